@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+""" Benchmark of the Gemfile parser on a large synthetic Gemfile.
+
+Compares the hand-written GemfileReader with the former lepl grammar (if
+lepl is installed), including the time needed to build the lepl grammar.
+
+    python3 bench/gemfile.py --gems 2000 --repeat 5
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.realpath(os.path.join(__file__, '..', '..'))
+sys.path.insert(0, ROOT)
+
+
+def gemfile(gems, seed=0):
+    rand = random.Random(seed)
+    lines = ["source 'https://rubygems.org'", "ruby '2.3.1'", '',
+             "rails_version = ENV['RAILS_VERSION'] ? "
+             "ENV['RAILS_VERSION'] : '~> 4.2.7'", '']
+    groups = [':development', ':test', ':production', ':assets']
+    indent = ''
+    for i in range(gems):
+        if i % 50 == 0:
+            if indent:
+                lines.append('end')
+                lines.append('')
+            indent = ''
+            if rand.random() < 0.5:
+                lines.append('group {} do'.format(
+                    ', '.join(rand.sample(groups, rand.randint(1, 2)))))
+                indent = '  '
+        line = "gem 'gem-{}'".format(i)
+        kind = rand.randint(0, 5)
+        if kind == 1:
+            line += ", '~> {}.{}'".format(rand.randint(0, 9),
+                                          rand.randint(0, 20))
+        elif kind == 2:
+            line += ", '>= 1.{}', '< 3'".format(rand.randint(0, 9))
+        elif kind == 3:
+            line += ', require: false'
+        elif kind == 4:
+            line += (", :require => 'gem{0}/base', "
+                     ":git => \"https://example.org/gem{0}.git\"").format(i)
+        elif kind == 5:
+            line += ', rails_version  # follow rails'
+        lines.append(indent + line)
+    if indent:
+        lines.append('end')
+    return '\n'.join(lines) + '\n'
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.monotonic()
+        result = func()
+        duration = time.monotonic() - start
+        best = duration if best is None else min(best, duration)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--gems', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    content = gemfile(args.gems)
+    print('Gemfile: {} gems, {} lines, {} bytes'.format(
+        args.gems, content.count('\n'), len(content)))
+
+    from debler.bundler.parser import parse_gemfile
+    duration, result = measure(lambda: parse_gemfile(content), args.repeat)
+    print('{:25} {:9.3f}s ({} statements)'.format(
+        'GemfileReader', duration, len(result)))
+
+    start = time.monotonic()
+    try:
+        from debler.bundler import lepl_grammar
+    except ImportError:
+        print('lepl is not installed, skipping the reference grammar')
+        return
+    print('{:25} {:9.3f}s'.format('lepl grammar import',
+                                  time.monotonic() - start))
+    lepl_duration, lepl_result = measure(
+        lambda: lepl_grammar.parser.parse(content), args.repeat)
+    print('{:25} {:9.3f}s ({} statements)'.format(
+        'lepl grammar', lepl_duration, len(lepl_result)))
+    print('speedup: {:.1f}x'.format(lepl_duration / duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+""" End-to-end benchmark of the build pipeline.
+
+Generates a synthetic corpus of gems and npm tarballs, registers them in an
+in-memory database and drives GemBuilder, YarnBuilder and AppBuilder over
+it. The external tools (dpkg-buildpackage, sbuild, dput, wget) are replaced
+by stubs, so only debler's own generation code is measured; no network,
+Debian toolchain or PostgreSQL is needed.
+
+    python3 bench/pipeline.py --gems 300 --npms 300 --apps 5
+"""
+import argparse
+from collections import namedtuple, OrderedDict
+from contextlib import redirect_stdout
+from datetime import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import tarfile
+from tempfile import TemporaryDirectory
+import time
+
+import yaml
+
+ROOT = os.path.realpath(os.path.join(__file__, '..', '..'))
+sys.path.insert(0, ROOT)
+
+
+STUBS = {
+    # dpkg-buildpackage -S|-b: derive the .changes name from the changelog
+    'dpkg-buildpackage': '''#!/bin/sh
+base=$(head -n 1 debian/changelog | sed -e 's/^\\([^ ]*\\) (\\([^)]*\\)).*/\\1_\\2/')
+case " $* " in
+  *" -S "*) touch "../${base}_source.changes" "../${base}.dsc" ;;
+  *) touch "../${base}_amd64.changes" ;;
+esac
+''',
+    'sbuild': '''#!/bin/sh
+for last; do :; done
+touch "$(basename "$last" .dsc)_amd64.changes"
+''',
+    'dput': '''#!/bin/sh
+test -f "$2"
+''',
+    # wget URL -O FILE: serve the file from the corpus directory
+    'wget': '''#!/bin/sh
+cp "$BENCH_CORPUS/$(basename "$1")" "$3"
+''',
+}
+
+
+Build = namedtuple('Build', 'id pkger pkg slot slot_id version '
+                            'version_config revision distribution')
+
+
+class BenchDatabase():
+    """ In-memory replacement for :py:class:`debler.db.Database` providing
+        the queries used by the builders and app integrators. """
+    def __init__(self, pkgers):
+        self.pkgers_config = pkgers
+        self.pkgers = {}
+        self.packages = OrderedDict()
+        self.slots = {}
+        self.versions = {}
+        self.builds = OrderedDict()
+
+    def get_pkger(self, name):
+        if name not in self.pkgers:
+            from importlib import import_module
+            pkger_id, cfg = self.pkgers_config[name]
+            cfg = dict(cfg)
+            impl = import_module(cfg.pop('module'))
+            self.pkgers[name] = impl.pkgerInfo(self, pkger_id, **cfg)
+        return self.pkgers[name]
+
+    def get_pkgers(self):
+        return {name: self.get_pkger(name) for name in self.pkgers_config}
+
+    def register_pkg(self, pkger_id, name, config):
+        self.packages[(pkger_id, name)] = {
+            'id': len(self.packages) + 1, 'config': config, 'slots': []}
+
+    def register_pkgs(self, pkger_id, names, config):
+        for name in names:
+            self.register_pkg(pkger_id, name, config)
+
+    def set_pkg_config(self, pkg_id, config):
+        pass
+
+    def pkg_info(self, pkger_id, name, deb_name):
+        from debler.db import PkgInfo, SlotInfo
+        try:
+            pkg = self.packages[(pkger_id, name)]
+        except KeyError:
+            raise ValueError('Pkg "{}" unknown in pkger {}'.format(
+                name, pkger_id))
+        info = PkgInfo(self, pkg['id'], name, deb_name, pkg['config'], [])
+        for slot_id in pkg['slots']:
+            version, metadata = self.slots[slot_id]
+            info.slots.append(SlotInfo(self, info, slot_id, version, {},
+                                       metadata))
+        return info
+
+    def pkg_infos(self, pkger_id, names, name2deb):
+        return {name: self.pkg_info(pkger_id, name, name2deb(name))
+                for name in names if (pkger_id, name) in self.packages}
+
+    def pkgs_fingerprint(self, pkger_id, names):
+        digest = hashlib.md5()
+        for name in sorted(names):
+            pkg = self.packages.get((pkger_id, name))
+            if pkg is None:
+                continue
+            digest.update(repr((name, pkg['config'], [
+                (self.slots[slot_id], self.versions.get(slot_id))
+                for slot_id in pkg['slots']])).encode('utf-8'))
+        return digest.hexdigest()
+
+    def create_pkg_slot(self, pkg, slot):
+        from debler.constraints import invalidate
+        from debler.db import SlotInfo
+        invalidate(pkg.id)
+        slot_id = len(self.slots) + 1
+        self.slots[slot_id] = (slot, {})
+        for data in self.packages.values():
+            if data['id'] == pkg.id:
+                data['slots'].append(slot_id)
+        return SlotInfo(self, pkg, slot_id, slot, {}, {})
+
+    def get_versions(self, slot):
+        from debler.db import VersionInfo
+        return [VersionInfo(self, slot, None, version, {}, {}, False)
+                for version in self.versions.get(slot.id, [])]
+
+    def slots_versions(self, slots):
+        return {slot.id: self.get_versions(slot) for slot in slots}
+
+    def schedule_build(self, slot, *, version, revision, changelog,
+                       distribution, extra={}, format=None):
+        self.versions.setdefault(slot.id, []).append(version)
+        pkger, name = next(key for key, data in self.packages.items()
+                           if data['id'] == slot.pkg.id)
+        pkger_name = next(n for n, (pkger_id, _) in self.pkgers_config.items()
+                          if pkger_id == pkger)
+        build_id = len(self.builds) + 1
+        self.builds[build_id] = Build(
+            build_id, pkger_name, name, str(slot.version), slot.id, version,
+            extra, version + '-' + str(revision), distribution)
+
+    def build_data(self, build_id):
+        return self.builds[build_id]
+
+    def changelog_entries(self, build_id):
+        build = self.builds[build_id]
+        yield (build.revision, datetime(2017, 1, 1),
+               'Import newly into debler', build.distribution)
+
+    def set_slot_metadata(self, slot_id, metadata):
+        self.slots[slot_id] = (self.slots[slot_id][0], metadata)
+
+    def update_slot_metadata(self, slot_id, metadata):
+        version, old = self.slots[slot_id]
+        self.slots[slot_id] = (version, dict(old, **metadata))
+
+
+def tarinfo(name, size=0, mode=0o644):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = mode
+    info.mtime = 1483228800
+    return info
+
+
+def add_file(tar, name, content, mode=0o644):
+    if type(content) is not bytes:
+        content = content.encode('utf-8')
+    tar.addfile(tarinfo(name, len(content), mode), io.BytesIO(content))
+
+
+def ruby_source(rng, lines):
+    return ''.join('  def method{0}(arg)\n    arg * {0}\n  end\n'.format(i)
+                   for i in range(rng.randint(1, lines)))
+
+
+class Corpus():
+    def __init__(self, directory, gems, npms, seed):
+        self.dir = directory
+        self.rng = random.Random(seed)
+        self.gems = OrderedDict()
+        self.npms = OrderedDict()
+        self.npm_deps = {}
+        for i in range(gems):
+            self.generate_gem('benchgem{}'.format(i))
+        for i in range(npms):
+            self.generate_npm('bench-npm{}'.format(i))
+
+    def version(self):
+        return '{}.{}.{}'.format(self.rng.randint(0, 5),
+                                 self.rng.randint(0, 12),
+                                 self.rng.randint(0, 20))
+
+    def pick_deps(self, known):
+        known = list(known.items())
+        count = min(len(known), self.rng.choice([0, 0, 1, 2, 3, 5]))
+        return self.rng.sample(known, count)
+
+    def generate_gem(self, name):
+        rng = self.rng
+        version = self.version()
+        native = rng.random() < 0.1
+        files = rng.choice([3, 10, 40, 150])
+        deps = []
+        for dep, dep_version in self.pick_deps(self.gems):
+            major, minor, _ = dep_version.split('.')
+            op, constraint = rng.choice([
+                ('~>', '{}.{}'.format(major, minor)),
+                ('>=', dep_version),
+                ('~>', dep_version),
+            ])
+            deps.append({
+                'name': dep,
+                'type': ':runtime',
+                'version_requirements': {
+                    'requirements': [[op, {'version': constraint}]]},
+            })
+        metadata = {
+            'name': name,
+            'version': {'version': version},
+            'summary': 'Synthetic gem {} for benchmarking'.format(name),
+            'description': 'Generated by bench/pipeline.py.\n\n' * 3,
+            'homepage': 'https://example.org/' + name,
+            'authors': ['Bench Mark'],
+            'email': ['bench@example.org'],
+            'licenses': ['MIT'],
+            'date': datetime(2017, 1, 1),
+            'require_paths': ['lib'],
+            'bindir': 'bin',
+            'extensions': ['ext/{}/extconf.rb'.format(name)] if native else [],
+            'dependencies': deps,
+        }
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w:gz') as datatar:
+            add_file(datatar, 'lib/{}.rb'.format(name),
+                     'module Bench\n{}end\n'.format(ruby_source(rng, 20)))
+            for i in range(files):
+                add_file(datatar, 'lib/{}/part{}.rb'.format(name, i),
+                         'module Bench\n{}end\n'.format(ruby_source(rng, 40)))
+            if rng.random() < 0.3:
+                add_file(datatar, 'bin/' + name, '#!/usr/bin/ruby\n', 0o755)
+            if native:
+                add_file(datatar, 'ext/{}/extconf.rb'.format(name),
+                         'require "mkmf"\ncreate_makefile("{}")\n'.format(
+                             name))
+                add_file(datatar, 'ext/{}/{}.c'.format(name, name),
+                         'void Init_{}(void) {{}}\n'.format(name))
+        with tarfile.open(os.path.join(self.dir, '{}-{}.gem'.format(
+                name, version)), 'w') as gem:
+            add_file(gem, 'metadata.gz',
+                     gzip.compress(yaml.dump(metadata).encode('utf-8')))
+            add_file(gem, 'data.tar.gz', data.getvalue())
+        self.gems[name] = version
+
+    def generate_npm(self, name):
+        rng = self.rng
+        version = self.version()
+        deps = {}
+        for dep, dep_version in self.pick_deps(self.npms):
+            deps[dep] = rng.choice(['^', '~', '>=', '']) + dep_version
+        package = {
+            'name': name,
+            'version': version,
+            'description': 'Synthetic npm package',
+            'main': 'index.js',
+            'license': 'MIT',
+            'dependencies': deps,
+        }
+        with tarfile.open(os.path.join(self.dir, '{}-{}.tgz'.format(
+                name, version)), 'w:gz') as tar:
+            add_file(tar, 'package/package.json', json.dumps(package))
+            add_file(tar, 'package/index.js', 'module.exports = {};\n')
+            for i in range(rng.choice([2, 10, 60])):
+                add_file(tar, 'package/lib/part{}.js'.format(i),
+                         'exports.f{0} = function (a) {{ return a * {0}; }};\n'
+                         .format(i) * rng.randint(1, 50))
+        self.npms[name] = version
+        self.npm_deps[name] = deps
+
+    def generate_app(self, basedir, name):
+        rng = self.rng
+        os.makedirs(os.path.join(basedir, 'app'))
+        with open(os.path.join(basedir, 'app', 'main.rb'), 'w') as f:
+            f.write(ruby_source(rng, 50))
+        gems = rng.sample(list(self.gems), min(len(self.gems), 30))
+        with open(os.path.join(basedir, 'Gemfile'), 'w') as f:
+            f.write("source 'https://rubygems.org'\n\n")
+            for gem in gems:
+                f.write("gem '{}', '>= 0'\n".format(gem))
+        with open(os.path.join(basedir, 'Gemfile.lock'), 'w') as f:
+            f.write('GEM\n  remote: https://rubygems.org/\n  specs:\n')
+            for gem, version in sorted(self.gems.items()):
+                f.write('    {} ({})\n'.format(gem, version))
+            f.write('\nPLATFORMS\n  ruby\n\nDEPENDENCIES\n')
+            for gem in sorted(gems):
+                f.write('  {} (>= 0)\n'.format(gem))
+        npms = rng.sample(list(self.npms), min(len(self.npms), 30))
+        with open(os.path.join(basedir, 'package.json'), 'w') as f:
+            json.dump({'name': name, 'version': '1.0.0', 'private': True,
+                       'dependencies': {npm: '^' + self.npms[npm]
+                                        for npm in npms}}, f)
+        with open(os.path.join(basedir, 'yarn.lock'), 'w') as f:
+            f.write('# THIS IS AN AUTOGENERATED FILE.\n'
+                    '# yarn lockfile v1\n')
+            specs = {npm: {'^' + version}
+                     for npm, version in self.npms.items()}
+            for deps in self.npm_deps.values():
+                for dep, constraint in deps.items():
+                    specs[dep].add(constraint)
+            for npm, version in sorted(self.npms.items()):
+                deps = self.npm_deps[npm]
+                f.write('\n\n{header}:\n  version "{version}"\n'
+                        '  resolved "https://registry.yarnpkg.com/{npm}/-/'
+                        '{npm}-{version}.tgz"\n'.format(
+                            header=', '.join(
+                                '"{}@{}"'.format(npm, spec)
+                                for spec in sorted(specs[npm])),
+                            npm=npm, version=version))
+                if deps:
+                    f.write('  dependencies:\n')
+                    for dep, constraint in sorted(deps.items()):
+                        f.write('    {} "{}"\n'.format(dep, constraint))
+
+
+def write_config(directory):
+    config = {
+        'database': 'dbname=unused',
+        'appdir': os.path.join(directory, 'apps'),
+        'gemdir': os.path.join(directory, 'gems'),
+        'npmdir': os.path.join(directory, 'npm'),
+        'keyid': 0xbe4c8,
+        'maintainer': 'Bench Mark <bench@example.org>',
+        'gem_format': '1.0',
+        'distribution': 'bench',
+        'package_uploads': {'gem': 'bench', 'app': 'bench', 'npm': 'bench'},
+    }
+    filename = os.path.join(directory, 'debler.yml')
+    with open(filename, 'w') as f:
+        yaml.dump(config, f)
+    return filename
+
+
+def write_stubs(directory):
+    os.makedirs(directory)
+    for name, content in STUBS.items():
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(content)
+        os.chmod(os.path.join(directory, name), 0o755)
+
+
+class Stats():
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.phases = OrderedDict()
+
+    def add(self, duration, timings):
+        self.count += 1
+        self.total += duration
+        for phase, value in timings.items():
+            self.phases.setdefault(phase, []).append(value)
+
+    def report(self, name):
+        if not self.count:
+            return
+        print('{}: {} packages in {:.2f}s, {:.1f} packages/s'.format(
+            name, self.count, self.total, self.count / self.total))
+        for phase, values in self.phases.items():
+            print('  {:25} total {:8.3f}s  mean {:8.2f}ms  max {:8.2f}ms'
+                  .format(phase, sum(values),
+                          sum(values) / len(values) * 1000,
+                          max(values) * 1000))
+
+
+def build(workdir, builder_factory, stats):
+    with TemporaryDirectory(dir=workdir) as d:
+        builder = builder_factory(d)
+        start = time.monotonic()
+        builder.generate()
+        builder.run()
+        builder.upload()
+        stats.add(time.monotonic() - start, builder.timings)
+    os.chdir(workdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--gems', type=int, default=200)
+    parser.add_argument('--npms', type=int, default=200)
+    parser.add_argument('--apps', type=int, default=3)
+    parser.add_argument('--rubies', default='2.3,2.4')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', metavar='DIR',
+                        help='work in DIR and keep the generated files')
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        workdir = os.path.realpath(args.keep or tmp)
+        os.environ['DEBLER_CONFIG'] = write_config(workdir)
+        os.environ['BENCH_CORPUS'] = os.path.join(workdir, 'corpus')
+        write_stubs(os.path.join(workdir, 'stubs'))
+        os.environ['PATH'] = os.path.join(workdir, 'stubs') + ':' + \
+            os.environ['PATH']
+        os.makedirs(os.environ['BENCH_CORPUS'])
+
+        from debler.app import AppInfo, AppBuilder
+
+        start = time.monotonic()
+        corpus = Corpus(os.environ['BENCH_CORPUS'],
+                        args.gems, args.npms, args.seed)
+        print('generated corpus of {} gems and {} npm packages in {:.2f}s'
+              .format(len(corpus.gems), len(corpus.npms),
+                      time.monotonic() - start))
+
+        db = BenchDatabase(OrderedDict([
+            ('bundler', (1, {'module': 'debler.bundler',
+                             'rubies': args.rubies.split(',')})),
+            ('yarn', (2, {'module': 'debler.yarn'})),
+        ]))
+        for pkger, packages in (('bundler', corpus.gems),
+                                ('yarn', corpus.npms)):
+            pkger = db.get_pkger(pkger)
+            for name, version in packages.items():
+                info = (pkger.gem_info if hasattr(pkger, 'gem_info')
+                        else pkger.pkg_info)(name, autocreate=True)
+                info.slot_for_version(version, create=True).create(
+                    version=version, revision=1,
+                    changelog='Import newly into debler',
+                    distribution='bench')
+
+        results = OrderedDict([('bundler', Stats()), ('yarn', Stats()),
+                               ('apps', Stats()), ('apps-cached', Stats())])
+        os.chdir(workdir)
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            for build_id, data in list(db.builds.items()):
+                pkger = db.get_pkger(data.pkger)
+                build(workdir,
+                      lambda d: pkger.builder(d, build_id),
+                      results[data.pkger])
+            apps = []
+            for i in range(args.apps):
+                name = 'benchapp{}'.format(i)
+                basedir = os.path.join(workdir, 'sources', name)
+                corpus.generate_app(basedir, name)
+                app = AppInfo(db, name, '1.0.{}'.format(i), basedir,
+                              homepage='https://example.org/' + name,
+                              description='Benchmark app\n\nGenerated',
+                              dirs=['app'],
+                              bundler={'bundler_laucher': True,
+                                       'default_env': 'production'},
+                              yarn={})
+                build(workdir, lambda d: AppBuilder(db, d, app),
+                      results['apps'])
+                apps.append(app)
+            # rebuild with unchanged dependencies: reuses debian/
+            for app in apps:
+                build(workdir, lambda d: AppBuilder(db, d, app),
+                      results['apps-cached'])
+
+        for name, stats in results.items():
+            stats.report(name)
+        os.chdir(ROOT)
+
+
+if __name__ == '__main__':
+    main()
@@ -43,10 +43,18 @@ def run(args):
                 db.claim_build(build_id)
             with TemporaryDirectory() as d:
                 builder = db.get_pkger(data[0]).builder(d, build_id)
-                builder.generate()
-                builder.run()
-                if not args.incognito:
-                    builder.upload()
+                try:
+                    builder.generate()
+                    builder.run()
+                    if not args.incognito:
+                        builder.upload()
+                finally:
+                    if not args.incognito:
+                        # must not replace the outcome of the build
+                        try:
+                            db.record_timings(build_id, builder.timings)
+                        except Exception:
+                            traceback.print_exc()
             if not args.incognito:
                 db.update_build(build_id, result='finished')
             header(task, color=32)
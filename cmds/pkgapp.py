@@ -1,39 +1,102 @@
+from concurrent.futures import ProcessPoolExecutor
 import functools
 import sys
 from tempfile import TemporaryDirectory
+import traceback
 
 from debler.app import AppInfo, AppBuilder
 from debler.builder import BuildFailError
 from debler.db import Database
 
+# connection of a build worker process, see build_in_worker
+worker_db = None
 
-def run(args):
-    db = Database()
-    app = AppInfo.fromyml(db, args.app_info)
-
-    if args.parse_only:
-        return
-
-    app.schedule_dep_builds()
-    if args.schedule_dep_builds_only:
-        scheduled_builds = db.scheduled_builds(all=True)
-        print('{} builds are scheduled'.format(
-            functools.reduce(lambda count, _: count + 1, scheduled_builds, 0)))
-        return
 
+def build(db, app, full):
     with TemporaryDirectory() as d:
-        builder = AppBuilder(db, d, app)
-        builder.generate()
+        builder = AppBuilder(db, d, app, full=full)
         try:
+            builder.generate()
             builder.run()
+            builder.upload()
         except BuildFailError:
-            sys.exit(5)
-        builder.upload()
+            return False
+        except Exception:
+            traceback.print_exc()
+            return False
+    return True
+
+
+def build_in_worker(app_info, full):
+    global worker_db
+    try:
+        if worker_db is None:
+            worker_db = Database(cache=True)
+        app = AppInfo.fromyml(worker_db, app_info)
+    except Exception:
+        traceback.print_exc()
+        return False
+    return build(worker_db, app, full)
+
+
+def schedule(apps, args, failed):
+    """ schedule the dependency builds; returns the apps to build """
+    # deps shared by several apps are only looked at once
+    scheduled = set()
+    ready = []
+    for app_info, app in apps:
+        try:
+            app.schedule_dep_builds(since=args.since,
+                                    incremental=args.incremental,
+                                    scheduled=scheduled)
+        except Exception:
+            traceback.print_exc()
+            failed.append(app.name)
+        else:
+            ready.append((app_info, app))
+    return ready
+
+
+def run(args):
+    if args.since and len(args.app_infos) > 1:
+        sys.exit('--since only works with a single app')
+    db = Database(cache=True)
+    # a broken app is reported at the end instead of aborting the run
+    failed = []
+    apps = []
+    for app_info in args.app_infos:
+        try:
+            apps.append((app_info, AppInfo.fromyml(db, app_info)))
+        except Exception:
+            traceback.print_exc()
+            failed.append(app_info)
+
+    if not args.parse_only:
+        apps = schedule(apps, args, failed)
+        if args.schedule_dep_builds_only:
+            scheduled_builds = db.scheduled_builds(all=True)
+            print('{} builds are scheduled'.format(functools.reduce(
+                lambda count, _: count + 1, scheduled_builds, 0)))
+        elif args.jobs > 1 and len(apps) > 1:
+            # builds chdir into their tmp dirs; use processes, not threads
+            with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                results = list(pool.map(build_in_worker,
+                                        [app_info for app_info, app in apps],
+                                        [args.full] * len(apps)))
+            failed.extend(app.name for (app_info, app), ok
+                          in zip(apps, results) if not ok)
+        else:
+            failed.extend(app.name for app_info, app in apps
+                          if not build(db, app, args.full))
+
+    if failed:
+        print('Failed to build {}'.format(', '.join(failed)))
+        sys.exit(5)
 
 
 def register(subparsers):
     parser = subparsers.add_parser('pkgapp')
-    parser.add_argument('app_info',
+    parser.add_argument('app_infos', nargs='+', metavar='app_info',
                         help='file to app info yml description file')
     parser.add_argument('--schedule-dep-builds-only', '-D',
                         action='store_true', default=False,
@@ -41,4 +104,20 @@ def register(subparsers):
     parser.add_argument('--parse-only', '-P',
                         action='store_true', default=False,
                         help='only parse and process dependencies')
+    parser.add_argument('--since', metavar='GEMFILE.LOCK', default=None,
+                        help='only schedule builds for gems added or changed '
+                             'compared to this older lock file')
+    parser.add_argument('--incremental', '-i',
+                        action='store_true', default=False,
+                        help='only schedule builds for gems changed since '
+                             'the last incremental run of this app')
+    parser.add_argument('--full', '-f',
+                        action='store_true', default=False,
+                        help='regenerate the debian directory even if the '
+                             'dependencies did not change')
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar='n',
+                        help='build up to n app packages in parallel; every '
+                             'worker process parses the app info files '
+                             'again with its own database connection and '
+                             'cache')
     parser.set_defaults(run=run)
@@ -1,21 +1,45 @@
+from collections import OrderedDict
 import functools
 import http.server
 import logging
+import queue
+import socketserver
 import sys
+import threading
+import time
 import traceback
 
 
 import debler.db
+from debler.metrics import REGISTRY, Counter, Gauge, Histogram
 
 log = logging.getLogger(__name__)
 
+# pause before reconnecting to the database
+RETRY_SECONDS = 10
+
+request_seconds = Histogram('debler_webhook_request_seconds',
+                            'Time to accept and enqueue a webhook', ['hook'])
+process_seconds = Histogram('debler_webhook_process_seconds',
+                            'Time to process a batch of accepted webhooks',
+                            ['hook', 'outcome'])
+queue_full = Counter('debler_webhook_queue_full_total',
+                     'Webhooks rejected with 503 as the work queue was full',
+                     ['hook'])
+
+
+class DeblerServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
 
 class DeblerHandler(http.server.BaseHTTPRequestHandler):
     server_version = 'debler/0.1'
 
-    def __init__(self, args, hooks, *pargs, **kwargs):
+    def __init__(self, args, hooks, jobs, *pargs, **kwargs):
         self.args = args
         self.hooks = hooks
+        self.jobs = jobs
         super().__init__(*pargs, **kwargs)
 
     def send_data(self, data, content_type='text/plain', response_code=200):
@@ -31,6 +55,14 @@ class DeblerHandler(http.server.BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(data)
 
+    def do_GET(self):
+        """ Handles GET request (metrics). """
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        self.send_data(REGISTRY.expose(),
+                       content_type='text/plain; version=0.0.4')
+
     def do_POST(self):
         """ Handles POST request (webhooks). """
         if not self.path.startswith('/debler/updatetrigger/'):
@@ -42,30 +74,164 @@ class DeblerHandler(http.server.BaseHTTPRequestHandler):
             self.send_error(404)
             return
 
+        with request_seconds.time(name):
+            self.handle_hook(name)
+
+    def handle_hook(self, name):
         try:
-            self.hooks[name].run(self)
+            job = self.hooks[name].accept(self)
         except Exception:
-            log.exception('Could not run hook')
+            log.exception('Could not accept hook')
             self.send_error(500)
+            return
+        if job is None:  # rejected, error already sent
+            return
+        try:
+            self.jobs.put_nowait((name, job))
+        except queue.Full:
+            log.warning('Work queue is full, rejecting %s hook', name)
+            queue_full.inc(name)
+            self.send_error(503)
+            return
+        self.send_data(b'OK')
 
     def log_message(self, format, *args):
         pass
 
 
-def run(args):
-    db = debler.db.Database()
-    pkgers = db.get_pkgers()
+def create_hooks(args, db):
     hooks = {}
-    for pkger in pkgers.values():
+    for pkger in db.get_pkgers().values():
         if not hasattr(pkger, 'webhook'):
             continue
         webhook = pkger.webhook(args.hook, args.hook_arg)
         for name in webhook.hook_names:
             hooks[name] = webhook
-    connectedHandler = functools.partial(DeblerHandler, args, hooks)
+    return hooks
+
+
+def load_pkg_names(hooks):
+    """ Connection listening for new packages; loads the known package
+        names of the hooks """
+    db = debler.db.Database()
+    # listen before loading the names to not miss any new package
+    db.listen(db.packages_channel)
+    names = {hook: db.pkg_names(hook.pkger.id) for hook in hooks}
+    for hook in hooks:
+        hook.known_names = names[hook]
+    return db
+
+
+def track_pkg_names(db, hooks):
+    """ Keep the known package names of the hooks up to date with the
+        notifications sent by register_pkg """
+    while True:
+        try:
+            for payload in db.notifications():
+                pkger_id, name = payload.split(':', 1)
+                for hook in hooks:
+                    if str(hook.pkger.id) == pkger_id:
+                        hook.known_names.add(name)
+        except Exception:
+            log.exception('Lost package notifications, reloading names')
+        # look names up in the database until they are reloaded
+        for hook in hooks:
+            hook.known_names = None
+        db = None
+        while db is None:
+            try:
+                db = load_pkg_names(hooks)
+            except Exception:
+                log.exception('Could not reload package names, retrying in '
+                              '%ss', RETRY_SECONDS)
+                time.sleep(RETRY_SECONDS)
+
+
+def next_batch(args, jobs, gathering):
+    """ The next job and all further jobs arriving within the coalescing
+        window. Only one worker gathers at a time, so a burst of
+        deliveries ends up in one batch. """
+    with gathering:
+        batch = [jobs.get()]
+        deadline = time.monotonic() + args.coalesce
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(jobs.get(timeout=timeout))
+            except queue.Empty:
+                break
+    return batch
+
+
+def connect_hooks(args):
+    """ hooks with a database connection of their own; retries until the
+        database is reachable """
+    while True:
+        try:
+            return create_hooks(args, debler.db.Database())
+        except Exception:
+            log.exception('Could not connect to the database, retrying in '
+                          '%ss', RETRY_SECONDS)
+            time.sleep(RETRY_SECONDS)
+
+
+def work(args, jobs, gathering):
+    """ Worker thread: processes accepted hooks with its own database
+        connection, so a slow hook only blocks this worker. """
+    hooks = connect_hooks(args)
+    while True:
+        batch = next_batch(args, jobs, gathering)
+        by_hook = OrderedDict()
+        for name, job in batch:
+            by_hook.setdefault(name, []).append(job)
+        for name, hook_jobs in by_hook.items():
+            start = time.monotonic()
+            try:
+                hooks[name].process_batch(hook_jobs)
+            except Exception:
+                process_seconds.observe(time.monotonic() - start,
+                                        name, 'error')
+                log.exception('Could not run hook')
+                if hooks[name].pkger.db.conn.closed:
+                    hooks = connect_hooks(args)
+            else:
+                process_seconds.observe(time.monotonic() - start,
+                                        name, 'ok')
+        for job in batch:
+            jobs.task_done()
+
+
+def run(args):
+    hooks = create_hooks(args, debler.db.Database())
+
+    tracked = [hook for hook in set(hooks.values())
+               if hasattr(hook, 'known_names')]
+    names_db = load_pkg_names(tracked)
+    threading.Thread(target=track_pkg_names, args=(names_db, tracked),
+                     name='pkg-names', daemon=True).start()
+
+    jobs = queue.Queue(maxsize=args.queue_size)
+    gathering = threading.Lock()
+    Gauge('debler_webhook_queue_depth', 'Accepted webhooks waiting for a '
+          'worker', callback=lambda: {(): jobs.qsize()})
+    metrics_db = debler.db.Database()
+    metrics_db_lock = threading.Lock()
+
+    def build_counts():
+        with metrics_db_lock:
+            counts = metrics_db.build_counts()
+        return {(state, ): count for state, count in counts.items()}
+    Gauge('debler_builds', 'Pending and building builds, slots whose '
+          'latest build failed', ['state'], callback=build_counts)
+
+    for i in range(args.workers):
+        threading.Thread(target=work, args=(args, jobs, gathering),
+                         name='worker{}'.format(i), daemon=True).start()
+    connectedHandler = functools.partial(DeblerHandler, args, hooks, jobs)
 
-    server = http.server.HTTPServer((args.host, args.port), connectedHandler)
-    server.allow_reuse_address = True
+    server = DeblerServer((args.host, args.port), connectedHandler)
     server.serve_forever()
 
 
@@ -80,5 +246,15 @@ def register(subparsers):
     parser.add_argument('--hook-arg', action='append', default=[],
                         help='Argument to hook script; python format is '
                              'called on each argument, with gem, slot, '
-                             'version keyword arguments')
+                             'version keyword arguments; repeated for '
+                             'every release of a coalesced batch')
+    parser.add_argument('--coalesce', type=float, default=0, metavar='s',
+                        help='gather hooks arriving within s seconds and '
+                             'schedule them together, running the hook '
+                             'script once per batch')
+    parser.add_argument('--workers', type=int, default=4, metavar='n',
+                        help='process accepted hooks in n threads')
+    parser.add_argument('--queue-size', type=int, default=100, metavar='n',
+                        help='answer with 503 while n accepted hooks are '
+                             'waiting for a worker')
     parser.set_defaults(run=run, native=None)
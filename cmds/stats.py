@@ -0,0 +1,36 @@
+from debler.db import Database
+
+
+def run(args):
+    db = Database()
+    percentiles = args.percentiles or [50, 90, 99]
+
+    print('{:45} {:>6} {}'.format(
+        args.by, 'count',
+        ' '.join('{:>9}'.format('p{:g}'.format(p)) for p in percentiles)))
+    for *keys, phase, count, values in db.timing_stats(
+            by=args.by, percentiles=[p / 100 for p in percentiles],
+            pkgs=args.pkgs, days=args.days):
+        print('{:45} {:>6} {}'.format(
+            ':'.join(keys + [phase]), count,
+            ' '.join('{:9.2f}'.format(v) for v in values)))
+
+
+def register(subparsers):
+    parser = subparsers.add_parser('stats')
+    parser.add_argument('--by', choices=['phase', 'packager', 'package'],
+                        default='phase',
+                        help='group build timings by phase (default), '
+                             'by packager and phase or by package and phase; '
+                             'a nested phase outer.inner is already '
+                             'included in outer')
+    parser.add_argument('--percentile', '-p', dest='percentiles',
+                        action='append', type=float, metavar='P',
+                        help='report the P-th percentile (default: 50, 90 '
+                             'and 99)')
+    parser.add_argument('--days', '-d', type=int, default=None,
+                        help='only include builds of the last n days',
+                        metavar='n')
+    parser.add_argument('pkgs', nargs='*', metavar='PACKAGENAME',
+                        help='limit the statistics to these packages')
+    parser.set_defaults(run=run, percentiles=None)
@@ -0,0 +1,108 @@
+import queue
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from cmds import serve
+
+
+class FakeRequest():
+    def __init__(self, hooks, jobs):
+        self.hooks = hooks
+        self.jobs = jobs
+        self.responses = []
+
+    def send_error(self, code):
+        self.responses.append(code)
+
+    def send_data(self, data):
+        self.responses.append(200)
+
+
+class FakeHook():
+    def __init__(self):
+        self.pkger = SimpleNamespace(db=SimpleNamespace(
+            conn=SimpleNamespace(closed=0)))
+        self.batches = []
+        self.processed = threading.Event()
+
+    def accept(self, request):
+        return {'name': 'rails', 'version': '5.2.1'}
+
+    def process_batch(self, jobs):
+        self.batches.append(jobs)
+        self.processed.set()
+
+
+def test_full_queue_is_rejected():
+    hook = FakeHook()
+    jobs = queue.Queue(maxsize=1)
+    first = FakeRequest({'gem': hook}, jobs)
+    serve.DeblerHandler.handle_hook(first, 'gem')
+    second = FakeRequest({'gem': hook}, jobs)
+    serve.DeblerHandler.handle_hook(second, 'gem')
+
+    assert first.responses == [200]
+    assert second.responses == [503]
+    # accepted only; processing is left to the workers
+    assert hook.batches == []
+    assert jobs.get_nowait() == ('gem', {'name': 'rails',
+                                         'version': '5.2.1'})
+
+
+def test_worker_retries_database_connection(monkeypatch):
+    hook = FakeHook()
+    attempts = []
+
+    def create_hooks(args, db):
+        attempts.append(db)
+        if len(attempts) == 1:
+            raise OSError('database is down')
+        return {'gem': hook}
+    monkeypatch.setattr(serve, 'create_hooks', create_hooks)
+    monkeypatch.setattr(serve.debler.db, 'Database', lambda: None)
+    monkeypatch.setattr(serve.time, 'sleep', lambda seconds: None)
+
+    jobs = queue.Queue(maxsize=1)
+    jobs.put(('gem', {'name': 'rails', 'version': '5.2.1'}))
+    threading.Thread(target=serve.work,
+                     args=(SimpleNamespace(coalesce=0), jobs,
+                           threading.Lock()),
+                     daemon=True).start()
+    assert hook.processed.wait(5)
+    jobs.join()
+    assert len(attempts) == 2
+    assert hook.batches == [[{'name': 'rails', 'version': '5.2.1'}]]
+    assert 'debler_webhook_process_seconds_count{hook="gem",outcome="ok"}' \
+        in ''.join(serve.process_seconds.expose())
+
+
+class Stop(BaseException):
+    pass
+
+
+class FakeNamesDb():
+    def __init__(self, payloads, error):
+        self.payloads = payloads
+        self.error = error
+
+    def notifications(self):
+        yield from self.payloads
+        raise self.error
+
+
+def test_package_names_are_reloaded_after_errors(monkeypatch):
+    hook = SimpleNamespace(pkger=SimpleNamespace(id=1), known_names={'a'})
+    reloaded = FakeNamesDb(['1:c'], Stop())
+
+    def load_pkg_names(hooks):
+        assert hook.known_names is None
+        hook.known_names = {'a', 'b'}
+        return reloaded
+    monkeypatch.setattr(serve, 'load_pkg_names', load_pkg_names)
+
+    lost = FakeNamesDb(['1:b', '2:x'], OSError('connection lost'))
+    with pytest.raises(Stop):
+        serve.track_pkg_names(lost, [hook])
+    assert hook.known_names == {'a', 'b', 'c'}
@@ -0,0 +1,7 @@
+CREATE TABLE timings (
+  revision_id integer NOT NULL REFERENCES revisions(id) ON DELETE CASCADE ON UPDATE CASCADE,
+  phase varchar(30) NOT NULL,
+  duration double precision NOT NULL,
+  recorded_at timestamptz NOT NULL,
+  PRIMARY KEY (revision_id, phase)
+);
@@ -0,0 +1,2 @@
+CREATE INDEX revisions_unfinished ON revisions (id) WHERE result IS NULL;
+CREATE INDEX revisions_failed ON revisions (version_id) WHERE result = 'failed';
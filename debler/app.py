@@ -1,8 +1,14 @@
 import yaml
 from datetime import datetime
+from functools import lru_cache
+from glob import glob
+import hashlib
+import json
 import os
 import os.path
+import shutil
 import subprocess
+import tarfile
 
 from debian.changelog import Changelog
 from dateutil.tz import tzlocal
@@ -30,6 +36,7 @@ class AppInfo():
         self.description = description
         self.dirs = dirs
         self.files = files
+        self.pkgers_config = pkgers
         self.pkgers = []
 
         for pkger, cfg in pkgers.items():
@@ -42,9 +49,26 @@ class AppInfo():
             data['basedir'] = os.path.dirname(os.path.realpath(filename))
         return cls(db, **data)
 
-    def schedule_dep_builds(self):
+    def schedule_dep_builds(self, **kwargs):
         for pkger in self.pkgers:
-            pkger.schedule_dep_builds()
+            pkger.schedule_dep_builds(**kwargs)
+
+
+@lru_cache()
+def debler_fingerprint():
+    """ digest over the debler sources generating the packages """
+    digest = hashlib.sha256()
+    root = os.path.dirname(os.path.abspath(__file__))
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith('.py') or filename.startswith('test_'):
+                continue
+            path = os.path.join(dirpath, filename)
+            digest.update(os.path.relpath(path, root).encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
 
 
 class BasePackagerAppInfo():
@@ -55,9 +79,20 @@ class BasePackagerAppInfo():
     def appIntegrator(self, builder):
         return self.pkger.appIntegrator(self, builder)
 
+    def source_paths(self):
+        """ paths of the app tree installed by the integrator """
+        return []
+
 
 class AppBuilder(BaseBuilder):
-    def __init__(self, db, tmp_dir, app):
+    """ Builds the app package. The generated debian/ directory is kept in
+        a persistent workspace and reused as long as the fingerprint over
+        the app config, the packager inputs and debler itself matches;
+        only the changelog is bumped then. The workspace is only updated
+        after a successful upload. """
+    def __init__(self, db, tmp_dir, app, *, full=False):
+        super().__init__()
+        self.full = full
         self.db = db
         self.tmp_dir = tmp_dir
         self.app = app
@@ -78,17 +113,96 @@ class AppBuilder(BaseBuilder):
     def slot_dir(self):
         return self.tmp_dir
 
+    @property
+    def workspace(self):
+        return os.path.join(config.appdir, self.app.name, 'workspace')
+
+    @property
+    def pending_workspace(self):
+        """ output of this build, moved into the workspace by upload() """
+        return os.path.join(self.tmp_dir, 'workspace')
+
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        digest.update(json.dumps([
+            self.app.name, self.app.homepage, self.app.description,
+            self.app.dirs, self.app.files, self.app.pkgers_config,
+            config.maintainer, config.distribution, debler_fingerprint(),
+        ], sort_keys=True).encode('utf-8'))
+        for pkger in self.app.pkgers:
+            digest.update(pkger.fingerprint().encode('utf-8'))
+        return digest.hexdigest()
+
+    def gen_debian_package(self):
+        debian = os.path.join(self.pkg_dir, 'debian')
+        cached_debian = os.path.join(self.workspace, 'debian')
+        state_file = os.path.join(self.workspace, 'state.json')
+        fingerprint = self.fingerprint()
+        state = {}
+        if os.path.isfile(state_file) and os.path.isdir(cached_debian):
+            with open(state_file) as f:
+                state = json.load(f)
+        pending = self.pending_workspace
+        os.makedirs(pending, exist_ok=True)
+        if not self.full and state.get('fingerprint') == fingerprint:
+            # only the app sources changed: reuse the generated output
+            os.makedirs(debian, exist_ok=True)
+            subprocess.check_call(['cp', '-a', cached_debian + '/.', debian])
+            self.fast_build = state['fast_build']
+            self.changelog_change = 'Rebuild with updated app sources'
+            self.generate_changelog_file()
+            # the next run has to continue the changelog
+            shutil.copy(self.debian_file('changelog'),
+                        os.path.join(pending, 'changelog'))
+        else:
+            if os.path.isfile(os.path.join(cached_debian, 'changelog')):
+                os.makedirs(debian, exist_ok=True)
+                shutil.copy(os.path.join(cached_debian, 'changelog'),
+                            self.debian_file('changelog'))
+            self.changelog_change = 'Rebuild with updated dependencies'
+            super().gen_debian_package()
+            # copy before the build adds its files to debian/
+            shutil.copytree(debian, os.path.join(pending, 'debian'),
+                            symlinks=True)
+            with open(os.path.join(pending, 'state.json'), 'w') as f:
+                json.dump({'fingerprint': fingerprint,
+                           'fast_build': self.fast_build}, f)
+
+    def upload(self):
+        super().upload()
+        # a failed build must not use up a debian revision
+        self.save_workspace()
+
+    def save_workspace(self):
+        pending = self.pending_workspace
+        cached_debian = os.path.join(self.workspace, 'debian')
+        if os.path.isdir(os.path.join(pending, 'debian')):
+            os.makedirs(self.workspace, exist_ok=True)
+            if os.path.isdir(cached_debian):
+                shutil.rmtree(cached_debian)
+            shutil.move(os.path.join(pending, 'debian'), cached_debian)
+            shutil.move(os.path.join(pending, 'state.json'),
+                        os.path.join(self.workspace, 'state.json'))
+        else:
+            shutil.copy(os.path.join(pending, 'changelog'),
+                        os.path.join(cached_debian, 'changelog'))
+
     def generate_changelog_file(self):
         changelog = self.debian_file('changelog')
+        upstream_version = '.'.join([str(v) for v in self.app.version])
         if os.path.isfile(changelog):
             changes = Changelog(file=open(changelog, 'r'))
             deb_version = changes.get_version()
-            deb_version.debian_revision = str(
-                int(deb_version.debian_revision) + 1)
-            change = 'Rebuild with newer debler'
+            if deb_version.upstream_version == upstream_version:
+                deb_version.debian_revision = str(
+                    int(deb_version.debian_revision) + 1)
+                change = self.changelog_change
+            else:
+                deb_version = upstream_version + '-1'
+                change = 'Update to version {}'.format(upstream_version)
         else:
             changes = Changelog()
-            deb_version = '.'.join([str(v) for v in self.app.version]) + '-1'
+            deb_version = upstream_version + '-1'
             change = 'Build with debler'
         changes.new_block(package=self.deb_name, version=deb_version,
                           distributions=config.distribution, urgency='low',
@@ -140,23 +254,111 @@ class AppBuilder(BaseBuilder):
         return os.path.join(self.slot_dir, '{}_{}.orig.tar.xz'.format(
             self.deb_name, '.'.join(str(v) for v in self.app.version)))
 
+    @property
+    def orig_paths(self):
+        """ paths of the app tree that end up in the packages """
+        paths = list(self.app.dirs) + list(self.app.files)
+        for pkger in self.app.pkgers:
+            paths.extend(pkger.source_paths())
+        return sorted({os.path.normpath(path) for path in paths}) or ['.']
+
+    @property
+    def is_git(self):
+        return os.path.isfile(os.path.join(self.app.basedir, '.git', 'HEAD'))
+
+    def orig_members(self):
+        """ relative names of all dirs and files below orig_paths, sorted """
+        for path in self.orig_paths:
+            full = os.path.join(self.app.basedir, path)
+            if not os.path.isdir(full) or os.path.islink(full):
+                yield path
+                continue
+            for dirpath, dirnames, filenames in os.walk(full):
+                dirnames.sort()
+                yield os.path.normpath(
+                    os.path.relpath(dirpath, self.app.basedir))
+                for filename in sorted(filenames):
+                    yield os.path.relpath(os.path.join(dirpath, filename),
+                                          self.app.basedir)
+
+    def orig_tar_key(self):
+        digest = hashlib.sha256()
+        digest.update(json.dumps(self.orig_paths).encode('utf-8'))
+        if self.is_git:
+            # object ids of the committed trees
+            revs = ['HEAD:' + (path if path != '.' else '')
+                    for path in self.orig_paths]
+            digest.update(subprocess.check_output(
+                ['git', 'rev-parse'] + revs, cwd=self.app.basedir))
+            return 'git-' + digest.hexdigest()
+        for name in self.orig_members():
+            full = os.path.join(self.app.basedir, name)
+            digest.update(name.encode('utf-8') + b'\0')
+            if os.path.islink(full):
+                digest.update(os.readlink(full).encode('utf-8'))
+            elif os.path.isfile(full):
+                digest.update(b'x' if os.access(full, os.X_OK) else b'-')
+                with open(full, 'rb') as f:
+                    digest.update(f.read())
+        return 'files-' + digest.hexdigest()
+
+    def write_orig_tar(self, fileobj):
+        """ deterministic tar stream: sorted, without owners and mtimes """
+        with tarfile.open(fileobj=fileobj, mode='w|',
+                          format=tarfile.GNU_FORMAT) as tar:
+            for name in self.orig_members():
+                full = os.path.join(self.app.basedir, name)
+                info = tar.gettarinfo(full, arcname=name)
+                info.mtime = 0
+                info.uid = info.gid = 0
+                info.uname = info.gname = 'root'
+                if info.isreg():
+                    info.mode = 0o755 if info.mode & 0o100 else 0o644
+                    with open(full, 'rb') as f:
+                        tar.addfile(info, f)
+                else:
+                    if info.isdir():
+                        info.mode = 0o755
+                    tar.addfile(info)
+
+    @property
+    def orig_cache_dir(self):
+        return os.path.join(config.appdir, self.app.name, 'orig')
+
     def build_orig_tar(self):
         if os.path.isfile(self.orig_tar):
             return
-        if os.path.isfile(os.path.join('.git', 'HEAD')):
-            git_archive = subprocess.Popen(['git', 'archive',
-                                            '--format=tar', 'HEAD'],
-                                           stdout=subprocess.PIPE)
-            with open(self.orig_tar, 'w') as f:
-                xz = subprocess.Popen(['xz', '-9'], stdin=git_archive.stdout,
-                                      stdout=f)
-                git_archive.stdout.close()
-                xz.wait()
-                assert xz.returncode == 0
+        cached = os.path.join(self.orig_cache_dir,
+                              self.orig_tar_key() + '.tar.xz')
+        if not os.path.isfile(cached):
+            os.makedirs(self.orig_cache_dir, exist_ok=True)
+            xz_cmd = ['xz', '-T0', '-9']
+            with open(cached + '.tmp', 'wb') as f:
+                xz = subprocess.Popen(xz_cmd, stdin=subprocess.PIPE, stdout=f)
+                try:
+                    if self.is_git:
+                        subprocess.check_call(
+                            ['git', 'archive', '--format=tar', 'HEAD',
+                             '--'] + self.orig_paths,
+                            cwd=self.app.basedir, stdout=xz.stdin)
+                    else:
+                        self.write_orig_tar(xz.stdin)
+                    xz.stdin.close()
+                    if xz.wait():
+                        raise subprocess.CalledProcessError(xz.returncode,
+                                                            xz_cmd)
+                except BaseException:
+                    # never let a partial tarball into the cache
+                    xz.kill()
+                    xz.wait()
+                    os.unlink(cached + '.tmp')
+                    raise
+            os.rename(cached + '.tmp', cached)
+            # only keep the most recent trees
+            tars = sorted(glob(os.path.join(self.orig_cache_dir, '*.tar.xz')),
+                          key=os.path.getmtime)
+            for tar in tars[:-5]:
+                os.remove(tar)
         else:
-            subprocess.check_call([
-                'tar', '--create',
-                '--directory', self.app.basedir,
-                '--xz',
-                '--file', self.orig_tar,
-                '.'])
+            os.utime(cached)
+        os.symlink(cached, self.orig_tar)
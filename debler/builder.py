@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
 import logging
 import os
 import subprocess
+import time
 
 from debian.deb822 import Deb822, Dsc
 
@@ -33,9 +35,33 @@ log = logging.getLogger(__file__)
 
 
 class BaseBuilder():
+    def __init__(self):
+        self.timings = OrderedDict()
+        self.current_phase = None
+
+    @contextmanager
+    def timed(self, phase):
+        """ Measure the wall time of a build phase; the duration (in
+            seconds) is stored in :py:attr:`timings` even if the phase
+            fails. A phase timed within another one is recorded as
+            ``outer.inner`` as its time is already part of the outer
+            phase. """
+        outer = self.current_phase
+        if outer is not None:
+            phase = '{}.{}'.format(outer, phase)
+        self.current_phase = phase
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[phase] = time.monotonic() - start
+            self.current_phase = outer
+
     @staticmethod
     def npm2deb(name):
-        return 'debler-yarn-' + name.lower().replace('_', '--')
+        # scoped packages: @scope/name -> scope+name
+        return 'debler-yarn-' + name.lower().lstrip('@') \
+            .replace('/', '+').replace('_', '--')
 
     def debian_file(self, arg, *extra_args):
         return os.path.join(self.pkg_dir, 'debian', arg, *extra_args)
@@ -224,16 +250,22 @@ Licence: See LICENCE file
         return os.path.join(self.tmp_dir, changes)
 
     def generate(self):
-        self.build_orig_tar()
-        self.extract_orig_tar()
-        self.gen_debian_package()
-        self.create_source_package()
+        with self.timed('build_orig_tar'):
+            self.build_orig_tar()
+        with self.timed('extract_orig_tar'):
+            self.extract_orig_tar()
+        with self.timed('gen_debian_package'):
+            self.gen_debian_package()
+        with self.timed('create_source_package'):
+            self.create_source_package()
 
     def run(self):
         if self.fast_build:
-            self.build_native()
+            with self.timed('build_native'):
+                self.build_native()
         else:
-            self.build_with_sbuild()
+            with self.timed('sbuild'):
+                self.build_with_sbuild()
 
     def build_with_sbuild(self):
         os.chdir(self.slot_dir)
@@ -261,6 +293,10 @@ Licence: See LICENCE file
                                ])
 
     def upload(self):
+        with self.timed('upload'):
+            self.upload_changes()
+
+    def upload_changes(self):
         subprocess.check_call(['dput',
                                self.package_upload,
                                self.changes_path('source')])
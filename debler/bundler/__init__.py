@@ -15,11 +15,13 @@ class BundlerPackager(Packager):
 
     def __init__(self, *args, rubies,
                  rubygems='https://rubygems.org',
-                 rubygems_apikey=None):
+                 rubygems_apikey=None,
+                 ccache=None):
         super().__init__(*args)
         self.rubies = rubies
         self.rubygems = rubygems
         self.rubygems_apikey = rubygems_apikey
+        self.ccache = ccache
 
     def gem_info(self, name, autocreate=False):
         try:
@@ -1,19 +1,22 @@
+import hashlib
 import os.path
+import shutil
 
 from ..app import BasePackagerAppInfo
 from debler import config
-from ..db import Version
+from ..db import parse_version
 from .parser import Parser as GemfileParser
 
 
 class BundlerAppInfo(BasePackagerAppInfo):
     def __init__(self, pkger, app, *,
                  subdir='.',
-                 gemfile,
+                 gemfile, lockfile=None,
                  bundler_laucher=False,
                  default_env=None, ignore_gems=[]):
         super().__init__(pkger, app)
         self.gemfile = gemfile
+        self.lockfile = lockfile
         self.bundler_laucher = bundler_laucher
         self.default_env = default_env
 
@@ -26,15 +29,44 @@ class BundlerAppInfo(BasePackagerAppInfo):
               bundler_laucher=False,
               default_env=None, ignore_gems=[]):
         basedir = os.path.realpath(os.path.join(app.basedir, subdir))
-        gemfile = GemfileParser(os.path.join(basedir, 'Gemfile'), ignore_gems)
+        gemfile = GemfileParser.cached(
+            os.path.join(basedir, 'Gemfile'), ignore_gems,
+            cachedir=os.path.join(config.appdir, 'parse-cache', 'bundler'))
         return cls(pkger, app,
                    subdir=subdir,
                    gemfile=gemfile,
+                   lockfile=os.path.join(basedir, 'Gemfile.lock'),
                    bundler_laucher=bundler_laucher,
                    default_env=default_env)
 
-    def schedule_dep_builds(self):
+    @property
+    def remembered_lockfile(self):
+        return os.path.join(config.appdir, self.app.name, 'Gemfile.lock')
+
+    def changed_gems(self, since):
+        """ gems added or changed (version or git source) compared to the
+        given older Gemfile.lock """
+        old = GemfileParser.fromlock(since).gems
         for name, gem in self.gems.items():
+            if not gem.version:
+                continue
+            prev = old.get(name)
+            if prev is not None and str(prev.version) == str(gem.version) \
+                    and prev.revision == gem.revision \
+                    and prev.remote == gem.remote:
+                continue
+            yield name, gem
+
+    def schedule_dep_builds(self, *, since=None, incremental=False,
+                            scheduled=None):
+        if incremental and since is None \
+                and os.path.isfile(self.remembered_lockfile):
+            since = self.remembered_lockfile
+        if since is not None:
+            gems = self.changed_gems(since)
+        else:
+            gems = self.gems.items()
+        for name, gem in gems:
             if not gem.version:
                 continue
             info = self.pkger.gem_info(name, autocreate=True)
@@ -48,6 +80,11 @@ class BundlerAppInfo(BasePackagerAppInfo):
             else:
                 extra = {}
                 ourversion = str(gem.version)
+            if scheduled is not None:
+                # already handled for another app of this run
+                if (slot.id, ourversion) in scheduled:
+                    continue
+                scheduled.add((slot.id, ourversion))
             versions = slot.versions()
             if gem.revision:
                 for version in versions:
@@ -65,12 +102,33 @@ class BundlerAppInfo(BasePackagerAppInfo):
                     changelog='Import newly into debler',
                     distribution=config.distribution,
                     extra=extra)
-            elif Version(ourversion) > versions[-1].version:
+            elif parse_version(ourversion) > versions[-1].version:
                 slot.create(
                     version=ourversion, revision=1,
                     changelog='Update to version used in application',
                     distribution=config.distribution,
                     extra=extra)
+        if incremental and self.lockfile:
+            os.makedirs(os.path.dirname(self.remembered_lockfile),
+                        exist_ok=True)
+            shutil.copyfile(self.lockfile, self.remembered_lockfile)
+
+    def fingerprint(self):
+        """ digest over everything the app integration depends on """
+        digest = hashlib.sha256()
+        basedir = os.path.dirname(self.lockfile)
+        for filename in ('Gemfile', 'Gemfile.lock'):
+            with open(os.path.join(basedir, filename), 'rb') as f:
+                digest.update(f.read())
+        digest.update(repr((self.bundler_laucher, self.default_env,
+                            self.pkger.rubies)).encode('utf-8'))
+        digest.update(self.pkger.db.pkgs_fingerprint(
+            self.pkger.id, self.gems).encode('utf-8'))
+        return digest.hexdigest()
+
+    def source_paths(self):
+        return [gem.path for gem in self.gems.values()
+                if not gem.version and gem.path]
 
     @property
     def gems(self):
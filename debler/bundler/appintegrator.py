@@ -1,3 +1,4 @@
+from collections import OrderedDict
 import os.path
 
 from ..builder import Package, Dependency, \
@@ -15,11 +16,20 @@ class BundlerAppIntegrator():
         self.binaries = []
         self.natives = []
         self.load_paths = {'all': (self.builder.deb_name, [])}
+        # feature -> absolute file, resolved in $LOAD_PATH order
+        self.require_index = OrderedDict()
 
     @staticmethod
     def gemnam2deb(name):
         return 'debler-rubygem-' + name.lower().replace('_', '--')
 
+    @staticmethod
+    def ruby_str(value):
+        return "'{}'".format(value.replace('\\', '\\\\').replace("'", "\\'"))
+
+    def resolve(self, feature):
+        return self.require_index.get(feature, feature)
+
     @property
     def rubies(self):
         for ruby in self.pkger.rubies:
@@ -49,6 +59,11 @@ class BundlerAppIntegrator():
                 self.load_paths['all'][1].append(
                     '/usr/share/rubygems-debler/{name}/{}/'.format(
                         path, name=gem_slot_name))
+            for feature, path in sorted(
+                    slot.metadata.get('features', {}).items()):
+                self.require_index.setdefault(
+                    feature, '/usr/share/rubygems-debler/{}/{}'.format(
+                        gem_slot_name, path))
             for binary in slot.metadata.get('binaries', []):
                 self.binaries.append((binary.split('/', 1)[1],
                                       os.path.join(
@@ -137,6 +152,12 @@ class BundlerAppIntegrator():
 
         if self.app.bundler_laucher:
             for deb, ruby in self.rubies:
+                # native load paths are inlined into the launcher
+                yield RuleAction('build', [
+                    'sed',
+                    '--in-place',
+                    '--expression=s:/ARCH/:/${DEB_BUILD_MULTIARCH}/:',
+                    'debian/bin/{}{}'.format(self.app.name, ruby)])
                 yield InstallContent(
                     deb,
                     name='bin/' + self.app.name + ruby,
@@ -148,11 +169,26 @@ ENV['HOME'] = '/tmp'  # will be fixed later
 ENV['RAILS_ENV'] ||= '{default_env}'
 ENV['GEM_PATH'] = '/usr/share/{name}/.debler/gems'
 $LOAD_PATH << '/usr/share/{name}/.debler/lib'
-File.readlines("/usr/share/{name}/.debler/load_paths/all").each do |dir|
-  $LOAD_PATH << dir.strip
-end
-File.readlines("/usr/share/{name}/.debler/load_paths/{ruby}.0").each do |dir|
-  $LOAD_PATH << dir.strip
+$LOAD_PATH.concat [
+{load_paths}
+]
+load "/usr/share/{name}/.debler/require_index.rb"
+module Kernel
+  alias_method :debler_require, :require
+  # resolve known features with one lookup instead of scanning $LOAD_PATH,
+  # unless a file within the load paths of the app shadows the feature
+  def require(feature)
+    name = feature.to_s.chomp('.rb')
+    path = DEBLER_REQUIRE_INDEX[name]
+    if path.nil? || $LOAD_PATH.any? {{ |dir|
+        dir = File.expand_path(dir.to_s)
+        dir.start_with?('/usr/share/{name}/') &&
+          File.file?(File.join(dir, name + '.rb')) }}
+      return debler_require(feature)
+    end
+    debler_require(path)
+  end
+  private :require
 end
 require "bundler"
 exe = ARGF.argv.shift
@@ -173,6 +209,10 @@ end
                         ruby=ruby,
                         name=self.app.name,
                         default_env=self.app.default_env,
+                        load_paths='\n'.join(
+                            '  {},'.format(self.ruby_str(path))
+                            for version in ('all', ruby + '.0')
+                            for path in self.load_paths[version][1]),
                         binaries='\n'.join([
                             '''    '{}' => ["{}", ["{}"]],'''.format(
                                 exe, path, '", "'.join(requires))
@@ -222,6 +262,16 @@ esac
 exit 0
 '''.format(app=self.app.name, ruby=ruby))
 
+            yield InstallContent(
+                self.builder.deb_name,
+                name='data/require_index.rb',
+                dest='/usr/share/{}/.debler/'.format(self.app.name),
+                mode=0o644,
+                content='DEBLER_REQUIRE_INDEX = {{\n{}}}.freeze\n'.format(
+                    ''.join('  {} => {},\n'.format(
+                        self.ruby_str(feature), self.ruby_str(path))
+                        for feature, path in self.require_index.items())))
+
             yield InstallInto(self.builder.deb_name,
                               os.path.join('debian', 'lib'),
                               '/usr/share/{}/.debler'.format(self.app.name))
@@ -232,28 +282,47 @@ exit 0
                 content='require "bundler"\n',
             )
 
+            requires = list(self.bundler_requires())
+            groups = {env for gem in self.app.gemfile.gems.values()
+                      for env in gem.envs}
+            if self.app.default_env:
+                groups.add(self.app.default_env)
+            groups = sorted(groups - {'default'})
+            scripts = [('default', [])] + [(env, [env]) for env in groups]
+            for script, script_groups in scripts:
+                yield DebianContent(
+                    name='lib/bundler/require/{}.rb'.format(script),
+                    mode=0o644,
+                    content=''.join(
+                        'Kernel.require "{}"\n'.format(require)
+                        for require, envs in requires
+                        if envs is None or set(envs) & set(script_groups)))
+
             bundler_content = '''class Bundler
+  REQUIRE_SCRIPTS = {{
+{scripts}
+  }}.freeze
+
   def self.require(*groups)
     groups = groups.map(&:to_s)
-'''
-            for name in self.app.gemfile.required_gems:
-                gem = self.app.gemfile.gems[name]
-                if not gem.require:
-                    continue
-                if gem.require is not True:  # specific require!
-                    bundler_content += '    Kernel.require "{}"\n'.format(
-                        gem.require)
-                    continue
-                for require in self.gem_metadatas.get(
-                        name, {'require': [name.replace('-', '/')]}) \
-                        .get('require', []) or [name.replace('-', '/')]:
-                    if 'default' in gem.envs:
-                        bundler_content += '    Kernel.require "{}"\n' \
-                            .format(require)
-                    else:
-                        bundler_content += '    Kernel.require "{}"' \
-                            ' unless (groups & ["{}"]).empty?\n'.format(
-                                require, '", "'.join(gem.envs))
+    script = REQUIRE_SCRIPTS[(groups - ["default"]).uniq.sort]
+    if script
+      return Kernel.require(File.join(__dir__, "bundler", "require", script))
+    end
+'''.format(scripts='\n'.join(
+                '    {} => "{}",'.format(
+                    '[{}]'.format(', '.join(
+                        '"{}"'.format(group) for group in script_groups)),
+                    script)
+                for script, script_groups in scripts))
+            for require, envs in requires:
+                if envs is None:
+                    bundler_content += '    Kernel.require "{}"\n' \
+                        .format(require)
+                else:
+                    bundler_content += '    Kernel.require "{}"' \
+                        ' unless (groups & ["{}"]).empty?\n'.format(
+                            require, '", "'.join(envs))
             bundler_content += '''  end
 
   def self.setup(*args)
@@ -268,3 +337,21 @@ end
                 name='lib/bundler.rb',
                 mode=0o755,
                 content=bundler_content)
+
+    def bundler_requires(self):
+        """ (feature, groups) for every gem required by Bundler.require,
+            groups being None for gems of the default group """
+        for name in self.app.gemfile.required_gems:
+            gem = self.app.gemfile.gems[name]
+            if not gem.require:
+                continue
+            if gem.require is not True:  # specific require!
+                yield self.resolve(gem.require), None
+                continue
+            for require in self.gem_metadatas.get(
+                    name, {'require': [name.replace('-', '/')]}) \
+                    .get('require', []) or [name.replace('-', '/')]:
+                if 'default' in gem.envs:
+                    yield self.resolve(require), None
+                else:
+                    yield self.resolve(require), list(gem.envs)
@@ -1,11 +1,14 @@
+import fcntl
+import hashlib
 import os
 import tarfile
 import gzip
 import yaml
-from struct import pack, unpack
+import re
 import subprocess
 from shutil import move
 from types import SimpleNamespace
+from functools import lru_cache
 from glob import glob
 
 from debian.changelog import Changelog
@@ -14,7 +17,7 @@ from debler import config
 from debler.builder import BaseBuilder, \
     SourceControl, Package, \
     BuildDependency, Dependency, Provide, \
-    InstallInto, InstallContent, RuleAction, \
+    InstallInto, InstallContent, DebianContent, RuleAction, \
     FastBuild
 from .constraints import parseConstraints
 from ..constraints import dependencies4Constraints
@@ -32,11 +35,31 @@ yaml.add_multi_constructor(u"!ruby/object:", construct_ruby_object)
 yaml.add_multi_constructor(u'!binary', construct_binary_object)
 
 
+segment_re = re.compile(r'[0-9]+|[a-z]+', re.IGNORECASE)
+
+
 class GemVersion():
-    def __init__(self, parts):
-        self.parts = parts
+    """ immutable gem version with RubyGems ordering
+
+    parts is the historic integer encoding: numbers stay numbers, strings
+    are -1, char codes, 0 and git revisions -2, five signed 32bit words, 0.
+    The string form and the sort key are computed only once.
+    """
+    __slots__ = ('parts', '_str', '_key')
+
+    def __init__(self, parts, string=None):
+        object.__setattr__(self, 'parts', tuple(parts))
+        object.__setattr__(self, '_str', string)
+        object.__setattr__(self, '_key', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('GemVersion is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('GemVersion is immutable')
 
     @classmethod
+    @lru_cache(maxsize=4096)
     def fromstr(cls, s):
         parts = []
         for part in s.split('.'):
@@ -46,61 +69,133 @@ class GemVersion():
                 parts.append(-2)
                 part = part[3:]
                 assert len(part) == 40
-                while len(part) > 0:
-                    i = int(part[:8], 16)
-                    parts.append(unpack('i', pack('I', i))[0])
-                    part = part[8:]
+                for pos in range(0, 40, 8):
+                    i = int(part[pos:pos + 8], 16)
+                    parts.append(i - (1 << 32) if i >= (1 << 31) else i)
                 parts.append(0)
             else:
                 parts.append(-1)
-                for char in part:
-                    parts.append(ord(char))
+                parts.extend(ord(char) for char in part)
                 parts.append(0)
-        return cls(parts)
+        return cls(parts, s)
 
     def __str__(self):
-        s = ''
+        if self._str is None:
+            object.__setattr__(self, '_str', self.build_str())
+        return self._str
+
+    def build_str(self):
+        s = []
         needdot = False
         instr = False
         inrev = False
         for part in self.parts:
             if needdot:
-                s += '.'
+                s.append('.')
             else:
                 needdot = True
             if part == 0 and (instr or inrev):
                 instr = False
             elif instr:
-                s += chr(part)
+                s.append(chr(part))
                 needdot = False
             elif inrev:
-                s += '{:08x}'.format(unpack('I', pack('i', part))[0])
+                s.append('{:08x}'.format(part % (1 << 32)))
                 needdot = False
             elif part >= 0:
-                s += str(part)
+                s.append(str(part))
             elif part == -1:
                 instr = True
                 needdot = False
             elif part == -2:
                 inrev = True
                 needdot = False
-                s += 'rev'
+                s.append('rev')
             elif part == -9:
-                s += 'beta'
+                s.append('beta')
                 needdot = False
             elif part == -8:
-                s += 'xikolo'
+                s.append('xikolo')
             elif part == -7:
-                s += 'openhpi'
-        return s
+                s.append('openhpi')
+        return ''.join(s)
+
+    @property
+    def key(self):
+        """ sort key: canonical segments like Gem::Version#<=>
+
+        Numbers compare as (1, n), strings as (0, s) and sort before numbers
+        (prereleases), trailing zeros are ignored. A git revision (1, 0, sha)
+        sorts right after the version it is based on.
+        """
+        if self._key is None:
+            segments = []
+            for part in str(self).split('.'):
+                if part.startswith('rev') and len(part) == 43:
+                    segments.append((1, 0, part[3:]))
+                    continue
+                for segment in segment_re.findall(part):
+                    if segment.isdigit():
+                        segments.append((1, int(segment)))
+                    else:
+                        segments.append((0, segment))
+            release = next((pos for pos, segment in enumerate(segments)
+                            if segment[0] == 0), len(segments))
+            key = strip_zero_segments(segments[:release]) + \
+                strip_zero_segments(segments[release:])
+            key.append((1, 0))
+            object.__setattr__(self, '_key', tuple(key))
+        return self._key
+
+    def __repr__(self):
+        return 'GemVersion({!r})'.format(str(self))
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        if type(other) is not GemVersion:
+            return NotImplemented
+        return self.key == other.key
+
+    def __ne__(self, other):
+        if type(other) is not GemVersion:
+            return NotImplemented
+        return self.key != other.key
+
+    def __lt__(self, other):
+        if type(other) is not GemVersion:
+            return NotImplemented
+        return self.key < other.key
+
+    def __le__(self, other):
+        if type(other) is not GemVersion:
+            return NotImplemented
+        return self.key <= other.key
+
+    def __gt__(self, other):
+        if type(other) is not GemVersion:
+            return NotImplemented
+        return self.key > other.key
+
+    def __ge__(self, other):
+        if type(other) is not GemVersion:
+            return NotImplemented
+        return self.key >= other.key
 
     def todb(self):
-        return self.parts
+        return list(self.parts)
 
     def limit(self, l):
         return GemVersion(self.parts[:l])
 
 
+def strip_zero_segments(segments):
+    while segments and segments[-1] == (1, 0):
+        segments.pop()
+    return segments
+
+
 class GemInfo():
     pass
 
@@ -111,6 +206,7 @@ class GemBuilder(BaseBuilder):
         return 'debler-rubygem-' + name.lower().replace('_', '--')
 
     def __init__(self, pkger, tmp_dir, build_id):
+        super().__init__()
         self.pkger = pkger
         self.db = pkger.db
         self.tmp_dir = tmp_dir
@@ -133,8 +229,10 @@ class GemBuilder(BaseBuilder):
 
     def generate(self):
         self.create_dirs()
-        self.fetch_source()
-        self.parse_metadata()
+        with self.timed('fetch_source'):
+            self.fetch_source()
+        with self.timed('parse_metadata'):
+            self.parse_metadata()
 
         super().generate()
 
@@ -146,6 +244,8 @@ class GemBuilder(BaseBuilder):
 
     def create_dirs(self):
         os.makedirs(os.path.dirname(self.src_file), exist_ok=True)
+        if self.ccache:
+            os.makedirs(self.ccache, exist_ok=True)
 
     @property
     def src_file(self):
@@ -180,21 +280,47 @@ class GemBuilder(BaseBuilder):
                                            self.gem_version),
                 '-O', self.src_file])
             return
-        subprocess.check_call(['git', 'clone',
-                               self.build.version_config['repository'],
-                               os.path.join(self.tmp_dir, 'git')])
-        subprocess.check_call([
-            'git',
-            '-C', os.path.join(self.tmp_dir, 'git'),
-            'reset', '--hard',
-            self.build.version_config['revision']])
+        checkout = os.path.join(self.tmp_dir, 'git')
+        self.checkout_git_revision(checkout)
         subprocess.check_call([
             'gem', 'build',
-            *glob(os.path.join(self.tmp_dir, 'git', '*.gemspec'))],
-            cwd=os.path.join(self.tmp_dir, 'git'))
-        gem_file = glob(os.path.join(self.tmp_dir, 'git', '*.gem'))[0]
+            *glob(os.path.join(checkout, '*.gemspec'))],
+            cwd=checkout)
+        gem_file = glob(os.path.join(checkout, '*.gem'))[0]
         move(gem_file, self.src_file)
 
+    @property
+    def git_mirror(self):
+        repository = self.build.version_config['repository']
+        return os.path.join(
+            config.gemdir,
+            'git',
+            hashlib.sha1(repository.encode('utf-8')).hexdigest() + '.git')
+
+    def checkout_git_revision(self, checkout):
+        """ Check out the pinned revision into a worktree of a shared bare
+            mirror of the repository. The mirror is only fetched if it does
+            not contain the revision yet. """
+        repository = self.build.version_config['repository']
+        revision = self.build.version_config['revision']
+        mirror = self.git_mirror
+        git = ['git', '--git-dir', mirror]
+        os.makedirs(os.path.dirname(mirror), exist_ok=True)
+        # serialize concurrent builds working on the same mirror
+        with open(mirror + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.isdir(mirror):
+                subprocess.check_call(['git', 'clone', '--mirror',
+                                       repository, mirror])
+            elif subprocess.call(git + ['cat-file', '-e',
+                                        revision + '^{commit}'],
+                                 stderr=subprocess.DEVNULL) != 0:
+                subprocess.check_call(git + ['fetch', '--prune', 'origin'])
+            # forget worktrees of former builds (their tmp dirs are gone)
+            subprocess.check_call(git + ['worktree', 'prune'])
+            subprocess.check_call(git + ['worktree', 'add', '--detach',
+                                         checkout, revision])
+
     @property
     def slot_dir(self):
         return self.tmp_dir
@@ -222,7 +348,8 @@ class GemBuilder(BaseBuilder):
     def build_orig_tar(self):
         if os.path.isfile(self.orig_tar):
             return
-        self.build_tarxz()
+        with self.timed('build_tarxz'):
+            self.build_tarxz()
         os.symlink(self.tarxz_file, self.orig_tar)
 
     def generate_control_content(self):
@@ -241,6 +368,8 @@ class GemBuilder(BaseBuilder):
             for ruby in self.pkger.rubies:
                 yield BuildDependency('ruby{}'.format(ruby))
                 yield BuildDependency('ruby{}-dev'.format(ruby))
+            if self.ccache:
+                yield BuildDependency('ccache')
         yield FastBuild(len(exts) == 0)  # extension prohibite fast build
 
         info = self.pkger.gem_info(self.gem_name)
@@ -415,16 +544,24 @@ Gem::Specification.new do |s|
                            for ext in exts]
 
         if len(exts) > 0:
-            yield RuleAction('build', 'mkdir -p ' +
-                             ' '.join(build.dir for build in buildmatrix))
-            for build in buildmatrix:
-                yield RuleAction('build',
-                                 ('cd {build.dir} && ' +
-                                  '{build.ruby} {build.rubyopts} ' +
-                                  '{build.ext} {build.ext_args}').format(
-                                    build=build))
-            for build in buildmatrix:
-                yield RuleAction('build', 'make -C ' + build.dir)
+            yield DebianContent(
+                name='extensions.mk',
+                mode=0o644,
+                content=''.join(self.extensions_makefile(buildmatrix)))
+            if self.ccache:
+                yield RuleAction('build', 'CCACHE_DIR={} ccache --zero-stats'
+                                 .format(self.ccache))
+            # build all matrix entries concurrently; the sub-makes share
+            # the job slots granted by DEB_BUILD_OPTIONS=parallel=N
+            yield RuleAction('build', [
+                '$(MAKE)',
+                '-f', 'debian/extensions.mk',
+                '-j$(or $(patsubst parallel=%,%,'
+                '$(filter parallel=%,$(DEB_BUILD_OPTIONS))),1)'])
+            if self.ccache:
+                # report hits and misses of this build in the build log
+                yield RuleAction('build', 'CCACHE_DIR={} ccache --show-stats'
+                                 .format(self.ccache))
             for build in buildmatrix:
                 yield InstallInto(
                     self.deb_name + '-' + build.ruby,
@@ -445,6 +582,8 @@ Gem::Specification.new do |s|
 
         current_level = None
         require_files = []
+        # feature -> file per require path, earlier require paths win
+        features = [{} for path in self.metadata['require_paths']]
         with tarfile.open(self.src_file) as t, \
                 tarfile.open(fileobj=t.extractfile('data.tar.gz')) as dt:
             members = dt.getmembers()
@@ -465,6 +604,13 @@ Gem::Specification.new do |s|
                         elif len(parts) == current_level:  # should not happend
                             # strip extension + require path
                             require_files.append(member.name[len(path)+1:-3])
+                for path, path_features in zip(
+                        self.metadata['require_paths'], features):
+                    prefix = path.rstrip('/') + '/' if path != '.' else ''
+                    if member.isfile() and member.name.endswith('.rb') \
+                            and member.name.startswith(prefix):
+                        path_features[member.name[len(prefix):-3]] = \
+                            member.name
                 if member.name.startswith('ext'):
                     continue
                 for path in self.metadata['require_paths'] + \
@@ -491,8 +637,38 @@ Gem::Specification.new do |s|
         else:
             # not sure what to do ...
             metadata['require'] = require_files
+        metadata['features'] = {}
+        for path_features in reversed(features):
+            metadata['features'].update(path_features)
         self.pkger.db.set_slot_metadata(self.build.slot_id, metadata)
 
+    def extensions_makefile(self, buildmatrix):
+        yield '# File auto-generated by debler gem-builder\n\n'
+        if self.ccache:
+            yield ('export PATH := /usr/lib/ccache:$(PATH)\n'
+                   'export CCACHE_DIR := {}\n'
+                   'export CCACHE_BASEDIR := $(CURDIR)\n'
+                   'export CCACHE_UMASK := 002\n\n').format(self.ccache)
+        yield 'all: {}\n'.format(
+            ' '.join(build.dir for build in buildmatrix))
+        yield '.PHONY: all {}\n'.format(
+            ' '.join(build.dir for build in buildmatrix))
+        for build in buildmatrix:
+            yield ('\n{build.dir}:\n'
+                   '\tmkdir -p {build.dir}\n'
+                   '\tcd {build.dir} && {build.ruby} {build.rubyopts} '
+                   '{build.ext} {build.ext_args}\n'
+                   '\t$(MAKE) -C {build.dir}\n').format(build=build)
+
+    @property
+    def ccache(self):
+        """ Persistent ccache directory for native extensions or None """
+        if not self.pkger.ccache:
+            return None
+        if not self.pkger.gem_info(self.gem_name).get('ccache', True):
+            return None
+        return self.pkger.ccache
+
     def extension_list(self):
         info = self.pkger.gem_info(self.gem_name)
         exts = list(self.metadata['extensions'])
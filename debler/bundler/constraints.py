@@ -1,8 +1,8 @@
-from functools import partial
+from functools import lru_cache, partial
 import re
 
 from debler.constraints import GreaterThan, GreaterEqual, \
-    LessThan, LessEqual, Exact, \
+    LessThan, LessEqual, Exact, IntervalSet, \
     buildAnd, all
 
 
@@ -24,9 +24,8 @@ def eval_equal(version):
 
 
 def eval_unequal(version):
-    # use for now a newer version
-    # TODO implement proper mapping
-    yield GreaterThan(version)
+    yield IntervalSet.fromConstraint(Exact(version)).complement() \
+        .toConstraint()
 
 
 def eval_terminal(klass, version):
@@ -45,10 +44,16 @@ eval_by_op = {
 
 
 def parseConstraints(requirements):
+    return parseRequirements(tuple(
+        (requirement[0], requirement[1]['version'])
+        for requirement in requirements))
+
+
+@lru_cache(maxsize=4096)
+def parseRequirements(requirements):
     constraints = []
-    for requirement in requirements:
-        op = requirement[0]
-        version = re.sub('\.([^0-9])', '.~\\1', requirement[1]['version'])
+    for op, version in requirements:
+        version = re.sub('\.([^0-9])', '.~\\1', version)
         constraints.extend(eval_by_op[op](version))
     if not constraints:
         return all
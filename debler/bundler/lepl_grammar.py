@@ -0,0 +1,94 @@
+""" The original lepl based Gemfile grammar.
+
+It is no longer used to parse Gemfiles (see parser.GemfileReader) but kept
+as reference implementation for the differential tests and the benchmark.
+"""
+from string import ascii_letters, digits
+
+import lepl
+
+from .parser import Source, Assignment, VariableAccess, GemfileGem, \
+    build_gems, fetch_env, eval_conditional
+
+
+def build_str(s):
+    return ''.join(s)
+
+
+def expand(cls):
+    def call(args):
+        return cls(*args)
+    return call
+
+
+def ret(v):
+    def call(arg):
+        return v
+    return call
+
+
+maybespace = lepl.Drop(lepl.Optional(lepl.Space()))
+
+singlestring = (lepl.Drop('\'') & lepl.Star(lepl.AnyBut('\'')) & lepl.Drop('\'')) > build_str
+douplestring = (lepl.Drop('"') & lepl.Star(lepl.AnyBut('"')) & lepl.Drop('"')) > build_str
+string = singlestring | douplestring
+symbol = lepl.Drop(':') & lepl.Star(lepl.AnyBut('\':\t\n ')) > build_str
+identifier = lepl.Any(ascii_letters + '_') & lepl.Star(lepl.Any(ascii_letters + '_' + digits)) & lepl.Optional(lepl.Any('?!')) > build_str
+variable_read = identifier > expand(VariableAccess)
+
+line_comment = lepl.Literal('#') & lepl.Star(lepl.AnyBut('\n'))
+newline = lepl.Drop(lepl.Star(lepl.Space()) & lepl.Optional(line_comment) & lepl.Literal('\n') & lepl.Star(lepl.Space()))
+
+# define ruby line
+spaces = lepl.Star(lepl.Space())
+breakablespaces = spaces | (lepl.Literal('\n ') & spaces )
+
+ruby = lepl.Drop('ruby') & ~lepl.Space() & string >> ret(None)
+
+expr = lepl.Delayed()
+
+true = lepl.Literal('true') >> ret(True)
+false = lepl.Literal('false') >> ret(False)
+constant_value = true | false | symbol | string | variable_read
+
+env_expr = lepl.Drop('ENV[') & maybespace & string & maybespace & lepl.Drop(']') > expand(fetch_env)
+
+parentheses_expr = lepl.Drop('(') & maybespace & expr  & maybespace & lepl.Drop(')')
+simple_expr = parentheses_expr | env_expr | constant_value
+
+conditional_expr = simple_expr & maybespace & lepl.Drop('?') & maybespace & simple_expr & maybespace & lepl.Drop(':') & maybespace & expr > expand(eval_conditional)
+expr += conditional_expr | simple_expr
+
+keywoard_value = simple_expr
+keyword_name = lepl.Star(lepl.AnyBut(':\t=> ')) > build_str
+keyword_newstyle = keyword_name & lepl.Drop(':') & ~spaces & keywoard_value > tuple
+keyword_oldstyle = lepl.Drop(':') & keyword_name & ~spaces & lepl.Drop('=>') & ~spaces & keywoard_value > tuple
+keyword = keyword_oldstyle | keyword_newstyle
+keywords = lepl.Star(~lepl.Drop(',') & ~breakablespaces & keyword) > dict
+
+# define gem line
+gem = lepl.Drop('gem') & ~lepl.Space() & string
+# optional version constraints
+gem_constraint_value = variable_read | string
+gem_constraints = lepl.Star(~spaces & ~lepl.Drop(',') & ~spaces & ~lepl.Lookahead(keyword) & gem_constraint_value) > tuple
+gem &= gem_constraints
+# optional keywords
+gem &= keywords
+# comment
+gem &= lepl.Drop(lepl.Star(lepl.Space()) & lepl.Optional(line_comment))
+gem = gem > expand(GemfileGem)
+
+# gem group
+group_envs = symbol & lepl.Star(lepl.Drop(',') & ~lepl.Space() & symbol) > tuple
+group_start = ~lepl.Literal('group') & ~lepl.Space() & group_envs & ~lepl.Space() & ~lepl.Literal('do')
+group_content = lepl.Star(gem | newline)
+group_end = ~lepl.Literal('end')
+group = group_start & group_content & group_end > expand(build_gems)
+
+source = ~lepl.Literal('source') & ~lepl.Space() & string > expand(Source)
+
+var_assignment = identifier & maybespace & lepl.Drop('=') & maybespace & expr > expand(Assignment)
+
+
+parser = lepl.Star(source | var_assignment | ruby | gem | group | newline)
+
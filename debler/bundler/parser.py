@@ -1,14 +1,12 @@
-import lepl
+from glob import glob
+import hashlib
+import json
 import os
-from string import ascii_letters, digits
+import re
 
 from .builder import GemVersion
 
 
-def build_str(s):
-    return ''.join(s)
-
-
 class Source():
     def __init__(self, source):
         self.source = source
@@ -65,18 +63,6 @@ def build_gems(envs, *gems):
     return gems
 
 
-def expand(cls):
-    def call(args):
-        return cls(*args)
-    return call
-
-
-def ret(v):
-    def call(arg):
-        return v
-    return call
-
-
 def fetch_env(env):
     return os.environ.get(env)
 
@@ -99,70 +85,215 @@ class VariableAccess():
         self.name = name
 
 
-maybespace = lepl.Drop(lepl.Optional(lepl.Space()))
-
-singlestring = (lepl.Drop('\'') & lepl.Star(lepl.AnyBut('\'')) & lepl.Drop('\'')) > build_str
-douplestring = (lepl.Drop('"') & lepl.Star(lepl.AnyBut('"')) & lepl.Drop('"')) > build_str
-string = singlestring | douplestring
-symbol = lepl.Drop(':') & lepl.Star(lepl.AnyBut('\':\t\n ')) > build_str
-identifier = lepl.Any(ascii_letters + '_') & lepl.Star(lepl.Any(ascii_letters + '_' + digits)) & lepl.Optional(lepl.Any('?!')) > build_str
-variable_read = identifier > expand(VariableAccess)
-
-line_comment = lepl.Literal('#') & lepl.Star(lepl.AnyBut('\n'))
-newline = lepl.Drop(lepl.Star(lepl.Space()) & lepl.Optional(line_comment) & lepl.Literal('\n') & lepl.Star(lepl.Space()))
-
-# define ruby line
-spaces = lepl.Star(lepl.Space())
-breakablespaces = spaces | (lepl.Literal('\n ') & spaces )
-
-ruby = lepl.Drop('ruby') & ~lepl.Space() & string >> ret(None)
-
-expr = lepl.Delayed()
-
-true = lepl.Literal('true') >> ret(True)
-false = lepl.Literal('false') >> ret(False)
-constant_value = true | false | symbol | string | variable_read
-
-env_expr = lepl.Drop('ENV[') & maybespace & string & maybespace & lepl.Drop(']') > expand(fetch_env)
-
-parentheses_expr = lepl.Drop('(') & maybespace & expr  & maybespace & lepl.Drop(')')
-simple_expr = parentheses_expr | env_expr | constant_value
-
-conditional_expr = simple_expr & maybespace & lepl.Drop('?') & maybespace & simple_expr & maybespace & lepl.Drop(':') & maybespace & expr > expand(eval_conditional)
-expr += conditional_expr | simple_expr
-
-keywoard_value = simple_expr
-keyword_name = lepl.Star(lepl.AnyBut(':\t=> ')) > build_str
-keyword_newstyle = keyword_name & lepl.Drop(':') & ~spaces & keywoard_value > tuple
-keyword_oldstyle = lepl.Drop(':') & keyword_name & ~spaces & lepl.Drop('=>') & ~spaces & keywoard_value > tuple
-keyword = keyword_oldstyle | keyword_newstyle
-keywords = lepl.Star(~lepl.Drop(',') & ~breakablespaces & keyword) > dict
-
-# define gem line
-gem = lepl.Drop('gem') & ~lepl.Space() & string
-# optional version constraints
-gem_constraint_value = variable_read | string
-gem_constraints = lepl.Star(~spaces & ~lepl.Drop(',') & ~spaces & ~lepl.Lookahead(keyword) & gem_constraint_value) > tuple
-gem &= gem_constraints
-# optional keywords
-gem &= keywords
-# comment
-gem &= lepl.Drop(lepl.Star(lepl.Space()) & lepl.Optional(line_comment))
-gem = gem > expand(GemfileGem)
-
-# gem group
-group_envs = symbol & lepl.Star(lepl.Drop(',') & ~lepl.Space() & symbol) > tuple
-group_start = ~lepl.Literal('group') & ~lepl.Space() & group_envs & ~lepl.Space() & ~lepl.Literal('do')
-group_content = lepl.Star(gem | newline)
-group_end = ~lepl.Literal('end')
-group = group_start & group_content & group_end > expand(build_gems)
-
-source = ~lepl.Literal('source') & ~lepl.Space() & string > expand(Source)
-
-var_assignment = identifier & maybespace & lepl.Drop('=') & maybespace & expr > expand(Assignment)
-
-
-parser = lepl.Star(source | var_assignment | ruby | gem | group | newline)
+class GemfileSyntaxError(ValueError):
+    def __init__(self, line, msg):
+        super().__init__('line {}: {}'.format(line, msg))
+        self.line = line
+
+
+token_re = re.compile(r"""
+    (?P<space>[ \t\r]+)
+  | (?P<comment>\#[^\n]*)
+  | (?P<newline>\n)
+  | '(?P<sstring>[^']*)'
+  | "(?P<dstring>[^"]*)"
+  | (?P<label>[A-Za-z_][A-Za-z0-9_]*[?!]?):(?!:)
+  | :(?P<symbol>[^':\t\n\r ,()\]=>]+)
+  | (?P<identifier>[A-Za-z_][A-Za-z0-9_]*[?!]?)
+  | (?P<op>=>|[=,()?:\[\]])
+""", re.VERBOSE)
+
+
+def tokenize(content):
+    """ split a Gemfile into (kind, value, line) tokens (single pass) """
+    tokens = []
+    line = 1
+    pos = 0
+    end = len(content)
+    match = token_re.match
+    while pos < end:
+        m = match(content, pos)
+        if m is None:
+            raise GemfileSyntaxError(
+                line, 'unexpected character {!r}'.format(content[pos]))
+        kind = m.lastgroup
+        if kind == 'newline':
+            tokens.append(('newline', None, line))
+            line += 1
+        elif kind == 'sstring' or kind == 'dstring':
+            tokens.append(('string', m.group(kind), line))
+        elif kind == 'op':
+            tokens.append((m.group(kind), None, line))
+        elif kind != 'space' and kind != 'comment':
+            tokens.append((kind, m.group(kind), line))
+        pos = m.end()
+    tokens.append(('eof', None, line))
+    return tokens
+
+
+class GemfileReader():
+    """ recursive descent parser for the supported Gemfile subset
+
+    Produces the same object list as the former lepl grammar: Source,
+    None (ruby version), Assignment, GemfileGem and a tuple of GemfileGem
+    per group.
+    """
+    def __init__(self, content):
+        self.tokens = tokenize(content)
+        self.pos = 0
+        self.env = {}
+
+    def peek(self, offset=0):
+        return self.tokens[self.pos + offset]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, kind, what=None):
+        token = self.next()
+        if token[0] != kind:
+            self.fail(token, what or kind)
+        return token[1]
+
+    def accept(self, kind):
+        if self.tokens[self.pos][0] == kind:
+            self.pos += 1
+            return True
+        return False
+
+    def skip_newlines(self):
+        while self.tokens[self.pos][0] == 'newline':
+            self.pos += 1
+
+    def fail(self, token, expected):
+        found = token[0] if token[1] is None else '{} {!r}'.format(*token[:2])
+        raise GemfileSyntaxError(token[2], 'expected {}, found {}'.format(
+            expected, found))
+
+    def end_of_statement(self):
+        token = self.next()
+        if token[0] not in ('newline', 'eof'):
+            self.fail(token, 'end of line')
+        if token[0] == 'eof':
+            self.pos -= 1
+
+    def parse(self):
+        result = []
+        while True:
+            self.skip_newlines()
+            if self.peek()[0] == 'eof':
+                return result
+            result.append(self.statement())
+            self.end_of_statement()
+
+    def statement(self):
+        kind, value, _ = token = self.next()
+        if kind == 'identifier':
+            if value == 'gem' and self.peek()[0] == 'string':
+                return self.gem()
+            if value == 'group' and self.peek()[0] == 'symbol':
+                return self.group()
+            if value == 'source' and self.peek()[0] == 'string':
+                return Source(self.next()[1])
+            if value == 'ruby' and self.peek()[0] == 'string':
+                self.next()
+                return None
+            if self.accept('='):
+                return Assignment(value, self.expr())
+        self.fail(token, 'statement')
+
+    def gem(self):
+        name = self.expect('string')
+        constraints = []
+        opts = {}
+        while self.accept(','):
+            self.skip_newlines()
+            kind, value, _ = token = self.next()
+            if kind == 'label':
+                opts[value] = self.simple_expr()
+            elif kind == 'symbol' and self.accept('=>'):
+                opts[value] = self.simple_expr()
+            elif opts:
+                self.fail(token, 'keyword')
+            elif kind == 'string':
+                constraints.append(value)
+            elif kind == 'identifier':
+                constraints.append(VariableAccess(value))
+            else:
+                self.fail(token, 'version constraint or keyword')
+        return GemfileGem(name, tuple(constraints), opts)
+
+    def group(self):
+        envs = [self.expect('symbol')]
+        while self.accept(','):
+            envs.append(self.expect('symbol'))
+        token = self.next()
+        if token[:2] != ('identifier', 'do'):
+            self.fail(token, 'do')
+        self.end_of_statement()
+        gems = []
+        while True:
+            self.skip_newlines()
+            token = self.next()
+            if token[:2] == ('identifier', 'end'):
+                return build_gems(tuple(envs), *gems)
+            if token[:2] != ('identifier', 'gem'):
+                self.fail(token, 'gem or end')
+            gems.append(self.gem())
+            self.end_of_statement()
+
+    def expr(self):
+        value = self.simple_expr()
+        if not self.accept('?'):
+            return value
+        expr = self.simple_expr()
+        self.expect(':')
+        return eval_conditional(value, expr, self.expr())
+
+    def simple_expr(self):
+        kind, value, _ = token = self.next()
+        if kind == '(':
+            value = self.expr()
+            self.expect(')')
+            return value
+        if kind == 'string' or kind == 'symbol':
+            return value
+        if kind == 'identifier':
+            if value == 'ENV' and self.accept('['):
+                name = self.expect('string')
+                value = self.env[name] = fetch_env(name)
+                self.expect(']')
+                return value
+            if value == 'true':
+                return True
+            if value == 'false':
+                return False
+            return VariableAccess(value)
+        self.fail(token, 'expression')
+
+
+def parse_gemfile(content):
+    return GemfileReader(content).parse()
+
+
+# bump whenever the parser or the format of todict() changes
+CACHE_VERSION = 1
+# number of parse results kept in the cache
+CACHE_ENTRIES = 100
+
+
+def encode_cache_value(o):
+    if type(o) is VariableAccess:
+        return {'__var__': o.name}
+    raise TypeError('{!r} is not serializable'.format(o))
+
+
+def decode_cache_value(d):
+    if len(d) == 1 and '__var__' in d:
+        return VariableAccess(d['__var__'])
+    return d
 
 
 class Parser():
@@ -179,8 +310,99 @@ class Parser():
             except ValueError:
                 pass
 
+    @classmethod
+    def cached(cls, gemfile, ignore_gems=[], *, cachedir):
+        """ parse gemfile or load the result of a former run
+
+        Results are stored per content hash of Gemfile and Gemfile.lock; the
+        ENV variables read by the Gemfile must still have the same values.
+        """
+        key = hashlib.sha256(str(CACHE_VERSION).encode('utf-8'))
+        for file in (gemfile, gemfile + '.lock'):
+            with open(file, 'rb') as f:
+                key.update(hashlib.sha256(f.read()).digest())
+        key.update(json.dumps(sorted(ignore_gems)).encode('utf-8'))
+        cachefile = os.path.join(cachedir, key.hexdigest() + '.json')
+
+        try:
+            with open(cachefile, 'r') as f:
+                data = json.load(f, object_hook=decode_cache_value)
+            if all(fetch_env(name) == value
+                   for name, value in data['env'].items()):
+                parser = cls.fromdict(data)
+                os.utime(cachefile)
+                return parser
+        except (OSError, ValueError, KeyError):
+            pass
+
+        parser = cls(gemfile, ignore_gems)
+        os.makedirs(cachedir, exist_ok=True)
+        tmpfile = '{}.{}.tmp'.format(cachefile, os.getpid())
+        with open(tmpfile, 'w') as f:
+            json.dump(parser.todict(), f, separators=(',', ':'),
+                      default=encode_cache_value)
+        os.replace(tmpfile, cachefile)
+        # only keep the most recent results; other processes may prune
+        # concurrently
+        results = glob(os.path.join(cachedir, '*.json'))
+        if len(results) > CACHE_ENTRIES:
+            mtimes = {}
+            for result in results:
+                try:
+                    mtimes[result] = os.path.getmtime(result)
+                except FileNotFoundError:
+                    pass
+            for result in sorted(mtimes, key=mtimes.get)[:-CACHE_ENTRIES]:
+                try:
+                    os.remove(result)
+                except FileNotFoundError:
+                    pass
+        return parser
+
+    @classmethod
+    def fromlock(cls, lockfile):
+        """ parse only a Gemfile.lock e.g. of an older app version """
+        self = cls.__new__(cls)
+        self.gems = {}
+        self.parse_gemlock(lockfile)
+        return self
+
+    def todict(self):
+        return {
+            'env': self.env,
+            'remote': getattr(self, 'remote', None),
+            'required_gems': self.required_gems,
+            'dependencies': getattr(self, 'dependencies', {}),
+            'gems': [[gem.name, gem.version and str(gem.version),
+                      gem.constraints, gem.envs, gem.require, gem.path,
+                      gem.revision, gem.remote, gem.deps]
+                     for gem in self.gems.values()],
+        }
+
+    @classmethod
+    def fromdict(cls, data):
+        self = cls.__new__(cls)
+        self.env = data['env']
+        if data['remote'] is not None:
+            self.remote = data['remote']
+        self.required_gems = data['required_gems']
+        self.dependencies = data['dependencies']
+        self.gems = {}
+        for name, version, constraints, envs, require, path, revision, \
+                remote, deps in data['gems']:
+            gem = Gem(name, version and GemVersion.fromstr(version),
+                      tuple(constraints), envs, require, path)
+            gem.revision = revision
+            gem.remote = remote
+            gem.deps = deps
+            self.gems[name] = gem
+        return self
+
     def parse_gemfile(self, file):
-        d = parser.parse(open(file, 'r'))
+        with open(file, 'r') as f:
+            reader = GemfileReader(f.read())
+        d = reader.parse()
+        self.env = reader.env
         assignments = {}
         self.required_gems = []
         for o in d:
@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+from debler.builder import InstallContent, DebianContent
+from debler.bundler.appintegrator import BundlerAppIntegrator
+from debler.bundler.parser import Gem
+from debler.db import PkgInfo, SlotInfo
+
+
+class FakePkger():
+    rubies = ['2.5']
+
+    def __init__(self, features):
+        self.features = features
+
+    def gem_info(self, name):
+        info = PkgInfo(None, None, name, name, {}, [])
+        metadata = {'require_paths': ['lib'], 'require': [name]}
+        if name in self.features:
+            metadata['features'] = self.features[name]
+        info.slots.append(SlotInfo(None, info, None, '1', {}, metadata))
+        return info
+
+
+def integrate(features, gems):
+    gems = {gem.name: gem for gem in gems}
+    app = SimpleNamespace(
+        name='shop', app=SimpleNamespace(description='Shop'), gems=gems,
+        gemfile=SimpleNamespace(gems=gems, required_gems=sorted(gems)),
+        bundler_laucher=True, default_env='production')
+    integrator = BundlerAppIntegrator(FakePkger(features), app,
+                                      SimpleNamespace(deb_name='shop'))
+    list(integrator.generate_control_content())
+    return {action.name: action.content
+            for action in integrator.generate_rules_content()
+            if type(action) in (InstallContent, DebianContent)}
+
+
+def test_require_index():
+    files = integrate({
+        'rack': {'rack': 'lib/rack.rb', 'rack/lint': 'lib/rack/lint.rb'},
+        'rake': {'rack': 'lib/rack.rb', "o'dd": "lib/o'dd.rb"},
+    }, [
+        Gem('rack', '1.0', [], ['default'], require=True),
+        Gem('rake', '1.2', [], ['test'], require=True),
+    ])
+    assert files['data/require_index.rb'] == '''DEBLER_REQUIRE_INDEX = {
+  'rack' => '/usr/share/rubygems-debler/rack-1/lib/rack.rb',
+  'rack/lint' => '/usr/share/rubygems-debler/rack-1/lib/rack/lint.rb',
+  'o\\'dd' => '/usr/share/rubygems-debler/rake-1/lib/o\\'dd.rb',
+}.freeze
+'''
+    launcher = files['bin/shop2.5']
+    assert 'path = DEBLER_REQUIRE_INDEX[name]' in launcher
+    # files of the app itself shadow indexed features
+    assert "dir.start_with?('/usr/share/shop/') &&\n" \
+        "          File.file?(File.join(dir, name + '.rb')) }\n" \
+        "      return debler_require(feature)\n" in launcher
+    bundler = files['lib/bundler.rb']
+    assert 'Kernel.require ' \
+        '"/usr/share/rubygems-debler/rack-1/lib/rack.rb"\n' in bundler
+    # no feature list recorded (yet): fall back to the load path
+    assert 'Kernel.require "rake" unless' in bundler
+
+
+def test_static_require_scripts():
+    files = integrate({}, [
+        Gem('rails', '1.0', [], ['default'], require=True),
+        Gem('pry', '1.0', [], ['development', 'test'], require=True),
+        Gem('puma', '1.0', [], ['production'], require='puma/server'),
+        Gem('yard', '1.0', [], ['doc'], require=False),
+    ])
+    assert files['lib/bundler/require/default.rb'] == \
+        'Kernel.require "puma/server"\nKernel.require "rails"\n'
+    assert files['lib/bundler/require/production.rb'] == \
+        'Kernel.require "puma/server"\nKernel.require "rails"\n'
+    assert files['lib/bundler/require/test.rb'] == \
+        'Kernel.require "pry"\nKernel.require "puma/server"\n' \
+        'Kernel.require "rails"\n'
+    assert files['lib/bundler/require/doc.rb'] == \
+        files['lib/bundler/require/default.rb']
+    bundler = files['lib/bundler.rb']
+    assert '    ["development"] => "development",\n' in bundler
+    assert '    [] => "default",\n' in bundler
+    # unknown group combinations still work
+    assert 'Kernel.require "pry" unless (groups & ' \
+        '["development", "test"]).empty?' in bundler
+
+
+def test_launcher_inlines_load_paths():
+    files = integrate({}, [Gem('rack', '1.0', [], ['default'])])
+    launcher = files['bin/shop2.5']
+    assert "$LOAD_PATH.concat [\n" \
+        "  '/usr/share/rubygems-debler/rack-1/lib/',\n]\n" in launcher
+    assert 'load_paths' not in launcher
@@ -0,0 +1,46 @@
+import pytest
+
+from debler.bundler.builder import GemVersion
+
+REV = 'rev523bd46c768226893f23889079a7aa9c73b57d68'
+
+
+@pytest.mark.parametrize('version', [
+    '1', '4.2.7', '5.0.0.beta1', '0.18.4', '2.0.0.rc.2', '1.2.' + REV])
+def test_str_roundtrip(version):
+    v = GemVersion.fromstr(version)
+    assert str(v) == version
+    assert str(GemVersion(v.parts)) == version
+
+
+def test_rev_parts_are_signed_words():
+    v = GemVersion.fromstr('1.' + REV)
+    assert v.parts[1:3] == (-2, 0x523bd46c)
+    v = GemVersion.fromstr('1.rev' + 'ffffffff' + '0' * 32)
+    assert v.parts[1:4] == (-2, -1, 0)
+    assert str(v) == '1.rev' + 'ffffffff' + '0' * 32
+
+
+def test_rubygems_ordering():
+    versions = ['1.0.a', '1.0.b1', '1.0', '1.0.' + REV, '1.0.1',
+                '1.1.pre', '1.1', '1.10', '2.0.0.beta1', '2.0.0']
+    parsed = [GemVersion.fromstr(v) for v in versions]
+    assert sorted(reversed(parsed)) == parsed
+    assert [str(v) for v in sorted(reversed(parsed))] == versions
+
+
+def test_trailing_zeros_are_equal():
+    assert GemVersion.fromstr('1.0') == GemVersion.fromstr('1.0.0')
+    assert hash(GemVersion.fromstr('1.0')) == \
+        hash(GemVersion.fromstr('1'))
+    assert GemVersion.fromstr('1.0') != GemVersion.fromstr('1.0.1')
+    assert GemVersion.fromstr('1.0.0.a') == GemVersion.fromstr('1.a')
+
+
+def test_immutable():
+    v = GemVersion.fromstr('1.2.3')
+    with pytest.raises(AttributeError):
+        v.parts = (1,)
+    with pytest.raises(AttributeError):
+        v.other = 1
+    assert v.limit(2) == GemVersion.fromstr('1.2')
@@ -26,3 +26,11 @@ def test_tilde_leading_zeros():
         c.And([c.GreaterEqual('0.2'), c.LessThan('1')])
     assert parse('~> 0') == \
         c.And([c.GreaterEqual('0'), c.LessThan('1')])
+
+
+def test_unequal():
+    assert parse('!= 1.2.3') == \
+        c.Or([c.LessThan('1.2.3'), c.GreaterThan('1.2.3')])
+    assert parse('~> 1.2', '!= 1.4.0') == \
+        c.Or([c.And([c.GreaterEqual('1.2'), c.LessThan('1.4.0')]),
+              c.And([c.GreaterThan('1.4.0'), c.LessThan('2')])])
@@ -1,6 +1,18 @@
+import glob
+import json
 import os.path
 
-from debler.bundler.parser import Parser
+import pytest
+
+from debler.bundler import parser
+from debler.bundler.parser import Parser, parse_gemfile, \
+    GemfileSyntaxError, Source, Assignment, VariableAccess, GemfileGem, \
+    encode_cache_value
+
+try:
+    from debler.bundler import lepl_grammar
+except Exception:  # lepl is missing or does not run on this Python
+    lepl_grammar = None
 
 
 def gemfile(name):
@@ -13,3 +25,125 @@ def gemfile(name):
 def test_git_oldkeyword_double_string():
     p = Parser(gemfile('git-oldkeyword-double'))
     assert len(p.gems) == 10
+
+
+def test_grammar_fixture():
+    p = Parser(gemfile('grammar'))
+    assert p.required_gems == [
+        'rails', 'pg', 'puma', 'paperclip', 'local', 'rack-cors',
+        'rspec-rails', 'pry', 'unicorn', 'sass-rails']
+    assert p.gems['rails'].constraints == ('~> 4.2.7',)
+    assert p.gems['pg'].constraints == ('~> 0.18', '>= 0.18.2')
+    assert p.gems['puma'].require is False
+    assert p.gems['paperclip'].require == 'paperclip/railtie'
+    assert p.gems['paperclip'].revision == \
+        '523bd46c768226893f23889079a7aa9c73b57d68'
+    assert p.gems['local'].path == 'vendor/local'
+    assert p.gems['rack-cors'].require == 'rack/cors'
+    assert p.gems['pry'].envs == ('development', 'test')
+    assert p.gems['unicorn'].envs == ('production',)
+    assert p.gems['sass-rails'].envs == ['default']
+    assert p.gems['sass-rails'].require is False
+
+
+def test_oldkeyword_without_spaces():
+    p = Parser(gemfile('oldkeyword-nospace'))
+    assert p.gems['puma'].require is False
+    assert p.gems['paperclip'].remote == \
+        'https://github.com/thoughtbot/paperclip.git'
+
+
+def test_syntax_error_reports_line():
+    with pytest.raises(GemfileSyntaxError) as e:
+        parse_gemfile("source 'https://rubygems.org'\n\ngemspec\n")
+    assert e.value.line == 3
+
+
+def dump(o):
+    """ comparable representation of the parser output """
+    if isinstance(o, tuple):
+        return tuple(dump(i) for i in o)
+    if isinstance(o, Source):
+        return ('source', o.source)
+    if isinstance(o, Assignment):
+        return ('assign', o.name, dump(o.value))
+    if isinstance(o, VariableAccess):
+        return ('var', o.name)
+    if isinstance(o, GemfileGem):
+        return ('gem', o.name, dump(tuple(o.constraints)),
+                sorted((k, dump(v)) for k, v in o.opts.items()))
+    return o
+
+
+@pytest.mark.parametrize('name', sorted(
+    os.path.basename(f)[8:] for f in glob.glob(gemfile('*'))
+    if not f.endswith('.lock')))
+@pytest.mark.skipif(lepl_grammar is None, reason='lepl is not available')
+def test_same_result_as_lepl_grammar(name):
+    with open(gemfile(name)) as f:
+        content = f.read()
+    expected = lepl_grammar.parser.parse(content)
+    assert [dump(o) for o in parse_gemfile(content)] == \
+        [dump(o) for o in expected]
+
+
+def cached_state(p):
+    return json.dumps(p.todict(), sort_keys=True,
+                      default=encode_cache_value)
+
+
+def test_cached_parse_is_reused(tmpdir, monkeypatch):
+    monkeypatch.delenv('DEBLER_TEST_RAILS', raising=False)
+    p = Parser.cached(gemfile('grammar'), cachedir=str(tmpdir))
+    assert len(tmpdir.listdir()) == 1
+
+    monkeypatch.setattr(Parser, 'parse_gemfile', None)
+    cached = Parser.cached(gemfile('grammar'), cachedir=str(tmpdir))
+    assert cached_state(cached) == cached_state(p)
+    assert str(cached.gems['rails'].version) == '4.2.7'
+    assert cached.gems['pry'].require.name == 'require_debug'
+
+
+def test_cached_parse_checks_env(tmpdir, monkeypatch):
+    monkeypatch.delenv('DEBLER_TEST_RAILS', raising=False)
+    Parser.cached(gemfile('grammar'), cachedir=str(tmpdir))
+    monkeypatch.setenv('DEBLER_TEST_RAILS', '5.0.0')
+    p = Parser.cached(gemfile('grammar'), cachedir=str(tmpdir))
+    assert p.gems['rails'].constraints == ('5.0.0',)
+
+
+def test_cache_is_versioned(tmpdir, monkeypatch):
+    Parser.cached(gemfile('grammar'), cachedir=str(tmpdir))
+    monkeypatch.setattr(parser, 'CACHE_VERSION', parser.CACHE_VERSION + 1)
+    Parser.cached(gemfile('grammar'), cachedir=str(tmpdir))
+    assert len(tmpdir.listdir()) == 2
+
+
+def test_cache_is_pruned(tmpdir, monkeypatch):
+    monkeypatch.setattr(parser, 'CACHE_ENTRIES', 1)
+    old = tmpdir.join('old.json')
+    old.write('{}')
+    os.utime(str(old), (0, 0))
+    Parser.cached(gemfile('grammar'), cachedir=str(tmpdir))
+    assert len(tmpdir.listdir()) == 1
+    assert not old.exists()
+
+
+def test_fromlock_reads_specs_only():
+    p = Parser.fromlock(gemfile('grammar') + '.lock')
+    assert str(p.gems['unicorn'].version) == '5.1.0'
+    assert p.gems['paperclip'].revision == \
+        '523bd46c768226893f23889079a7aa9c73b57d68'
+
+
+def test_changed_gems_since_older_lock(tmpdir):
+    from debler.bundler.appinfo import BundlerAppInfo
+    with open(gemfile('grammar') + '.lock') as f:
+        lock = f.read()
+    old = tmpdir.join('Gemfile.lock')
+    old.write(lock.replace('puma (3.6.0)', 'puma (3.4.0)')
+                  .replace('523bd46c', '00000000')
+                  .replace('    unicorn (5.1.0)\n', ''))
+    app = BundlerAppInfo(None, None, gemfile=Parser(gemfile('grammar')))
+    assert sorted(name for name, _ in app.changed_gems(str(old))) == \
+        ['paperclip', 'puma', 'unicorn']
@@ -0,0 +1,111 @@
+from contextlib import contextmanager
+import io
+import json
+
+from debler.bundler import webhook
+from debler.bundler.webhook import RubygemsWebHook
+from debler.db import PkgInfo, SlotInfo
+
+
+class FakeRequest():
+    def __init__(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.headers = {'Authorization': 'x',
+                        'Content-Type': 'application/json',
+                        'Content-Length': str(len(body))}
+        self.rfile = io.BytesIO(body)
+        self.responses = []
+
+    def send_error(self, code):
+        self.responses.append(code)
+
+    def send_data(self, data):
+        self.responses.append(200)
+
+
+class FailingPkger():
+    rubygems_apikey = None
+
+    def gem_info(self, name, autocreate=False):
+        raise AssertionError('unexpected database lookup')
+
+
+def test_unknown_gems_are_skipped_without_lookup():
+    hook = RubygemsWebHook(FailingPkger(), None, [])
+    hook.known_names = {'rails'}
+
+    request = FakeRequest({'name': 'left-pad', 'version': '1.0.0'})
+    assert hook.accept(request) is None
+    assert request.responses == [200]
+
+    request = FakeRequest({'name': 'rails', 'version': '5.2.1'})
+    assert hook.accept(request) == {'name': 'rails', 'version': '5.2.1'}
+    assert request.responses == []
+
+
+class FakeDb():
+    def __init__(self):
+        self.transactions = 0
+        self.scheduled = []
+
+    @contextmanager
+    def transaction(self):
+        self.transactions += 1
+        yield
+
+    @contextmanager
+    def savepoint(self):
+        scheduled = list(self.scheduled)
+        try:
+            yield
+        except Exception:
+            self.scheduled = scheduled
+            raise
+
+    def get_versions(self, slot):
+        return []
+
+    def schedule_build(self, slot, *, version, **kwargs):
+        self.scheduled.append(version)
+        if version == '0.0.0':
+            raise RuntimeError('broken release')
+
+
+class FakePkger():
+    rubygems_apikey = None
+
+    def __init__(self):
+        self.db = FakeDb()
+
+    def gem_info(self, name, autocreate=False):
+        if name == 'left-pad':
+            raise ValueError(name)
+        info = PkgInfo(self.db, None, name, name, {}, [])
+        info.slots.append(SlotInfo(self.db, info, None, '5', {}, {}))
+        return info
+
+
+def test_batch_is_scheduled_together(monkeypatch):
+    calls = []
+    monkeypatch.setattr(webhook.subprocess, 'run',
+                        lambda args, **kwargs: calls.append(args))
+    pkger = FakePkger()
+    hook = RubygemsWebHook(pkger, 'notify', ['{gem}={version}'])
+    hook.process_batch([{'name': 'rails', 'version': '5.2.1'},
+                        {'name': 'left-pad', 'version': '1.0.0'},
+                        {'name': 'actionpack', 'version': '5.2.1'}])
+    assert pkger.db.transactions == 1
+    assert pkger.db.scheduled == ['5.2.1', '5.2.1']
+    assert calls == [['notify', 'rails=5.2.1', 'actionpack=5.2.1']]
+
+
+def test_failing_release_keeps_rest_of_batch(monkeypatch):
+    calls = []
+    monkeypatch.setattr(webhook.subprocess, 'run',
+                        lambda args, **kwargs: calls.append(args))
+    pkger = FakePkger()
+    hook = RubygemsWebHook(pkger, 'notify', ['{gem}={version}'])
+    hook.process_batch([{'name': 'rails', 'version': '0.0.0'},
+                        {'name': 'actionpack', 'version': '5.2.1'}])
+    assert pkger.db.scheduled == ['5.2.1']
+    assert calls == [['notify', 'actionpack=5.2.1']]
@@ -4,9 +4,15 @@ import logging
 import subprocess
 
 from debler import config
+from debler.metrics import Counter, Histogram
 
 log = logging.getLogger(__name__)
 
+deliveries = Counter('debler_webhook_deliveries_total',
+                     'Webhook deliveries by outcome', ['hook', 'outcome'])
+hook_seconds = Histogram('debler_webhook_hook_seconds',
+                         'Runtime of the hook script', ['hook'])
+
 
 class RubygemsWebHook():
     hook_names = ('gem', )
@@ -15,20 +21,30 @@ class RubygemsWebHook():
         self.pkger = pkger
         self.hook = hook
         self.hook_args = hook_args
+        # names of all known gems if tracked (see cmds/serve.py);
+        # releases of other gems are skipped without a database lookup
+        self.known_names = None
 
-    def run(self, request):
+    def accept(self, request):
+        """ Validate the delivery within the request thread. Returns the
+            job for :py:meth:`process_batch` or None if an error response has
+            already been sent. """
         if 'Authorization' not in request.headers:
+            deliveries.inc('gem', 'unauthorized')
             request.send_error(403)
             return
         if 'Content-Type' not in request.headers \
                 or request.headers['Content-Type'] != 'application/json':
+            deliveries.inc('gem', 'invalid')
             request.send_error(415)
             return
         if 'Content-Length' not in request.headers:
+            deliveries.inc('gem', 'invalid')
             request.send_error(411)
             return
         content_length = int(request.headers['Content-Length'])
         if content_length > 1024*1024:  # 1M
+            deliveries.inc('gem', 'invalid')
             request.send_error(413)
             return
         try:
@@ -36,39 +52,81 @@ class RubygemsWebHook():
             data = json.loads(encoded_data.decode('utf-8'))
         except Exception as e:
             print(e)
+            deliveries.inc('gem', 'invalid')
             request.send_error(400)
             return
         if 'name' not in data or 'version' not in data:
+            deliveries.inc('gem', 'invalid')
             request.send_error(400)
             return
         name = data['name']
         version = data['version']
-        kwargs = {'name': name, 'gem': name, 'version': version, 'slot': None}
         if self.pkger.rubygems_apikey:
             hashdata = name + version + self.pkger.rubygems_apikey
             auth = hashlib.sha256(hashdata.encode('utf-8')).hexdigest()
             if auth != request.headers['Authorization']:
+                deliveries.inc('gem', 'unauthorized')
                 request.send_error(403)
                 return
-        request.send_data(b'OK')
+        if self.known_names is not None and name not in self.known_names:
+            log.debug('Skip release %s of %s we do not use it', version, name)
+            deliveries.inc('gem', 'unknown_gem')
+            request.send_data(b'OK')
+            return
+        return {'name': name, 'version': version}
+
+    def process_batch(self, jobs):
+        """ Schedule the builds of accepted releases in one transaction and
+            run the hook once for all of them; runs in a worker thread with
+            its own database connection. """
+        scheduled = []
+        db = self.pkger.db
+        with db.transaction():
+            for job in jobs:
+                # a failing release must not discard the rest of the batch
+                try:
+                    with db.savepoint():
+                        kwargs = self.schedule(job['name'], job['version'])
+                except Exception:
+                    log.exception('Could not schedule %s in %s',
+                                  job['name'], job['version'])
+                    deliveries.inc('gem', 'failed')
+                    continue
+                if kwargs is not None:
+                    scheduled.append(kwargs)
+        if self.hook and scheduled:
+            # the hook arguments are repeated for every release
+            args = [self.hook]
+            for kwargs in scheduled:
+                for arg in self.hook_args:
+                    args.append(arg.format(**kwargs))
+            log.debug('exec %s', ' '.join(args))
+            with hook_seconds.time('gem'):
+                subprocess.run(args, check=True, timeout=60)
+
+    def schedule(self, name, version):
+        kwargs = {'name': name, 'gem': name, 'version': version, 'slot': None}
         log.debug('Webhook triggered for %(gem)s in %(version)s', kwargs)
         try:
             info = self.pkger.gem_info(name, autocreate=False)
         except ValueError:
             log.debug('Skip release %(version)s of %(gem)s we do not use it',
                       kwargs)
+            deliveries.inc('gem', 'unknown_gem')
             return
         try:
             slot = info.slot_for_version(version, create=False)
         except ValueError:
             log.info('%(gem)s\'s release %(version)s in unknown slot %(slot)s',
                      kwargs)
+            deliveries.inc('gem', 'unknown_slot')
             return
         kwargs['slot'] = slot.version
         versions = [v.version for v in slot.versions()]
         if version in versions:
             log.warning('%(gem)s rerelease in version %(version)s',
                         kwargs)
+            deliveries.inc('gem', 'rerelease')
             return
         slot.create(
             version=version, revision=1,
@@ -77,9 +135,5 @@ class RubygemsWebHook():
             extra={})
         log.info('%(gem)s scheduled to build %(version)s in %(slot)s',
                  kwargs)
-        if self.hook:
-            args = [self.hook]
-            for arg in self.hook_args:
-                args.append(arg.format(**kwargs))
-            log.debug('exec %s', ' '.join(args))
-            subprocess.run(args, check=True, timeout=60)
+        deliveries.inc('gem', 'scheduled')
+        return kwargs
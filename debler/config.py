@@ -1,7 +1,8 @@
 import os.path
 import yaml
 
-data = yaml.load(open(os.path.expanduser('~/.debler.yml')))
+data = yaml.load(open(os.path.expanduser(
+    os.getenv('DEBLER_CONFIG', '~/.debler.yml'))))
 
 database = data['database']
 appdir = data['appdir']
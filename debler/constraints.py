@@ -1,14 +1,22 @@
-import builtins
-from collections import defaultdict
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import product
 import operator
+import threading
 
 from .builder import Dependency
-from .db import Version
+from .db import parse_version, version_key
 
 
 class Or():
     def __init__(self, ranges):
-        self.ranges = ranges
+        # constraints are shared through caches; never mutate them
+        self.ranges = tuple(ranges)
+
+    def __eq__(self, other):
+        if type(self) != type(other):
+            return NotImplemented
+        return self.ranges == other.ranges
 
     def __repr__(self):
         return 'Or({})'.format(', '.join(str(r) for r in self.ranges))
@@ -16,7 +24,7 @@ class Or():
 
 class And():
     def __init__(self, ranges):
-        self.ranges = ranges
+        self.ranges = tuple(ranges)
 
     def needed_relation(self):
         for range in self.ranges:
@@ -39,7 +47,7 @@ class And():
 
 class Operator():
     def __init__(self, version):
-        self.version = Version(str(version))
+        self.version = parse_version(str(version))
 
     def __repr__(self):
         return '{}{}'.format(self.char, self.version)
@@ -54,30 +62,35 @@ class GreaterThan(Operator):
     char = '>>'
     op = operator.gt
     group = '>'
+    inclusive = False
 
 
 class GreaterEqual(Operator):
     char = '>='
     op = operator.ge
     group = '>'
+    inclusive = True
 
 
 class LessThan(Operator):
     char = '<<'
     op = operator.lt
     group = '<'
+    inclusive = False
 
 
 class LessEqual(Operator):
     char = '<='
     op = operator.le
     group = '<'
+    inclusive = True
 
 
 class Exact(Operator):
     char = '='
     op = operator.eq
     group = '='
+    inclusive = True
 
 
 class All():
@@ -87,181 +100,318 @@ class All():
 all = All()
 
 
-def buildAnd(ops):
-    if len(ops) == 1:
-        return ops[0]
-    by_group = defaultdict(list)
-    for op in ops:
-        by_group[op.group].append(op)
-    if '=' in by_group:
-        eq = by_group.pop('=')
-        assert len(eq) == 1, 'multiple equals are not implemented yet'
-        return eq[0]
-    # simplify < constraints
-    cleared = []
-    if '>' in by_group:
-        most_specifist = by_group['>'][0]
-        for op in by_group['>'][1:]:
-            if Version(str(op.version)) < Version(str(most_specifist.version)):
-                continue
-            if op.version == most_specifist.version and op.char == '>=':
-                continue
-            most_specifist = op
-        cleared.append(most_specifist)
-    if '<' in by_group:
-        most_specifist = by_group['<'][0]
-        for op in by_group['<'][1:]:
-            if Version(str(op.version)) > Version(str(most_specifist.version)):
-                continue
-            if op.version == most_specifist.version and op.char == '>=':
-                continue
-            most_specifist = op
-        cleared.append(most_specifist)
-    if len(cleared) == 1:
-        return cleared[0]
-    else:
-        return And(cleared)
-
-
 def rstripZeros(version):
     parts = str(version).split('.')
-    while parts[-1] == '0':
+    while len(parts) > 1 and parts[-1] == '0':
         parts.pop()
     return '.'.join(parts)
 
 
+@lru_cache(maxsize=65536)
+def bound_key(version):
+    """ sort key of a bound; trailing zeros are ignored (3 == 3.0) """
+    return version_key(rstripZeros(version))
+
+
+def lower_key(lower):
+    if lower is None:
+        return (0,)
+    return (1, bound_key(str(lower.version)), 0 if lower.inclusive else 1)
+
+
+def upper_key(upper):
+    if upper is None:
+        return (2,)
+    return (1, bound_key(str(upper.version)), 1 if upper.inclusive else 0)
+
+
+def reaches(lower, upper, touching):
+    """ whether lower bound lies before upper bound (lower <= upper)
+
+    With touching, [..., 3) and [3, ...) as well as [..., 3] and (3, ...)
+    count as connected (for unions); otherwise the bounds must overlap.
+    """
+    if lower is None or upper is None:
+        return True
+    lower_version = bound_key(str(lower.version))
+    upper_version = bound_key(str(upper.version))
+    if lower_version != upper_version:
+        return lower_version < upper_version
+    if touching:
+        return lower.inclusive or upper.inclusive
+    return lower.inclusive and upper.inclusive
+
+
+inverted = {
+    GreaterThan: LessEqual,
+    GreaterEqual: LessThan,
+    LessThan: GreaterEqual,
+    LessEqual: GreaterThan,
+}
+
+
+class IntervalSet():
+    """ normalized constraint: sorted, disjoint (lower, upper) intervals
+
+    Bounds are GreaterThan/GreaterEqual resp. LessThan/LessEqual operators
+    or None for unbounded. Union, intersection and complement are linear
+    sweeps over the sorted intervals (union sorts first).
+    """
+    __slots__ = ('intervals',)
+
+    def __init__(self, intervals):
+        self.intervals = intervals
+
+    @classmethod
+    def fromConstraint(cls, constraint):
+        if constraint is all:
+            return cls([(None, None)])
+        if type(constraint) is IntervalSet:
+            return constraint
+        if type(constraint) is Exact:
+            return cls([(GreaterEqual(constraint.version),
+                         LessEqual(constraint.version))])
+        if isinstance(constraint, Operator):
+            if constraint.group == '>':
+                return cls([(constraint, None)])
+            return cls([(None, constraint)])
+        if type(constraint) is And:
+            return cls.intersect(constraint.ranges)
+        if type(constraint) is Or:
+            return cls.unite(constraint.ranges)
+        raise ValueError(constraint)
+
+    @classmethod
+    def unite(cls, constraints):
+        intervals = []
+        for constraint in constraints:
+            intervals.extend(cls.fromConstraint(constraint).intervals)
+        intervals.sort(key=lambda interval: lower_key(interval[0]))
+        merged = []
+        for lower, upper in intervals:
+            if merged and reaches(lower, merged[-1][1], touching=True):
+                if upper_key(upper) > upper_key(merged[-1][1]):
+                    merged[-1] = (merged[-1][0], upper)
+            else:
+                merged.append((lower, upper))
+        return cls(merged)
+
+    @classmethod
+    def intersect(cls, constraints):
+        result = cls([(None, None)])
+        for constraint in constraints:
+            result = result.intersection(cls.fromConstraint(constraint))
+        return result
+
+    def union(self, other):
+        return self.unite([self, other])
+
+    def intersection(self, other):
+        result = []
+        a, b = self.intervals, other.intervals
+        i = j = 0
+        while i < len(a) and j < len(b):
+            lower = max(a[i][0], b[j][0], key=lower_key)
+            upper = min(a[i][1], b[j][1], key=upper_key)
+            if reaches(lower, upper, touching=False):
+                result.append((lower, upper))
+            if upper_key(a[i][1]) < upper_key(b[j][1]):
+                i += 1
+            else:
+                j += 1
+        return IntervalSet(result)
+
+    def complement(self):
+        result = []
+        lower = None
+        for start, end in self.intervals:
+            if start is not None:
+                result.append((lower, inverted[type(start)](start.version)))
+            if end is None:
+                return IntervalSet(result)
+            lower = inverted[type(end)](end.version)
+        result.append((lower, None))
+        return IntervalSet(result)
+
+    def toConstraint(self):
+        """ express as all, single operator, And or Or of those """
+        pieces = []
+        for lower, upper in self.intervals:
+            if lower is not None and upper is not None \
+                    and lower.inclusive and upper.inclusive \
+                    and bound_key(str(lower.version)) == \
+                    bound_key(str(upper.version)):
+                pieces.append(Exact(lower.version))
+            elif lower is None and upper is None:
+                pieces.append(all)
+            elif lower is None or upper is None:
+                pieces.append(lower or upper)
+            else:
+                pieces.append(And([lower, upper]))
+        if len(pieces) == 1:
+            return pieces[0]
+        return Or(pieces)
+
+    def __repr__(self):
+        return 'IntervalSet({!r})'.format(self.intervals)
+
+
+def buildAnd(ops):
+    if len(ops) == 1:
+        return ops[0]
+    return IntervalSet.intersect(ops).toConstraint()
+
+
 def buildOr(ands):
     if len(ands) == 1:
         return ands[0]
-    if not builtins.all(isinstance(_and, And) for _and in ands):
-        return Or(ands)
-    ranges = sorted(ands, key=lambda range: (range.ranges[0].char, range.ranges[0].version))
-    closedRanges = []
-    current = ranges[0]
-    closed = False
-    for range in ranges[1:]:
-        if closed:
-            closedRanges.append(current)
-            current = range
-            continue
-        if rstripZeros(current.ranges[1].version) == \
-                rstripZeros(range.ranges[0].version):
-            current = And([current.ranges[0], range.ranges[1]])
-        else:
-            closed = True
-    if closed:
-        closedRanges.append(current)
-        current = range
-    closedRanges.append(current)
-    if len(closedRanges) < 2:
-        return closedRanges[0]
-    else:
-        return Or(closedRanges)
-    builtins
-    asd
-    by_group = defaultdict(list)
+    return IntervalSet.unite(ands).toConstraint()
+
+
+def candidate_slots(pkg, ops):
+    """ slots that may match all ops (in reversed(pkg.slots) order) """
+    lower = upper = None
     for op in ops:
-        by_group[op.group].append(op)
-    if '=' in by_group:
-        eq = by_group.pop('=')
-        assert len(eq) == 1, 'multiple equals are not implemented yet'
-        return eq[0]
-    # simplify < constraints
-    cleared = []
-    if '>' in by_group:
-        most_specifist = by_group['>'][0]
-        for op in by_group['>'][1:]:
-            if Version(str(op.version)) < Version(str(most_specifist.version)):
-                continue
-            if op.version == most_specifist.version and op.char == '>=':
-                continue
-            most_specifist = op
-        cleared.append(most_specifist)
-    if '<' in by_group:
-        most_specifist = by_group['<'][0]
-        for op in by_group['<'][1:]:
-            if Version(str(op.version)) > Version(str(most_specifist.version)):
-                continue
-            if op.version == most_specifist.version and op.char == '>=':
-                continue
-            most_specifist = op
-        cleared.append(most_specifist)
-    if len(cleared) == 1:
-        return cleared[0]
-    else:
-        return And(cleared)
+        if op.group in ('>', '=') and (lower is None or op.version > lower):
+            lower = op.version
+        if op.group in ('<', '=') and (upper is None or op.version < upper):
+            upper = op.version
+    return pkg.slot_index.overlapping(lower, upper)
+
+
+def slot_alternatives(pkg, ops):
+    """ (slot, needed ops) for every slot with versions matching all ops """
+    if len(ops) == 1 and type(ops[0]) is Exact:
+        version = ops[0].version
+        return [(slot, ops) for slot in candidate_slots(pkg, ops)
+                if slot.min_version <= version < slot.max_version]
+    alternatives = []
+    for slot in candidate_slots(pkg, ops):
+        valid_constraints = []
+        for op in ops:
+            lower = op.op(slot.min_version, op.version)
+            upper = op.op(slot.max_version, op.version)
+            if lower is upper is False:  # matches never
+                break
+            if lower is upper is True:  # matches always
+                pass
+            else:
+                valid_constraints.append(op)
+        else:
+            alternatives.append((slot, valid_constraints))
+    return alternatives
 
 
-def dependencies4Constraints(deb_name, pkg, constraints):
+def format_alternative(pkg, slot, op=None):
+    if op is None:
+        return '{deb}-{slot}'.format(deb=pkg.deb_name, slot=slot.version)
+    return '{dep}-{slot} ({op} {version})'.format(
+        dep=pkg.deb_name,
+        slot=slot.version,
+        op=op.char,
+        version=op.version)
+
+
+def constraint_key(constraints):
+    """ hashable key of a constraint preserving the version spelling """
     if constraints is all:
-        yield Dependency(deb_name, pkg.deb_name)
-        return
-    if type(constraints) is Or:
-        raise NotImplementedError('Cannot generate dependencies for {}: {}'.format(constraints, [s.version for s in pkg.slots]))
+        return ('*',)
+    if isinstance(constraints, Operator):
+        return (constraints.char, str(constraints.version))
     if type(constraints) is And:
-        ors = []
-        for slot in reversed(pkg.slots):
-            valid_constraints = []
-            for op in constraints.ranges:
-                lower = op.op(slot.min_version, Version(str(op.version)))
-                upper = op.op(slot.max_version, Version(str(op.version)))
-                if lower is upper is False:  # matches never
-                    break
-                if lower is upper is True:  # matches always
-                    pass
-                else:
-                    valid_constraints.append(op)
-            else:
-                if not valid_constraints:
-                    ors.append('{deb}-{slot}'.format(
-                        deb=pkg.deb_name,
-                        slot=slot.version))
-                elif len(valid_constraints) == 1:
-                    ors.append('{dep}-{slot} ({op} {version})'.format(
-                        dep=pkg.deb_name,
-                        slot=slot.version,
-                        op=valid_constraints[0].char,
-                        version=valid_constraints[0].version))
-                else:
-                    for op in valid_constraints:
-                        yield Dependency(
-                            deb_name,
-                            '{dep}-{slot} ({op} {version})'.format(
-                                dep=pkg.deb_name,
-                                slot=slot.version,
-                                op=op.char,
-                                version=op.version))
-                    break
-        if ors:
-            yield Dependency(deb_name, ' | '.join(ors))
+        return ('and',) + tuple(sorted(
+            constraint_key(op) for op in constraints.ranges))
+    if type(constraints) is Or:
+        return ('or',) + tuple(
+            constraint_key(piece) for piece in constraints.ranges)
+    raise ValueError(constraints)
+
+
+# pkg id -> (deb name, slot fingerprint, {constraint key: relations});
+# lives as long as the worker process, see invalidate(). The least recently
+# used packages are dropped beyond DEPENDENCY_CACHE_PKGS packages, the
+# relations of a package beyond DEPENDENCY_CACHE_KEYS constraints.
+DEPENDENCY_CACHE_PKGS = 4096
+DEPENDENCY_CACHE_KEYS = 256
+dependency_cache = OrderedDict()
+dependency_cache_lock = threading.Lock()
+
+
+def invalidate(pkg_id):
+    """ forget rendered dependencies on a package (e.g. new slot) """
+    with dependency_cache_lock:
+        dependency_cache.pop(pkg_id, None)
+
+
+def cached_relations(pkg, key):
+    """ relations dict of the current slots of pkg """
+    fingerprint = pkg.slot_index.fingerprint
+    with dependency_cache_lock:
+        entry = dependency_cache.get(pkg.id)
+        if entry is None or entry[0] != pkg.deb_name \
+                or entry[1] != fingerprint \
+                or (key not in entry[2]
+                    and len(entry[2]) >= DEPENDENCY_CACHE_KEYS):
+            entry = dependency_cache[pkg.id] = \
+                (pkg.deb_name, fingerprint, {})
+        dependency_cache.move_to_end(pkg.id)
+        while len(dependency_cache) > DEPENDENCY_CACHE_PKGS:
+            dependency_cache.popitem(last=False)
+        return entry[2]
+
+
+def dependencies4Constraints(deb_name, pkg, constraints):
+    """ Dependency items of deb_name to match constraints on pkg
+
+    The rendered relations are cached per package and slot list.
+    """
+    key = constraint_key(constraints)
+    cache = cached_relations(pkg, key)
+    relations = cache.get(key)
+    if relations is None:
+        relations = cache[key] = tuple(buildDependencies(pkg, constraints))
+    for relation in relations:
+        yield Dependency(deb_name, relation)
+
+
+def buildDependencies(pkg, constraints):
+    """ relations (Depends entries) to match constraints on pkg """
+    if constraints is all:
+        yield pkg.deb_name
         return
     if type(constraints) is Exact:
-        yield Dependency(
-            deb_name,
-            '{dep}-{version}'.format(
-                dep=pkg.deb_name,
-                version=constraints.version))
+        yield '{dep}-{version}'.format(
+            dep=pkg.deb_name,
+            version=constraints.version)
         return
-    if isinstance(constraints, Operator):
-        ors = []
-        for slot in reversed(pkg.slots):
-            lower = constraints.op(slot.min_version,
-                                   Version(str(constraints.version)))
-            upper = constraints.op(slot.max_version,
-                                   Version(str(constraints.version)))
-            if lower is upper is False:  # matches never
-                continue
-            if lower is upper is True:  # matches always
-                ors.append('{dep}-{slot}'.format(
-                    dep=pkg.deb_name,
-                    slot=slot.version))
-            else:
-                ors.append('{dep}-{slot} ({op} {version})'.format(
-                    dep=pkg.deb_name,
-                    slot=slot.version,
-                    op=constraints.char,
-                    version=constraints.version))
-        if ors:
-            yield Dependency(deb_name, ' | '.join(ors))
+    if type(constraints) is Or:
+        if not constraints.ranges:
+            raise ValueError('unsatisfiable constraints on {}'.format(
+                pkg.name))
+        pieces = [piece.ranges if type(piece) is And else [piece]
+                  for piece in constraints.ranges]
+    elif type(constraints) is And:
+        pieces = [constraints.ranges]
+    elif isinstance(constraints, Operator):
+        pieces = [[constraints]]
+    else:
+        raise ValueError(pkg, constraints)
+
+    alternatives = []
+    for piece in reversed(pieces):  # newest first like the slots
+        alternatives.extend(slot_alternatives(pkg, piece))
+    if not alternatives:
         return
-    raise ValueError(deb_name, pkg, constraints)
+    # Debian alternatives can only express one relation per alternative:
+    # a range within a slot needs one relation per bound. Distribute the
+    # alternatives over the bounds,
+    #   (s1 >= a and s1 << b) or s2 == (s1 >= a or s2) and (s1 << b or s2),
+    # which is exact as only one version of s1 can be installed.
+    relations = []
+    for choice in product(*(ops or [None] for slot, ops in alternatives)):
+        relation = ' | '.join(
+            format_alternative(pkg, slot, op)
+            for (slot, ops), op in zip(alternatives, choice))
+        if relation not in relations:
+            relations.append(relation)
+    yield from relations
@@ -1,7 +1,12 @@
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
 from importlib import import_module
 import json
 import logging
+import re
+import select
 import socket
 
 from dateutil.tz import tzlocal
@@ -15,8 +20,108 @@ from debler import config
 log = logging.getLogger(__name__)
 
 
+def string_key(s):
+    """ dpkg order of a non-digit part: ~ < end < letters < others """
+    return tuple(-1 if c == '~' else ord(c) if c.isalpha() else ord(c) + 256
+                 for c in s) + (0,)
+
+
+# end of a version part: above ~ and below any other (string, number) pair
+PART_END = ((0,), 0)
+
+
+def part_key(s):
+    pairs = []
+    for match in version_part_re.finditer(s):
+        if not match.group(0):  # empty match at the end
+            continue
+        pairs.append((string_key(match.group(1)), int(match.group(2) or 0)))
+    # the first pair may have an empty string (leading digits); it is
+    # always kept, so later pairs all start with a non-empty string and
+    # compare against PART_END like dpkg compares them against the end
+    if not pairs:
+        pairs.append(((0,), 0))
+    pairs.append(PART_END)
+    return tuple(pairs)
+
+
+version_part_re = re.compile(r'([^0-9]*)([0-9]*)')
+
+
+@lru_cache(maxsize=65536)
+def version_key(version):
+    """ sort key with dpkg semantics of a Debian version string """
+    epoch = 0
+    if ':' in version:
+        epoch, version = version.split(':', 1)
+    upstream, _, revision = version.rpartition('-')
+    if not upstream:
+        upstream, revision = revision, ''
+    return (int(epoch), part_key(upstream), part_key(revision))
+
+
 class Version(debian_support.Version):
-    pass
+    def _compare(self, other):
+        self_key = version_key(str(self))
+        other_key = version_key(str(other))
+        return (self_key > other_key) - (self_key < other_key)
+
+    def __hash__(self):
+        return hash(version_key(str(self)))
+
+
+@lru_cache(maxsize=65536)
+def parse_version(version):
+    """ shared Version instance for a version string """
+    return Version(version)
+
+
+class SlotIndex():
+    """ slots sorted by their version range [min_version, max_version)
+
+    Allows bisect lookups as long as the slot ranges do not overlap (e.g.
+    slots 4 and 4.2 of the same package); otherwise all slots are scanned.
+    """
+    def __init__(self, slots):
+        self.size = len(slots)
+        self.fingerprint = tuple(str(slot.version) for slot in slots)
+        positions = {id(slot): pos for pos, slot in enumerate(slots)}
+        self.slots = sorted(
+            slots, key=lambda slot: version_key(str(slot.min_version)))
+        self.positions = [positions[id(slot)] for slot in self.slots]
+        self.lower = [version_key(str(slot.min_version))
+                      for slot in self.slots]
+        self.upper = [version_key(str(slot.max_version))
+                      for slot in self.slots]
+        self.disjoint = all(
+            upper <= lower for upper, lower in zip(self.upper, self.lower[1:]))
+
+    def slot_for_version(self, version):
+        """ slot whose range contains version (only for disjoint slots) """
+        if not self.disjoint:
+            return None
+        key = version_key(str(version))
+        pos = bisect_right(self.lower, key) - 1
+        if pos >= 0 and key < self.upper[pos]:
+            return self.slots[pos]
+        return None
+
+    def overlapping(self, lower=None, upper=None):
+        """ slots that may contain versions between lower and upper
+        (inclusive, None is unbounded) in reversed order of pkg.slots """
+        lower = lower and version_key(str(lower))
+        upper = upper and version_key(str(upper))
+        if self.disjoint:
+            start = 0 if lower is None else bisect_left(self.upper, lower)
+            end = self.size if upper is None \
+                else bisect_right(self.lower, upper)
+            candidates = range(start, end)
+        else:
+            candidates = [pos for pos in range(self.size)
+                          if (lower is None or self.upper[pos] >= lower) and
+                          (upper is None or self.lower[pos] <= upper)]
+        return [self.slots[pos] for pos in sorted(
+            candidates, key=self.positions.__getitem__, reverse=True)]
 
 
 class PkgInfo():
@@ -27,6 +132,7 @@ class PkgInfo():
         self.deb_name = deb_name
         self.opts = opts
         self.slots = slots
+        self._slot_index = None
 
     def lookup(self, name, default):
         return self.opts.get('default', {}).get(name, default)
@@ -42,19 +148,37 @@ class PkgInfo():
         return self.lookup(name, default=None)
 
     def __setattr__(self, name, value):
-        if name in ('db', 'id', 'name', 'deb_name', 'opts', 'slots'):
+        if name in ('db', 'id', 'name', 'deb_name', 'opts', 'slots',
+                    '_slot_index'):
             return object.__setattr__(self, name, value)
         return self.set(name, value, context='default')
 
+    @property
+    def slot_index(self):
+        if self._slot_index is None or \
+                self._slot_index.size != len(self.slots):
+            self._slot_index = SlotIndex(self.slots)
+        return self._slot_index
+
+    @staticmethod
+    def slot_matches(slot, parts):
+        slot_parts = str(slot.version).split('.')
+        if len(slot_parts) > len(parts):
+            return False
+        for pos, slot_part in enumerate(slot_parts):
+            if parts[pos] != slot_part:
+                return False
+        return True
+
     def slot_for_version(self, version, create=False):
         parts = str(version).split('.')
-        for slot in self.slots:
-            slot_parts = str(slot.version).split('.')
-            for pos, slot_part in enumerate(slot_parts):
-                if parts[pos] != slot_part:
-                    break
-            else:
-                return slot
+        slot = self.slot_index.slot_for_version(version)
+        if slot is not None and self.slot_matches(slot, parts):
+            return slot
+        if not self.slot_index.disjoint:
+            for slot in self.slots:
+                if self.slot_matches(slot, parts):
+                    return slot
         if not create:
             raise ValueError('No slot for version "{}" ({!r})'.format(
                              version, self))
@@ -78,9 +202,10 @@ class SlotInfo():
         self.db = db
         self.pkg = pkg
         self.id = id
-        self.version = Version(version)
+        self.version = parse_version(version)
         self.config = config
         self.metadata = metadata
+        self._max_version = None
 
     def __repr__(self):
         return 'SlotInfo({!r}, {}, {!r}, {!r}, {!r})'.format(
@@ -92,9 +217,11 @@ class SlotInfo():
 
     @property
     def max_version(self):
-        parts = str(self.version).split('.')
-        parts[-1] = str(int(parts[-1]) + 1)
-        return Version('.'.join(parts) + '~~~')
+        if self._max_version is None:
+            parts = str(self.version).split('.')
+            parts[-1] = str(int(parts[-1]) + 1)
+            self._max_version = parse_version('.'.join(parts) + '~~~')
+        return self._max_version
 
     def versions(self):
         return self.db.get_versions(self)
@@ -108,7 +235,7 @@ class VersionInfo():
         self.db = db
         self.slot = slot
         self.id = id
-        self.version = Version(version)
+        self.version = parse_version(version)
         self.config = config
         self.metadata = metadata
         self.populated = populated
@@ -125,7 +252,7 @@ class RevisionsInfo():
     def __init__(self, id, version, distribution, scheduled_at,
                  builder, built_at, changelog, result):
         self.id = id
-        self.version = Version(version)
+        self.version = parse_version(version)
         self.distribution = distribution
         self.scheduled_at = scheduled_at
         self.builder = builder
@@ -137,14 +264,54 @@ class RevisionsInfo():
 class Database():
     rubygems = 'https://rubygems.org'
 
-    def __init__(self):
+    def __init__(self, *, cache=False):
         self.conn = psycopg2.connect(
             config.database,
             connection_factory=psycopg2.extras.LoggingConnection)
         self.conn.initialize(log)
         self.conn.autocommit = True
+        # with cache, packagers and PkgInfos are loaded once and shared by
+        # all users of this connection (e.g. many apps in one pkgapp run)
+        self.pkgers = {} if cache else None
+        self.pkg_cache = {} if cache else None
+        self.in_transaction = False
+
+    @contextmanager
+    def transaction(self):
+        """ Run all statements of the block in one transaction, committed
+            at its end (or rolled back on errors) """
+        self.conn.autocommit = False
+        self.in_transaction = True
+        try:
+            yield
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            self.in_transaction = False
+            self.conn.autocommit = True
+
+    @contextmanager
+    def savepoint(self, name='debler'):
+        """ Within a transaction: undo only the statements of the block
+            if it fails """
+        c = self.conn.cursor()
+        c.execute('SAVEPOINT {};'.format(name))
+        try:
+            yield
+        except BaseException:
+            c.execute('ROLLBACK TO SAVEPOINT {};'.format(name))
+            raise
+        c.execute('RELEASE SAVEPOINT {};'.format(name))
+
+    def _commit(self):
+        if not self.in_transaction:
+            self.conn.commit()
 
     def get_pkger(self, name):
+        if self.pkgers is not None and name in self.pkgers:
+            return self.pkgers[name]
         c = self.conn.cursor()
         c.execute('SELECT id, config FROM packager WHERE name = %s',
                   (name,))
@@ -153,7 +320,10 @@ class Database():
             raise NotImplementedError('packager "{}" is not defined'
                                       .format(name))
         impl = import_module(result[1].pop('module'))
-        return getattr(impl, 'pkgerInfo')(self, result[0], **result[1])
+        pkger = getattr(impl, 'pkgerInfo')(self, result[0], **result[1])
+        if self.pkgers is not None:
+            self.pkgers[name] = pkger
+        return pkger
 
     def get_pkgers(self):
         c = self.conn.cursor()
@@ -164,20 +334,52 @@ class Database():
             pkgers[name] = getattr(impl, 'pkgerInfo')(self, id, **cfg)
         return pkgers
 
+    # notified with "<pkger_id>:<name>" for every registered package
+    packages_channel = 'debler_packages'
+
     def register_pkg(self, pkger_id, name, config):
+        self.register_pkgs(pkger_id, [name], config)
+
+    def register_pkgs(self, pkger_id, names, config):
         c = self.conn.cursor()
         c.execute("""INSERT INTO packages (pkger_id, name, config)
-             VALUES (%s, %s, %s);""", (pkger_id, name, json.dumps(config)))
-        self.conn.commit()
+             SELECT %s, unnest(%s), %s;""",
+                  (pkger_id, list(names), json.dumps(config)))
+        c.execute("""SELECT pg_notify(%s, %s || ':' || unnest(%s));""",
+                  (self.packages_channel, str(pkger_id), list(names)))
+        self._commit()
+
+    def pkg_names(self, pkger_id):
+        c = self.conn.cursor()
+        c.execute('SELECT name FROM packages WHERE pkger_id = %s',
+                  (pkger_id, ))
+        return {name for name, in c}
+
+    def listen(self, channel):
+        c = self.conn.cursor()
+        c.execute('LISTEN {};'.format(channel))
+
+    def notifications(self, timeout=60):
+        """ Payloads of notifications on the listened channels; blocks
+            while there are none """
+        while True:
+            if select.select([self.conn], [], [], timeout) == ([], [], []):
+                continue
+            self.conn.poll()
+            while self.conn.notifies:
+                yield self.conn.notifies.pop(0).payload
 
     def set_pkg_config(self, pkg_id, config):
         c = self.conn.cursor()
         c.execute('UPDATE packages SET config = %s WHERE id = %s',
                   (json.dumps(config), pkg_id))
-        self.conn.commit()
+        self._commit()
 
     def pkg_info(self, pkger_id, name, deb_name,
                  klass=PkgInfo, slotklass=SlotInfo):
+        if self.pkg_cache is not None \
+                and (pkger_id, name, klass) in self.pkg_cache:
+            return self.pkg_cache[(pkger_id, name, klass)]
         c = self.conn.cursor()
         if pkger_id is not None:
             c.execute('SELECT id, config FROM packages '
@@ -200,15 +402,71 @@ class Database():
         pkg = klass(self, pkg_id, name, deb_name, config, slots)
         for row in c.fetchall():
             slots.append(slotklass(self, pkg, *row))
+        if self.pkg_cache is not None:
+            self.pkg_cache[(pkger_id, name, klass)] = pkg
         return pkg
 
+    def pkg_infos(self, pkger_id, names, name2deb,
+                  klass=PkgInfo, slotklass=SlotInfo):
+        """ PkgInfo of all known names (by name) with two queries """
+        pkgs = {}
+        if self.pkg_cache is not None:
+            for name in names:
+                if (pkger_id, name, klass) in self.pkg_cache:
+                    pkgs[name] = self.pkg_cache[(pkger_id, name, klass)]
+            names = [name for name in names if name not in pkgs]
+            if not names:
+                return pkgs
+        c = self.conn.cursor()
+        c.execute('SELECT id, name, config FROM packages '
+                  'WHERE pkger_id = %s AND name = ANY(%s)',
+                  (pkger_id, list(names)))
+        by_id = {}
+        for pkg_id, name, config in c.fetchall():
+            pkgs[name] = by_id[pkg_id] = klass(
+                self, pkg_id, name, name2deb(name), config, [])
+        if not by_id:
+            return pkgs
+
+        c.execute('SELECT pkg_id, id, version, config, metadata FROM slots '
+                  'WHERE pkg_id = ANY(%s) ORDER BY pkg_id, version',
+                  (list(by_id), ))
+        for pkg_id, *row in c.fetchall():
+            pkg = by_id[pkg_id]
+            pkg.slots.append(slotklass(self, pkg, *row))
+        if self.pkg_cache is not None:
+            for pkg in by_id.values():
+                self.pkg_cache[(pkger_id, pkg.name, klass)] = pkg
+        return pkgs
+
+    def pkgs_fingerprint(self, pkger_id, names):
+        """ digest over config, slots, slot metadata and versions of the
+            given packages; changes whenever app integration may change """
+        c = self.conn.cursor()
+        c.execute('''SELECT md5(string_agg(pkg, E'\\n' ORDER BY pkg))
+                     FROM (SELECT concat_ws(' ', packages.name,
+                                   packages.config::text,
+                                   slots.version, slots.metadata::text,
+                                   (SELECT string_agg(versions.version::text,
+                                                      ',' ORDER BY versions.id)
+                                    FROM versions
+                                    WHERE versions.slot_id = slots.id)) AS pkg
+                           FROM packages
+                           LEFT JOIN slots ON slots.pkg_id = packages.id
+                           WHERE packages.pkger_id = %s
+                             AND packages.name = ANY(%s)) AS pkgs''',
+                  (pkger_id, sorted(names)))
+        return c.fetchone()[0] or ''
+
     def create_pkg_slot(self, pkg, slot):
+        from debler.constraints import invalidate
         c = self.conn.cursor()
         c.execute("""INSERT INTO slots (pkg_id, version) VALUES (%s, %s)
                   RETURNING id, version, config, metadata;""",
                   (pkg.id, slot))
         row = c.fetchone()
-        self.conn.commit()
+        self._commit()
+        invalidate(pkg.id)
         return SlotInfo(self, pkg, *row)
 
     def get_versions(self, slot):
@@ -223,6 +481,22 @@ class Database():
             versions.append(VersionInfo(self, slot, *row))
         return versions
 
+    def slots_versions(self, slots):
+        """ versions of all given slots (by slot id) with one query """
+        by_id = {slot.id: slot for slot in slots}
+        versions = {slot_id: [] for slot_id in by_id}
+        if not by_id:
+            return versions
+        c = self.conn.cursor()
+        c.execute('''SELECT slot_id, id, version, config, metadata, populated
+                     FROM versions
+                     WHERE slot_id = ANY(%s)
+                     ORDER BY version ASC''',
+                  (list(by_id), ))
+        for slot_id, *row in c:
+            versions[slot_id].append(VersionInfo(self, by_id[slot_id], *row))
+        return versions
+
     def get_revisions(self, version):
         c = self.conn.cursor()
         c.execute('''SELECT revisions.id, version,
@@ -259,7 +533,7 @@ class Database():
                      VALUES (%s, %s, %s, %s, %s);""",
                   (result[0], distribution_id, version + '-' + str(revision),
                    now, changelog))
-        self.conn.commit()
+        self._commit()
 
     def schedule_rebuild(self, build_id, changelog):
         now = datetime.now(tz=tzlocal()).strftime('%Y-%m-%d %H:%M:%S %z')
@@ -279,7 +553,7 @@ class Database():
                      VALUES (%s, %s, %s, %s, %s);""",
                   (version_id, distribution_id, version,
                    now, changelog))
-        self.conn.commit()
+        self._commit()
 
     def _dump_builds(self, *, result=None, ids=None):
         c = self.conn.cursor()
@@ -333,6 +607,36 @@ class Database():
     def builds_by_id(self, build_ids, *, all=False):
         yield from self._dump_builds(ids=build_ids)
 
+    def build_counts(self):
+        """ number of pending and building builds and of slots whose
+            latest build (per distribution) failed """
+        c = self.conn.cursor()
+        c.execute('''SELECT CASE WHEN builder IS NULL THEN 'pending'
+                                 ELSE 'building' END AS state,
+                            count(*)
+                     FROM revisions
+                     WHERE result IS NULL
+                     GROUP BY state''')
+        counts = {'pending': 0, 'building': 0, 'failed': 0}
+        counts.update(c.fetchall())
+        # a failed build is superseded by any newer one of its slot
+        c.execute('''SELECT count(*)
+                     FROM revisions AS revs
+                     INNER JOIN versions ON revs.version_id = versions.id
+                     WHERE revs.result = 'failed'
+                       AND NOT EXISTS (
+                         SELECT 1
+                         FROM revisions AS newer_revs
+                         INNER JOIN versions AS newer
+                           ON newer_revs.version_id = newer.id
+                         WHERE newer.slot_id = versions.slot_id
+                           AND newer_revs.distribution_id =
+                               revs.distribution_id
+                           AND (newer.version, newer_revs.version) >
+                               (versions.version, revs.version))''')
+        counts['failed'] = c.fetchone()[0]
+        return counts
+
     def claim_build(self, build_id):
         now = datetime.now(tz=tzlocal()).strftime('%Y-%m-%d %H:%M:%S %z')
         c = self.conn.cursor()
@@ -341,7 +645,7 @@ class Database():
                         built_at = %s
                      WHERE id = %s''',
                   (socket.getfqdn(), now, build_id))
-        self.conn.commit()
+        self._commit()
 
     def update_build(self, build_id, *, result):
         c = self.conn.cursor()
@@ -349,7 +653,7 @@ class Database():
                         result = %s
                      WHERE id = %s''',
                   (result, build_id))
-        self.conn.commit()
+        self._commit()
 
     def build_data(self, build_id):
         c = self.conn.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
@@ -395,4 +699,53 @@ class Database():
         c = self.conn.cursor()
         c.execute('UPDATE slots SET metadata = %s WHERE id = %s',
                   (json.dumps(metadata), slot_id))
-        self.conn.commit()
+        self._commit()
+
+    def update_slot_metadata(self, slot_id, metadata):
+        """ merge the given keys into the metadata of a slot """
+        c = self.conn.cursor()
+        c.execute('UPDATE slots SET metadata = metadata || %s::jsonb '
+                  'WHERE id = %s', (json.dumps(metadata), slot_id))
+        self._commit()
+
+    def record_timings(self, build_id, timings):
+        now = datetime.now(tz=tzlocal()).strftime('%Y-%m-%d %H:%M:%S %z')
+        c = self.conn.cursor()
+        # a retried build replaces the timings of its former attempt
+        c.execute('DELETE FROM timings WHERE revision_id = %s', (build_id, ))
+        for phase, duration in timings.items():
+            c.execute('''INSERT INTO timings
+                            (revision_id, phase, duration, recorded_at)
+                         VALUES (%s, %s, %s, %s)''',
+                      (build_id, phase, duration, now))
+        self._commit()
+
+    def timing_stats(self, *, by, percentiles, pkgs=None, days=None):
+        groups = {
+            'phase': [],
+            'packager': ['packager.name'],
+            'package': ['packager.name', 'packages.name'],
+        }[by] + ['timings.phase']
+        sql = '''SELECT {groups},
+            count(*),
+            percentile_cont(%s::float8[])
+                WITHIN GROUP (ORDER BY timings.duration)
+        FROM timings
+        INNER JOIN revisions AS rev ON timings.revision_id = rev.id
+        INNER JOIN versions ON rev.version_id = versions.id
+        INNER JOIN slots ON versions.slot_id = slots.id
+        INNER JOIN packages ON slots.pkg_id = packages.id
+        INNER JOIN packager ON packages.pkger_id = packager.id
+        WHERE true'''.format(groups=', '.join(groups))
+        values = [list(percentiles)]
+        if pkgs:
+            sql += ' AND packages.name = ANY(%s)'
+            values.append(list(pkgs))
+        if days:
+            sql += " AND timings.recorded_at > now() - %s * interval '1 day'"
+            values.append(days)
+        sql += ' GROUP BY {groups} ORDER BY {groups}'.format(
+            groups=', '.join(groups))
+        c = self.conn.cursor()
+        c.execute(sql, tuple(values))
+        yield from c
@@ -0,0 +1,155 @@
+""" Minimal thread-safe metrics exposed in the Prometheus text format """
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape(value))
+                          for name, value in zip(names, values)) + '}'
+
+
+class Registry():
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def expose(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        return ''.join(line for metric in metrics
+                       for line in metric.expose())
+
+
+REGISTRY = Registry()
+
+
+class Metric():
+    type = 'untyped'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def expose(self):
+        yield '# HELP {} {}\n'.format(self.name, self.help)
+        yield '# TYPE {} {}\n'.format(self.name, self.type)
+        yield from self.samples()
+
+    def samples(self):
+        return []
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield '{}{} {}\n'.format(
+                self.name, format_labels(self.labels, labels),
+                format_value(value))
+
+
+class Gauge(Counter):
+    """ Gauge set explicitly or computed on exposure by callback, which
+        returns the values by label tuple """
+    type = 'gauge'
+
+    def __init__(self, *args, callback=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.callback = callback
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception:
+                log.exception('Could not collect %s', self.name)
+                return
+            with self.lock:
+                self.values = dict(values)
+        yield from super().samples()
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    default_buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30,
+                       60)
+
+    def __init__(self, *args, buckets=default_buckets, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'), )
+        self.values = {}
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts, total = self.values.get(
+                labels, ([0] * len(self.buckets), 0))
+            for pos, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[pos] += 1
+            self.values[labels] = (counts, total + value)
+
+    @contextmanager
+    def time(self, *labels):
+        """ Observe the wall time of the block """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, *labels)
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, (list(counts), total))
+                            for labels, (counts, total)
+                            in self.values.items())
+        for labels, (counts, total) in values:
+            for bound, count in zip(self.buckets, counts):
+                yield '{}_bucket{} {}\n'.format(
+                    self.name,
+                    format_labels(self.labels + ('le', ),
+                                  labels + (format_value(float(bound)), )),
+                    count)
+            yield '{}_sum{} {}\n'.format(
+                self.name, format_labels(self.labels, labels),
+                format_value(total))
+            yield '{}_count{} {}\n'.format(
+                self.name, format_labels(self.labels, labels), counts[-1])
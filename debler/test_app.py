@@ -0,0 +1,115 @@
+import os
+import subprocess
+import tarfile
+from types import SimpleNamespace
+
+import pytest
+
+from debler import config
+from debler.app import AppBuilder
+
+
+def builder(basedir, tmp_dir):
+    app = SimpleNamespace(name='shop', version=(1, 0), basedir=str(basedir),
+                          dirs=['app'], files=['config.ru'], pkgers=[],
+                          homepage='https://shop.example.org',
+                          description='Shop',
+                          pkgers_config={})
+    return AppBuilder(None, str(tmp_dir), app)
+
+
+def write_tree(basedir):
+    basedir.join('app', 'models', 'user.rb').write('class User; end\n',
+                                                   ensure=True)
+    basedir.join('app', 'main.rb').write('require "models/user"\n')
+    basedir.join('config.ru').write('run Shop\n')
+    basedir.join('README').write('not packaged\n')
+
+
+def test_orig_tar_is_cached_by_content(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'appdir', str(tmpdir.join('apps')))
+    basedir = tmpdir.join('src')
+    write_tree(basedir)
+
+    first = builder(basedir, tmpdir.mkdir('build1'))
+    first.build_orig_tar()
+    with tarfile.open(first.orig_tar) as t:
+        assert t.getnames() == ['app', 'app/main.rb', 'app/models',
+                                'app/models/user.rb', 'config.ru']
+        assert {m.mtime for m in t.getmembers()} == {0}
+
+    # unrelated files and mtimes do not matter
+    basedir.join('README').write('changed\n')
+    os.utime(str(basedir.join('config.ru')), (0, 0))
+    second = builder(basedir, tmpdir.mkdir('build2'))
+    second.build_orig_tar()
+    assert os.path.realpath(first.orig_tar) == \
+        os.path.realpath(second.orig_tar)
+
+    basedir.join('app', 'main.rb').write('require "models/admin"\n')
+    third = builder(basedir, tmpdir.mkdir('build3'))
+    third.build_orig_tar()
+    assert os.path.realpath(first.orig_tar) != \
+        os.path.realpath(third.orig_tar)
+
+
+def test_orig_tar_key_uses_git_trees(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'appdir', str(tmpdir.join('apps')))
+    basedir = tmpdir.join('src')
+    write_tree(basedir)
+    git = ['git', '-c', 'user.name=Debler', '-c', 'user.email=d@example.org']
+    subprocess.check_call(['git', 'init', '-q'], cwd=str(basedir))
+    subprocess.check_call(git + ['add', '.'], cwd=str(basedir))
+    subprocess.check_call(git + ['commit', '-q', '-m', 'init'],
+                          cwd=str(basedir))
+
+    first = builder(basedir, tmpdir.mkdir('build1'))
+    key = first.orig_tar_key()
+    assert key.startswith('git-')
+    first.build_orig_tar()
+    with tarfile.open(first.orig_tar) as t:
+        assert 'README' not in t.getnames()
+        assert 'app/models/user.rb' in t.getnames()
+
+    basedir.join('README').write('changed\n')
+    subprocess.check_call(git + ['commit', '-q', '-am', 'readme'],
+                          cwd=str(basedir))
+    assert builder(basedir, tmpdir.mkdir('build2')).orig_tar_key() == key
+
+
+def test_failed_orig_tar_is_not_cached(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'appdir', str(tmpdir.join('apps')))
+    basedir = tmpdir.join('src')
+    write_tree(basedir)
+    failing = builder(basedir, tmpdir.mkdir('build1'))
+
+    def write_orig_tar(fileobj):
+        fileobj.write(b'partial')
+        raise OSError('disk full')
+    monkeypatch.setattr(failing, 'write_orig_tar', write_orig_tar)
+    with pytest.raises(OSError):
+        failing.build_orig_tar()
+    assert os.listdir(failing.orig_cache_dir) == []
+
+
+def test_workspace_is_saved_after_upload_only(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'appdir', str(tmpdir.join('apps')))
+    basedir = tmpdir.mkdir('src')
+    builds = iter(range(1, 10))
+
+    def generate(upload):
+        app_builder = builder(basedir, tmpdir.mkdir(
+            'build{}'.format(next(builds))))
+        app_builder.gen_debian_package()
+        if upload:
+            app_builder.upload_changes = lambda: None
+            app_builder.upload()
+        return str(app_builder.deb_version)
+
+    # failed builds do not use up a revision
+    assert generate(upload=False) == '1.0-1'
+    assert generate(upload=True) == '1.0-1'
+    # reused debian/ output
+    assert generate(upload=False) == '1.0-2'
+    assert generate(upload=True) == '1.0-2'
+    assert generate(upload=False) == '1.0-3'
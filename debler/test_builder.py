@@ -0,0 +1,12 @@
+from debler.builder import BaseBuilder
+
+
+def test_nested_phases_are_prefixed():
+    builder = BaseBuilder()
+    with builder.timed('build_orig_tar'):
+        with builder.timed('build_tarxz'):
+            pass
+    with builder.timed('upload'):
+        pass
+    assert list(builder.timings) == [
+        'build_orig_tar.build_tarxz', 'build_orig_tar', 'upload']
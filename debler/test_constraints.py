@@ -1,9 +1,13 @@
+import pytest
+
 from debler.constraints import GreaterThan, GreaterEqual, \
-    LessThan, LessEqual, \
-    And, \
-    dependencies4Constraints
-from debler.db import PkgInfo, SlotInfo
+    LessThan, LessEqual, Exact, \
+    And, Or, IntervalSet, all, \
+    buildAnd, buildOr, dependencies4Constraints, \
+    dependency_cache, invalidate
+from debler.db import PkgInfo, SlotInfo, Version
 from debler.builder import Dependency
+from debler.bundler import constraints as bundler_constraints
 from debler.yarn.constraints import parseConstraints
 
 
@@ -77,3 +81,133 @@ def test_deps_gt():
     pkg = build_pkg_info('bar', '1.1', '1.2', '1.3')
     assert set(dependencies4Constraints('foo', pkg, parseConstraints('>=1.2.3'))) == \
         {Dependency('foo', 'bar-1.3 | bar-1.2 (>= 1.2.3)')}
+
+
+def test_slot_index_lookup():
+    pkg = build_pkg_info('bar', '1.1', '1.2', '2.0', '1.3')
+    assert pkg.slot_index.disjoint
+    assert str(pkg.slot_for_version('1.2.7').version) == '1.2'
+    assert str(pkg.slot_for_version('1.3.0.beta1').version) == '1.3'
+    assert str(pkg.slot_for_version('2.0').version) == '2.0'
+    with pytest.raises(ValueError):
+        pkg.slot_for_version('1.4.0')
+    assert [str(s.version) for s in pkg.slot_index.overlapping(
+        Version('1.2.3'), Version('2.0'))] == ['1.3', '2.0', '1.2']
+
+
+def test_slot_index_nested_slots():
+    pkg = build_pkg_info('bar', '4', '4.2', '5')
+    assert not pkg.slot_index.disjoint
+    assert str(pkg.slot_for_version('4.2.7').version) == '4'
+    assert str(pkg.slot_for_version('5.0.1').version) == '5'
+    assert [str(s.version) for s in pkg.slot_index.overlapping(
+        Version('4.2.1'))] == ['5', '4.2', '4']
+
+
+def test_slot_index_follows_new_slots():
+    pkg = build_pkg_info('bar', '1.1')
+    assert pkg.slot_index.slot_for_version('1.2.0') is None
+    pkg.slots.append(SlotInfo(None, pkg, None, '1.2', {}, {}))
+    assert str(pkg.slot_for_version('1.2.0').version) == '1.2'
+
+
+def test_deps_many_slots():
+    pkg = build_pkg_info('bar', *['{}.{}'.format(major, minor)
+                                  for major in range(1, 6)
+                                  for minor in range(10)])
+    assert set(dependencies4Constraints(
+        'foo', pkg, parseConstraints('>=3.8.1 <4.1'))) == \
+        {Dependency('foo', 'bar-4.0 | bar-3.9 | bar-3.8 (>= 3.8.1)')}
+
+
+def test_interval_intersection():
+    assert buildAnd([And([GreaterEqual('1.2'), LessThan('2')]),
+                     And([GreaterThan('1.5'), LessEqual('3')])]) == \
+        And([GreaterThan('1.5'), LessThan('2')])
+    assert buildAnd([GreaterEqual('1.2'), LessEqual('1.2.0')]) == \
+        Exact('1.2')
+    assert buildAnd([GreaterEqual('2'), LessThan('1')]) == Or([])
+
+
+def test_interval_union():
+    assert buildOr([And([GreaterEqual('1'), LessThan('2')]),
+                    And([GreaterEqual('3'), LessThan('4')]),
+                    And([GreaterEqual('2.0'), LessThan('2.5')])]) == \
+        Or([And([GreaterEqual('1'), LessThan('2.5')]),
+            And([GreaterEqual('3'), LessThan('4')])])
+    assert buildOr([LessThan('2'), GreaterThan('2')]) == \
+        Or([LessThan('2'), GreaterThan('2')])
+    assert buildOr([LessThan('2'), GreaterEqual('2')]) is all
+
+
+def test_interval_complement():
+    assert IntervalSet.fromConstraint(Exact('1.2')).complement() \
+        .toConstraint() == Or([LessThan('1.2'), GreaterThan('1.2')])
+    assert IntervalSet.fromConstraint(
+        And([GreaterEqual('1'), LessThan('2')])).complement() \
+        .complement().toConstraint() == \
+        And([GreaterEqual('1'), LessThan('2')])
+
+
+def test_deps_or():
+    pkg = build_pkg_info('bar', '1.1', '1.2', '2.0', '2.1', '3.0')
+    assert set(dependencies4Constraints(
+        'foo', pkg, parseConstraints('^1.2.3 || ^2.1'))) == \
+        {Dependency('foo', 'bar-2.1 | bar-1.2 (>= 1.2.3)')}
+
+
+def test_deps_or_exact():
+    pkg = build_pkg_info('bar', '1.1', '1.2', '2.0')
+    assert set(dependencies4Constraints(
+        'foo', pkg, parseConstraints('1.1.4 || >=2'))) == \
+        {Dependency('foo', 'bar-2.0 | bar-1.1 (= 1.1.4)')}
+
+
+def test_deps_range_within_slot():
+    pkg = build_pkg_info('bar', '1.1', '1.2', '1.3')
+    assert set(dependencies4Constraints(
+        'foo', pkg, parseConstraints('>=1.2.3 <1.2.7'))) == \
+        {Dependency('foo', 'bar-1.2 (>= 1.2.3)'),
+         Dependency('foo', 'bar-1.2 (<< 1.2.7)')}
+
+
+def test_deps_or_range_within_slot():
+    pkg = build_pkg_info('bar', '1.1', '1.2', '1.3', '2.0')
+    assert list(dependencies4Constraints(
+        'foo', pkg, parseConstraints('>=1.2.3 <1.2.7 || >=2'))) == \
+        [Dependency('foo', 'bar-2.0 | bar-1.2 (>= 1.2.3)'),
+         Dependency('foo', 'bar-2.0 | bar-1.2 (<< 1.2.7)')]
+
+
+def test_rendered_dependencies_are_cached():
+    pkg = build_pkg_info('cached', '1.1', '1.2')
+    pkg.id = 4711
+    constraints = parseConstraints('>=1.1.5')
+    assert list(dependencies4Constraints('foo', pkg, constraints)) == \
+        [Dependency('foo', 'cached-1.2 | cached-1.1 (>= 1.1.5)')]
+    assert list(dependencies4Constraints('baz', pkg, constraints)) == \
+        [Dependency('baz', 'cached-1.2 | cached-1.1 (>= 1.1.5)')]
+    assert len(dependency_cache[4711][2]) == 1
+
+    pkg.slots.append(SlotInfo(None, pkg, None, '1.3', {}, {}))
+    assert list(dependencies4Constraints('foo', pkg, constraints)) == \
+        [Dependency('foo', 'cached-1.3 | cached-1.2 | cached-1.1 (>= 1.1.5)')]
+    invalidate(4711)
+    assert 4711 not in dependency_cache
+
+
+def test_dependency_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr('debler.constraints.DEPENDENCY_CACHE_PKGS', 2)
+    for pkg_id in (1, 2, 3):
+        pkg = build_pkg_info('bounded{}'.format(pkg_id), '1.1')
+        pkg.id = pkg_id
+        list(dependencies4Constraints('foo', pkg, all))
+    assert 1 not in dependency_cache
+    assert 2 in dependency_cache and 3 in dependency_cache
+
+
+def test_cached_constraints_are_immutable():
+    constraints = bundler_constraints.parseRequirements(
+        (('>=', '1.2'), ('<', '2')))
+    assert type(constraints.ranges) is tuple
+    assert type(parseConstraints('^1.2 || ^3').ranges) is tuple
@@ -0,0 +1,33 @@
+import itertools
+
+from debian.debian_support import NativeVersion
+import pytest
+
+from debler.db import Version, parse_version, version_key
+
+
+VERSIONS = [
+    '1.0~~~', '1.0~beta1', '1.0', '1.0-0', '1.0-1', '1.0-1.1', '1.0-2',
+    '1.0.0', '1.0.1~~~', '1.0.1', '1.0a', '1.0+git', '1.1', '1.10', '1:0.1',
+    '2.3.6', '2.3.6.1', '1:0.9~rc1-3', '0', '0~rc1', '1.0-0~1',
+]
+
+
+@pytest.mark.parametrize('a,b', itertools.product(
+    VERSIONS, repeat=2))
+def test_version_key_matches_dpkg(a, b):
+    expected = NativeVersion(a)._compare(NativeVersion(b))
+    assert (version_key(a) > version_key(b)) - \
+        (version_key(a) < version_key(b)) == \
+        (expected > 0) - (expected < 0)
+
+
+def test_version_compare():
+    assert Version('2.3.6') > Version('2.3.5')
+    assert Version('1.0') == Version('1.0-0')
+    assert hash(Version('1.0')) == hash(Version('1.0-0'))
+    assert Version('1.0.1~~~') < '1.0.1'
+
+
+def test_parse_version_is_shared():
+    assert parse_version('1.2.3') is parse_version('1.2.3')
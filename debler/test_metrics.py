@@ -0,0 +1,48 @@
+from debler.metrics import Counter, Gauge, Histogram, Metric, Registry
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    counter = Counter('hooks_total', 'Hooks', ['outcome'], registry=registry)
+    counter.inc('scheduled')
+    counter.inc('scheduled')
+    counter.inc('unknown "gem"')
+    Gauge('queue_depth', 'Depth', registry=registry,
+          callback=lambda: {(): 3})
+    assert registry.expose() == '''# HELP hooks_total Hooks
+# TYPE hooks_total counter
+hooks_total{outcome="scheduled"} 2
+hooks_total{outcome="unknown \\"gem\\""} 1
+# HELP queue_depth Depth
+# TYPE queue_depth gauge
+queue_depth 3
+'''
+
+
+def test_histogram():
+    registry = Registry()
+    histogram = Histogram('hook_seconds', 'Hook runtime', ['hook'],
+                          buckets=[0.1, 1], registry=registry)
+    histogram.observe(0.05, 'gem')
+    histogram.observe(0.5, 'gem')
+    histogram.observe(5, 'gem')
+    assert registry.expose() == '''# HELP hook_seconds Hook runtime
+# TYPE hook_seconds histogram
+hook_seconds_bucket{hook="gem",le="0.1"} 1
+hook_seconds_bucket{hook="gem",le="1.0"} 2
+hook_seconds_bucket{hook="gem",le="+Inf"} 3
+hook_seconds_sum{hook="gem"} 5.55
+hook_seconds_count{hook="gem"} 3
+'''
+
+
+def test_failing_callback_exposes_no_samples():
+    registry = Registry()
+    Gauge('builds', 'Builds', registry=registry, callback=lambda: 1 / 0)
+    assert registry.expose() == '# HELP builds Builds\n# TYPE builds gauge\n'
+
+
+def test_metric_without_samples():
+    registry = Registry()
+    Metric('info', 'Info', registry=registry)
+    assert registry.expose() == '# HELP info Info\n# TYPE info untyped\n'
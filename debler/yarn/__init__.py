@@ -1,3 +1,4 @@
+from ..builder import BaseBuilder
 from ..pkger import Packager
 
 from .appinfo import YarnAppInfo
@@ -21,7 +22,19 @@ class YarnPackager(Packager):
             self.db.register_pkg(self.id, name, {})
             return self.db.pkg_info(self.id, name, self.name2deb(name))
 
+    def pkg_infos(self, names, autocreate=False):
+        names = set(names)
+        infos = self.db.pkg_infos(self.id, names, self.name2deb)
+        missing = names - set(infos)
+        if missing:
+            if not autocreate:
+                raise ValueError('Pkgs {} unknown in pkger {}'.format(
+                    ', '.join(sorted(missing)), self.id))
+            self.db.register_pkgs(self.id, sorted(missing), {})
+            infos.update(self.db.pkg_infos(self.id, missing, self.name2deb))
+        return infos
+
     def name2deb(self, name):
-        return 'debler-yarn-' + name.lower().replace('_', '--')
+        return BaseBuilder.npm2deb(name)
 
 pkgerInfo = YarnPackager
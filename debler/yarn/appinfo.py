@@ -1,9 +1,10 @@
+import hashlib
 import json
 import os.path
 
 from .lock import YarnLockParser
 from debler.app import BasePackagerAppInfo
-from ..db import Version
+from ..db import parse_version
 from debler import config
 
 
@@ -19,7 +20,7 @@ class YarnAppInfo(BasePackagerAppInfo):
                  keywords=None, **extra):
         super().__init__(pkger, app)
 
-        self.subdir = dir
+        self.subdir = subdir
         self.name = name
         self.version = version
         self.description = description
@@ -45,25 +46,60 @@ class YarnAppInfo(BasePackagerAppInfo):
         with open(os.path.join(basedir, 'package.json'), 'r') as f:
             opts = json.loads(f.read())
         with open(os.path.join(basedir, 'yarn.lock'), 'r') as f:
-            lock = YarnLockParser(f.read())
+            lock = YarnLockParser(f)
         return cls(pkger, app,
                    subdir=subdir,
                    withDevDependencies=withDevDependencies,
                    lock=lock,
                    **opts)
 
-    def schedule_dep_builds(self):
-        for pkg in self.lock.pkgs:
-            info = self.pkger.pkg_info(pkg.name, autocreate=True)
-            slot = info.slot_for_version(pkg.version, create=True)
-            versions = slot.versions()
+    def schedule_dep_builds(self, *, scheduled=None, **kwargs):
+        # yarn.lock resolves many specs to the same name@version
+        versions = {}
+        for name, version in self.lock.by_version:
+            versions.setdefault(name, []).append(version)
+        infos = self.pkger.pkg_infos(versions, autocreate=True)
+
+        # only the newest locked version per slot needs to be packaged
+        newest = {}
+        for name, pkg_versions in versions.items():
+            info = infos[name]
+            for version in pkg_versions:
+                slot = info.slot_for_version(version, create=True)
+                if slot.id not in newest or \
+                        parse_version(version) > newest[slot.id][1]:
+                    newest[slot.id] = (slot, parse_version(version))
+
+        if scheduled is not None:
+            # already handled for another app of this run
+            for slot_id, (slot, version) in list(newest.items()):
+                if (slot_id, str(version)) in scheduled:
+                    del newest[slot_id]
+                else:
+                    scheduled.add((slot_id, str(version)))
+        known = self.pkger.db.slots_versions(
+            slot for slot, _ in newest.values())
+        for slot, version in newest.values():
+            versions = known[slot.id]
             if len(versions) < 1:
                 slot.create(
-                    version=pkg.version, revision=1,
+                    version=str(version), revision=1,
                     changelog='Import newly into debler',
                     distribution=config.distribution)
-            elif Version(pkg.version) > versions[-1].version:
+            elif version > versions[-1].version:
                 slot.create(
-                    version=pkg.version, revision=1,
+                    version=str(version), revision=1,
                     changelog='Update to version used in application',
                     distribution=config.distribution)
+
+    def fingerprint(self):
+        """ digest over everything the app integration depends on """
+        digest = hashlib.sha256()
+        basedir = os.path.join(self.app.basedir, self.subdir)
+        for filename in ('package.json', 'yarn.lock'):
+            with open(os.path.join(basedir, filename), 'rb') as f:
+                digest.update(f.read())
+        digest.update(self.subdir.encode('utf-8'))
+        digest.update(self.pkger.db.pkgs_fingerprint(
+            self.pkger.id, self.lock.by_name).encode('utf-8'))
+        return digest.hexdigest()
@@ -1,17 +1,86 @@
+import os.path
+
+from ..builder import BaseBuilder, Dependency, Symlink, InstallContent
+from ..db import parse_version
+from .lock import hoist
+
+
 class YarnAppIntegrator():
+    """ wire the packaged node modules into the node_modules of the app
+
+    The hoisted layout of yarn.lock becomes a symlink farm pointing to
+    /usr/share/node-debler/<name>-<slot>. Packages which contain nested
+    node_modules (version conflicts) can not be linked as a whole; they
+    become real directories linking every top-level entry recorded by the
+    yarn builder. Node has to resolve modules without following symlinks
+    (NODE_PRESERVE_SYMLINKS=1), which the generated launcher
+    /usr/bin/<app>[-<subdir>]-node sets.
+    """
     def __init__(self, pkger, app, builder):
-        self.pgker = pkger
+        self.pkger = pkger
         self.app = app
+        self.builder = builder
+
+    @property
+    def node_modules(self):
+        return os.path.normpath(os.path.join(
+            '/usr/share', self.app.app.name, self.app.subdir,
+            'node_modules'))
+
+    @property
+    def launcher_name(self):
+        subdir = os.path.normpath(self.app.subdir).strip('/')
+        if subdir == '.':
+            return self.app.app.name + '-node'
+        return '{}-{}-node'.format(self.app.app.name,
+                                   subdir.replace('/', '-'))
+
+    def link_path(self, path):
+        return self.node_modules + ''.join(
+            '/' + name + '/node_modules' for name in path[:-1]) + \
+            '/' + path[-1]
 
     def generate_control_content(self):
-        if False:
-            yield None
-        return
-        base_dir = '/usr/share/{}/{}'.format(self.app.name, self.app.npm.dir)
-        new_deps, new_symlinks = self.app.npm.needed_relations(base_dir)
-        deps.extend(new_deps)
-        self.symlinks['all'].extend(new_symlinks)
+        deb_name = self.builder.deb_name
+        layout = hoist(self.app.lock, self.app.dependencies)
+        infos = self.pkger.pkg_infos({pkg.name for pkg in layout.values()})
+        # all packages containing nested packages
+        materialized = {path[:depth] for path in layout
+                        for depth in range(1, len(path))}
+
+        needed = {}
+        for path, pkg in layout.items():
+            slot = infos[pkg.name].slot_for_version(pkg.version)
+            slot_name = '{}-{}'.format(pkg.name, slot.version)
+            target = '/usr/share/node-debler/' + slot_name
+            link = self.link_path(path)
+            if path in materialized:
+                if 'files' not in slot.metadata:
+                    raise ValueError(
+                        '{} needs nested node_modules, but the file list of '
+                        '{} is unknown - rebuild it'.format(
+                            '/'.join(path), slot_name))
+                for file in slot.metadata['files']:
+                    yield Symlink(deb_name, target + '/' + file,
+                                  link + '/' + file)
+            else:
+                yield Symlink(deb_name, target, link)
+            dep = BaseBuilder.npm2deb(slot_name)
+            version = parse_version(pkg.version)
+            if dep not in needed or version > needed[dep]:
+                needed[dep] = version
+        for dep, version in sorted(needed.items()):
+            yield Dependency(deb_name, '{} (>= {})'.format(dep, version))
 
     def generate_rules_content(self):
-        if False:
-            yield None
+        yield InstallContent(
+            self.builder.deb_name,
+            name='bin/' + self.launcher_name,
+            dest='/usr/bin',
+            mode=0o755,
+            content='''#!/bin/sh
+# node must resolve the linked packages relative to node_modules
+export NODE_PRESERVE_SYMLINKS=1
+cd "{dir}"
+exec /usr/bin/node "$@"
+'''.format(dir=os.path.dirname(self.node_modules)))
@@ -20,6 +20,7 @@ from ..constraints import dependencies4Constraints
 
 class YarnBuilder(BaseBuilder):
     def __init__(self, pkger, tmp_dir, build_id):
+        super().__init__()
         self.pkger = pkger
         self.db = pkger.db
         self.tmp_dir = tmp_dir
@@ -43,8 +44,10 @@ class YarnBuilder(BaseBuilder):
 
     def generate(self):
         self.create_dirs()
-        self.fetch_source()
-        self.parse_metadata()
+        with self.timed('fetch_source'):
+            self.fetch_source()
+        with self.timed('parse_metadata'):
+            self.parse_metadata()
 
         super().generate()
 
@@ -76,8 +79,10 @@ class YarnBuilder(BaseBuilder):
     def fetch_source(self):
         if not os.path.isfile(self.src_file):
             subprocess.check_call(['wget',
-                                   'https://registry.yarnpkg.com/{pkg}/-/{pkg}-{version}.tgz'
-                                  .format(pkg=self.orig_name, version=self.pkg_version),
+                                   'https://registry.yarnpkg.com/{pkg}/-/{name}-{version}.tgz'
+                                  .format(pkg=self.orig_name,
+                                          name=self.orig_name.split('/')[-1],
+                                          version=self.pkg_version),
                                    '-O', self.src_file])
 
     @property
@@ -103,7 +108,8 @@ class YarnBuilder(BaseBuilder):
     def build_orig_tar(self):
         if os.path.isfile(self.orig_tar):
             return
-        self.build_tarxz()
+        with self.timed('build_tarxz'):
+            self.build_tarxz()
         os.symlink(self.tarxz_file, self.orig_tar)
 
     def generate_control_content(self):
@@ -139,10 +145,6 @@ class YarnBuilder(BaseBuilder):
 
         # todo
         for name, constraints in self.metadata.dependencies.items():
-            if name[0] == '@':  # scoped module
-                # we do not know how to correctly handle them,
-                # so skip them for now
-                continue
             yield from dependencies4Constraints(self.deb_name, self.pkger.pkg_info(name),
                                                 parseConstraints(constraints))
         #new_deps, self.symlinks = self.metadata.needed_relations('/usr/share/node-debler/{}/'.format(self.pkg_name))
@@ -171,6 +173,7 @@ class YarnBuilder(BaseBuilder):
         yield RuleOverride('test')
         yield RuleOverride('install')
 
+        files = set()
         with tarfile.open(self.tarxz_file, 'r:xz') as t:
             members = t.getmembers()
             for member in members:
@@ -181,6 +184,7 @@ class YarnBuilder(BaseBuilder):
                     continue
                 if filename.startswith('docs'):
                     continue
+                files.add(filename.split('/')[0])
                 yield InstallInto(
                     self.deb_name,
                     filename,
@@ -188,3 +192,7 @@ class YarnBuilder(BaseBuilder):
                         name=self.pkg_name,
                         dir='/'.join(os.path.dirname(member.name)
                                      .split('/')[1:])))
+        # top-level entries of the package, needed by app integrators to
+        # materialize nested node_modules
+        self.db.update_slot_metadata(self.build.slot_id,
+                                     {'files': sorted(files)})
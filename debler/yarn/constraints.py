@@ -1,4 +1,4 @@
-from functools import partial
+from functools import lru_cache, partial
 import re
 
 from debler.constraints import GreaterThan, GreaterEqual, \
@@ -96,6 +96,7 @@ eval_by_op = {
 }
 
 
+@lru_cache(maxsize=4096)
 def parseConstraints(constraints):
     if not constraints.strip():
         return all
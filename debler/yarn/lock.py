@@ -1,12 +1,20 @@
+from collections import deque, OrderedDict
+
+
 class PkgInfo():
+    __slots__ = ('name', 'constraints', 'version', 'resolved', 'integrity',
+                 'dependencies', 'optionalDependencies')
+
     def __init__(self, name, constraints,
-                 version, resolved,
-                 dependencies={}, optionalDependencies={}):
+                 version, resolved=None, integrity=None,
+                 dependencies=None, optionalDependencies=None):
         self.name = name
         self.constraints = constraints
         self.version = version
         self.resolved = resolved
-        self.dependencies = dependencies
+        self.integrity = integrity
+        self.dependencies = dependencies or {}
+        self.optionalDependencies = optionalDependencies or {}
 
     def __repr__(self):
         return 'PkgInfo({!r}, {!r}, {!r}, {!r}, {!r})'.format(
@@ -17,44 +25,129 @@ class PkgInfo():
             self.dependencies)
 
 
+def unquote(value):
+    if len(value) > 1 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def split_spec(spec):
+    """ split name@constraint, names may be scoped (@scope/name) """
+    pos = spec.index('@', 1)
+    return spec[:pos], spec[pos + 1:]
+
+
 class YarnLockParser():
+    """ line oriented parser for yarn.lock (v1) files
+
+    content can be the whole file or any iterable of lines (like an open
+    file). Entries are available as list (pkgs) and indexed by name
+    (by_name), by (name, version) (by_version) and by (name, constraint)
+    (by_spec).
+    """
+    fields = set(PkgInfo.__slots__) - {'name', 'constraints'}
+
     def __init__(self, content):
-        start = content.index('# yarn lockfile v1')
+        if isinstance(content, str):
+            content = content.split('\n')
         self.pkgs = []
-        pkgs = content[start+18:].strip().split('\n\n')
-        for pkg in pkgs:
-            self.parse_pkg(pkg)
-
-    def parse_pkg(self, data):
-        lines = data.strip().split('\n')
-        what = lines.pop(0)
-        assert what[-1] == ':'
-        name = None
-        constraints = []
-        for part in what[:-1].split(', '):
-            if part[0] == part[-1] == '"':
-                part = part[1:-1]
-            cur_name, cur_constraint = part.rsplit('@', 1)
-            if name is None:
-                name = cur_name
-            else:
-                assert cur_name == name
-            constraints.append(cur_constraint)
-        extras = {}
-        cur = None
-        for line in lines:
-            if line[2] != ' ':  # top level
-                cur = extras
-            if line[-1] != ':':
-                key, value = line.lstrip().split(' ', 1)
-                if value[0] == value[-1] == '"':
-                    value = value[1:-1]
-                cur[key] = value
+        self.by_name = {}
+        self.by_version = {}
+        self.by_spec = {}
+        header = False
+        specs = None
+        fields = None
+        nested = None
+        for line in content:
+            line = line.rstrip('\r\n')
+            if not line or line[0] == '#':
+                if line.startswith('# yarn lockfile v1'):
+                    header = True
+                continue
+            if not header:
+                raise ValueError('missing yarn lockfile v1 header')
+            if line[0] != ' ':  # new entry
+                if specs is not None:
+                    self.add(specs, fields)
+                assert line[-1] == ':', line
+                specs = [split_spec(unquote(spec.strip()))
+                         for spec in line[:-1].split(',')]
+                fields = {}
+                nested = None
+            elif line[2] != ' ':  # field of entry
+                if line[-1] == ':':
+                    nested = fields[line[2:-1].strip()] = {}
+                else:
+                    key, value = line[2:].split(' ', 1)
+                    fields[key] = unquote(value.strip())
+                    nested = None
+            else:  # e.g. dependencies
+                key, value = line.strip().split(' ', 1)
+                nested[unquote(key)] = unquote(value.strip())
+        if not header:
+            raise ValueError('missing yarn lockfile v1 header')
+        if specs is not None:
+            self.add(specs, fields)
+
+    def add(self, specs, fields):
+        name = specs[0][0]
+        for cur_name, _ in specs:
+            assert cur_name == name, specs
+        pkg = PkgInfo(name, [constraint for _, constraint in specs],
+                      **{key: value for key, value in fields.items()
+                         if key in self.fields})
+        self.pkgs.append(pkg)
+        self.by_name.setdefault(name, []).append(pkg)
+        self.by_version.setdefault((name, pkg.version), pkg)
+        for constraint in pkg.constraints:
+            self.by_spec[(name, constraint)] = pkg
+
+
+def hoist(lock, dependencies, max_depth=32):
+    """ compute a node_modules layout like yarn does
+
+    Returns an OrderedDict mapping paths (tuple of package names, e.g.
+    ('debug', 'ms') for node_modules/debug/node_modules/ms) to the lock
+    entries. Dependencies are placed at the top level whenever possible;
+    if another version of the same package is already visible from the
+    requiring package, it is nested below the requiring package.
+    """
+    def lookup(name, spec):
+        try:
+            return lock.by_spec[(name, spec)]
+        except KeyError:
+            raise ValueError('{}@{} is missing in yarn.lock'.format(
+                name, spec))
+
+    layout = {}
+    queue = deque()
+    for name, spec in sorted(dependencies.items()):
+        pkg = lookup(name, spec)
+        layout[(name, )] = pkg
+        queue.append(((name, ), pkg))
+
+    while queue:
+        path, pkg = queue.popleft()
+        requirements = sorted(pkg.dependencies.items())
+        requirements += sorted(
+            (name, spec) for name, spec in pkg.optionalDependencies.items()
+            if (name, spec) in lock.by_spec)
+        for name, spec in requirements:
+            dep = lookup(name, spec)
+            # node searches node_modules from the package upwards:
+            for depth in range(len(path), -1, -1):
+                visible = layout.get(path[:depth] + (name, ))
+                if visible is not None:
+                    break
+            if visible is not None and visible.version == dep.version:
+                continue
+            if visible is None:
+                target = (name, )
             else:
-                cur = {}
-                extras[line[2:-1].strip()] = cur
-        if name[0] == '@':  # scoped module
-            # we do not know how to correctly handle them,
-            # so skip them for now
-            return
-        self.pkgs.append(PkgInfo(name, constraints, **extras))
+                target = path + (name, )
+                if len(target) > max_depth:
+                    raise ValueError('cannot hoist {}@{}: nested too '
+                                     'deep'.format(name, spec))
+            layout[target] = dep
+            queue.append((target, dep))
+    return OrderedDict(sorted(layout.items()))
@@ -0,0 +1,72 @@
+from debler.db import PkgInfo, SlotInfo
+from debler.yarn.appinfo import YarnAppInfo
+from debler.yarn.lock import YarnLockParser
+
+
+LOCK = '''# yarn lockfile v1
+
+
+debug@2.6.9, debug@^2.6.0, debug@~2.6.1:
+  version "2.6.9"
+
+debug@^2.2.0:
+  version "2.2.0"
+
+debug@^4.1.0:
+  version "4.1.1"
+
+ms@2.0.0, ms@^2.0.0:
+  version "2.0.0"
+'''
+
+
+class FakeDb():
+    def __init__(self):
+        self.queries = 0
+        self.scheduled = []
+        self.slots = 0
+
+    def create_pkg_slot(self, pkg, slot):
+        self.slots += 1
+        return SlotInfo(self, pkg, self.slots, slot, {}, {})
+
+    def slots_versions(self, slots):
+        self.queries += 1
+        return {slot.id: [] for slot in slots}
+
+    def schedule_build(self, slot, *, version, **kwargs):
+        self.scheduled.append((slot.pkg.name, str(slot.version), version))
+
+
+class FakePkger():
+    def __init__(self):
+        self.db = FakeDb()
+        self.infos = {}
+
+    def pkg_infos(self, names, autocreate=False):
+        self.db.queries += 1
+        for name in names:
+            self.infos.setdefault(
+                name, PkgInfo(self.db, None, name, name, {}, []))
+        return {name: self.infos[name] for name in names}
+
+
+def test_schedule_newest_version_per_slot():
+    pkger = FakePkger()
+    app = YarnAppInfo(pkger, None, name='app', version='1.0',
+                      lock=YarnLockParser(LOCK))
+    app.schedule_dep_builds()
+    assert pkger.db.queries == 2
+    assert sorted(pkger.db.scheduled) == [
+        ('debug', '2', '2.6.9'), ('debug', '4', '4.1.1'),
+        ('ms', '2', '2.0.0')]
+
+
+def test_schedule_once_for_many_apps():
+    pkger = FakePkger()
+    scheduled = set()
+    for name in ('shop', 'admin'):
+        app = YarnAppInfo(pkger, None, name=name, version='1.0',
+                          lock=YarnLockParser(LOCK))
+        app.schedule_dep_builds(scheduled=scheduled)
+    assert len(pkger.db.scheduled) == 3
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+
+from debler.builder import Dependency, Symlink, InstallContent
+from debler.db import PkgInfo, SlotInfo
+from debler.yarn.appintegrator import YarnAppIntegrator
+from debler.yarn.lock import YarnLockParser
+from debler.yarn.test_lock import HOIST_LOCK
+
+
+class FakePkger():
+    def __init__(self, files):
+        self.files = files
+
+    def pkg_infos(self, names, autocreate=False):
+        infos = {}
+        for name in names:
+            info = infos[name] = PkgInfo(None, None, name, name, {}, [])
+            for slot in ('1', '2', '4'):
+                metadata = {}
+                if self.files:
+                    metadata['files'] = ['index.js', 'package.json']
+                info.slots.append(SlotInfo(None, info, None, slot, {},
+                                           metadata))
+        return infos
+
+
+def integrator(dependencies, files=True, subdir='frontend'):
+    app = SimpleNamespace(
+        app=SimpleNamespace(name='shop'), subdir=subdir,
+        lock=YarnLockParser(HOIST_LOCK), dependencies=dependencies)
+    return YarnAppIntegrator(FakePkger(files), app,
+                             SimpleNamespace(deb_name='shop'))
+
+
+def test_symlink_farm():
+    actions = list(integrator({'a': '^1.0.0'}).generate_control_content())
+    assert actions == [
+        Symlink('shop', '/usr/share/node-debler/a-1',
+                '/usr/share/shop/frontend/node_modules/a'),
+        Symlink('shop', '/usr/share/node-debler/debug-2',
+                '/usr/share/shop/frontend/node_modules/debug'),
+        Symlink('shop', '/usr/share/node-debler/ms-2',
+                '/usr/share/shop/frontend/node_modules/ms'),
+        Dependency('shop', 'debler-yarn-a-1 (>= 1.0.0)'),
+        Dependency('shop', 'debler-yarn-debug-2 (>= 2.6.9)'),
+        Dependency('shop', 'debler-yarn-ms-2 (>= 2.0.0)'),
+    ]
+
+
+def test_nested_packages_are_materialized():
+    actions = list(integrator({'a': '^1.0.0', 'debug': '^4.0.0'})
+                   .generate_control_content())
+    links = [(a.src, a.dest) for a in actions if type(a) is Symlink]
+    base = '/usr/share/shop/frontend/node_modules'
+    assert (base + '/a/index.js',
+            '/usr/share/node-debler/a-1/index.js') in links
+    assert (base + '/a/node_modules/debug/package.json',
+            '/usr/share/node-debler/debug-2/package.json') in links
+    assert (base + '/a/node_modules/debug/node_modules/ms',
+            '/usr/share/node-debler/ms-2') in links
+    assert (base + '/debug', '/usr/share/node-debler/debug-4') in links
+    assert Dependency('shop', 'debler-yarn-ms-2 (>= 2.1.2)') in actions
+
+
+def test_nested_packages_need_file_list():
+    with pytest.raises(ValueError):
+        list(integrator({'a': '^1.0.0', 'debug': '^4.0.0'}, files=False)
+             .generate_control_content())
+
+
+def test_launcher_preserves_symlinks():
+    launcher, = integrator({}).generate_rules_content()
+    assert type(launcher) is InstallContent
+    assert (launcher.name, launcher.dest) == ('bin/shop-frontend-node',
+                                              '/usr/bin')
+    assert 'export NODE_PRESERVE_SYMLINKS=1\n' in launcher.content
+    assert 'cd "/usr/share/shop/frontend"\n' in launcher.content
+    launcher, = integrator({}, subdir='.').generate_rules_content()
+    assert launcher.name == 'bin/shop-node'
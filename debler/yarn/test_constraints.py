@@ -91,3 +91,9 @@ def test_merged_ors():
 
     assert parseConstraints('^2.0.0 || ^1.1.13') == \
         c.And([c.GreaterEqual('1.1.13'), c.LessThan('3')])
+
+
+def test_disjoint_ors():
+    assert parseConstraints('^1.2.3 || ^3.0.0') == \
+        c.Or([c.And([c.GreaterEqual('1.2.3'), c.LessThan('2')]),
+              c.And([c.GreaterEqual('3.0.0'), c.LessThan('4')])])
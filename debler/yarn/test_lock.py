@@ -1,8 +1,140 @@
+import io
+
 import pytest
 
-from debler.yarn.lock import YarnLockParser
+from debler.yarn.lock import YarnLockParser, hoist
 
 
 def test_error_on_empty_file():
     with pytest.raises(ValueError):
         YarnLockParser('')
+
+
+LOCK = '''# THIS IS AN AUTOGENERATED FILE. DO NOT EDIT THIS FILE DIRECTLY.
+# yarn lockfile v1
+
+
+"@babel/code-frame@^7.0.0", "@babel/code-frame@^7.8.3":
+  version "7.8.3"
+  resolved "https://registry.yarnpkg.com/@babel/code-frame/-/code-frame-7.8.3.tgz#33e25903d7481181534e12ec0a25f16b6fcf419e"
+  integrity sha512-a9gxpmdXtZEInkCSHUJDLHZVBgb1QS0jhss4cPP93EW7s+uC5bikET2twEF3KV+7rDblJcmNvTR7VJejqd2C2g==
+  dependencies:
+    "@babel/highlight" "^7.8.3"
+
+abbrev@1, abbrev@^1.0.0:
+  version "1.1.1"
+  resolved "https://registry.yarnpkg.com/abbrev/-/abbrev-1.1.1.tgz#f8f2c887ad10bf67f634f005b6987fed3179aac8"
+
+debug@2.6.9:
+  version "2.6.9"
+  resolved "https://registry.yarnpkg.com/debug/-/debug-2.6.9.tgz#5d128515df134ff327e90a4c93f4e077a536341f"
+  dependencies:
+    ms "2.0.0"
+  optionalDependencies:
+    fsevents "^1.2.7"
+
+debug@^4.1.0:
+  version "4.1.1"
+  resolved "https://registry.yarnpkg.com/debug/-/debug-4.1.1.tgz#3b72260255109c6b589cee050f1d516139664791"
+  dependencies:
+    ms "^2.1.1"
+'''
+
+
+def test_entries():
+    lock = YarnLockParser(LOCK)
+    assert [(p.name, p.version) for p in lock.pkgs] == [
+        ('@babel/code-frame', '7.8.3'), ('abbrev', '1.1.1'),
+        ('debug', '2.6.9'), ('debug', '4.1.1')]
+    babel = lock.pkgs[0]
+    assert babel.constraints == ['^7.0.0', '^7.8.3']
+    assert babel.dependencies == {'@babel/highlight': '^7.8.3'}
+    assert babel.integrity.startswith('sha512-')
+    assert lock.pkgs[2].optionalDependencies == {'fsevents': '^1.2.7'}
+
+
+def test_indexes():
+    lock = YarnLockParser(LOCK)
+    assert [p.version for p in lock.by_name['debug']] == ['2.6.9', '4.1.1']
+    assert lock.by_version[('abbrev', '1.1.1')].constraints == \
+        ['1', '^1.0.0']
+    assert lock.by_spec[('debug', '^4.1.0')].version == '4.1.1'
+    assert lock.by_spec[('@babel/code-frame', '^7.0.0')] is lock.pkgs[0]
+
+
+def test_line_iterable():
+    lock = YarnLockParser(io.StringIO(LOCK))
+    assert len(lock.pkgs) == 4
+
+
+def test_error_without_header():
+    with pytest.raises(ValueError):
+        YarnLockParser(LOCK.replace('# yarn lockfile v1', ''))
+
+
+HOIST_LOCK = '''# yarn lockfile v1
+
+
+a@^1.0.0:
+  version "1.0.0"
+  dependencies:
+    debug "^2.6.0"
+
+b@^1.0.0:
+  version "1.1.0"
+  dependencies:
+    a "^1.0.0"
+    ms "^2.1.0"
+
+debug@^2.6.0:
+  version "2.6.9"
+  dependencies:
+    ms "2.0.0"
+
+debug@^4.0.0:
+  version "4.1.1"
+  dependencies:
+    ms "^2.1.0"
+
+ms@2.0.0:
+  version "2.0.0"
+
+ms@^2.1.0:
+  version "2.1.2"
+'''
+
+
+def test_hoist_flat():
+    lock = YarnLockParser(HOIST_LOCK)
+    layout = hoist(lock, {'a': '^1.0.0'})
+    assert [(path, pkg.version) for path, pkg in layout.items()] == [
+        (('a', ), '1.0.0'), (('debug', ), '2.6.9'), (('ms', ), '2.0.0')]
+
+
+def test_hoist_nests_conflicts():
+    lock = YarnLockParser(HOIST_LOCK)
+    layout = hoist(lock, {'a': '^1.0.0', 'debug': '^4.0.0'})
+    assert [(path, pkg.version) for path, pkg in layout.items()] == [
+        (('a', ), '1.0.0'),
+        (('a', 'debug'), '2.6.9'),
+        (('a', 'debug', 'ms'), '2.0.0'),
+        (('debug', ), '4.1.1'),
+        (('ms', ), '2.1.2')]
+
+
+def test_hoist_reuses_visible_versions():
+    lock = YarnLockParser(HOIST_LOCK)
+    layout = hoist(lock, {'b': '^1.0.0', 'debug': '^4.0.0'})
+    assert [(path, pkg.version) for path, pkg in layout.items()] == [
+        (('a', ), '1.0.0'),
+        (('a', 'debug'), '2.6.9'),
+        (('a', 'debug', 'ms'), '2.0.0'),
+        (('b', ), '1.1.0'),
+        (('debug', ), '4.1.1'),
+        (('ms', ), '2.1.2')]
+
+
+def test_hoist_missing_spec():
+    lock = YarnLockParser(HOIST_LOCK)
+    with pytest.raises(ValueError):
+        hoist(lock, {'a': '^2.0.0'})